@@ -1,16 +1,39 @@
 import tkinter as tk
 from tkinter import messagebox
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import pyodbc # For MSSQL database connection
+from tkinter import filedialog # Destination of history exports
 import numpy as np # For statistical calculations
 from tkinter import font # Import the font module
 import re # Import the regular expression module for Sample ID validation
-
-# Global variables for the matplotlib figure and axes
-fig = None
-ax_bottom = None # Axis for Bottom Hardness
-ax_top = None    # Axis for Top Hardness
+from collections import deque # Fixed-length buffers of the most recent readings
+from datetime import datetime # Timestamps of readings added to the history store
+import hardness_db # Database helpers shared by the SQL Server and SQLite backends
+from hardness_db import TABLE_NAME
+from db_connection import ConnectionManager, DatabaseConnectionError # Warm, auto-reconnecting connection
+from background_worker import BackgroundWorker # Runs queries/inserts off the Tk mainloop thread
+from offline_journal import JournalFlusher, OfflineJournal, journal_entry_records, unwritten_entries # Durable local capture, flushed to the DB in batches
+from hardness_validation import ( # Input rules shared with the headless tools
+    HARDNESS_MAX, HARDNESS_MIN, INITIALS_MAX_LENGTH, INITIALS_MIN_LENGTH, SAMPLE_ID_PATTERN, normalize_initials,
+)
+from spc_rules import LOOKBACK, describe_violations, evaluate_new_points, violating_indices # Nelson rules
+from spc_subgroups import CHART_XBAR_R, CHART_XBAR_S, draw_subgroup_charts # X-bar/R and X-bar/S charts
+from history_chart import HistoryPyramid, HistoryRunChart # Downsampled full-history run charts
+from history_store import SIDES, HistoryStore # Compact typed columns of every saved reading
+import instrumentation # Timed spans per user action, exported as Prometheus text/JSON
+import export_history # Streaming CSV/Parquet/Arrow export of the saved readings
+import capability # Cp/Cpk/Pp/Ppk with bootstrap confidence intervals
+from collector_service import CollectorClient # Batched writes and shared limits through the collector service
+from history_query import HistoryFilter, HistoryQueryCache, fetch_page, fetch_statistics # Filtered queries, LRU cache
+from spc_statistics import (build_position_statistics_from_aggregates, position_control_limits, # Running SPC statistics
+                            side_statistics_from_positions, update_position_statistics, update_side_statistics,
+                            load_statistics_snapshot, save_statistics_snapshot)
+from spc_config import (DEFAULT_BOTTOM_LCL, DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, # Default and spec limits
+                        DEFAULT_TOP_LCL, DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, SPEC_LIMITS)
+from spc_modes import (MODES, MODE_CUMULATIVE, MODE_ROLLING, MODE_HISTORY_SAMPLES, # Rolling window/EWMA/CUSUM limits
+                       build_mode_states, update_mode_states)
+# matplotlib (the slowest import by far) is only imported once the window is up; see import_chart_modules()
+
+# Global variables for the matplotlib chart (figure with Bottom and Top axes) and its Tk widget
+_chart = None
 canvas_widget = None
 
 # Global variables to temporarily store data between "Display" and "Save" actions
@@ -18,6 +41,30 @@ _pending_records_to_save = []
 _current_displayed_bottom_values = []
 _current_displayed_top_values = []
 
+# Running count/mean/M2 per side, loaded once at startup and updated on each save
+_side_statistics = None
+_position_statistics = None # {(side, position): RunningStatistics} for the per-position limits
+_loading_statistics = False # True while the background load of the statistics is in flight
+_statistics_saves_while_loading = None # [(journal sequence, records)] saved while the statistics load, else None
+
+# Rolling window, EWMA and CUSUM state per side (restored at startup, updated on each save) and the selected mode
+_mode_states = None
+_limit_mode = MODE_CUMULATIVE
+
+# Last known limits from the previous session, shown until the fresh statistics arrive
+_snapshot_side_statistics = None
+_snapshot_position_statistics = None
+
+# Most recent saved values per side: the context the Nelson rules need for new readings
+_recent_values = {'Bottom': deque(maxlen=LOOKBACK), 'Top': deque(maxlen=LOOKBACK)}
+
+# Every reading in typed columns, loaded when a history window is first opened and extended on each save;
+# the run chart pyramids index its value columns in place
+_history_store = None
+_history_pyramids = None
+_history_saves_while_loading = None # [(journal sequence, records, timestamp)] while the store loads, else None
+_history_charts = [] # HistoryRunChart of every open history window
+
 # --- MSSQL Database Configuration ---
 # IMPORTANT: Replace these with your actual SQL Server details
 DB_CONFIG = {
@@ -27,84 +74,138 @@ DB_CONFIG = {
     'password': 'YOUR_PASSWORD'        # e.g., 'YourStrongPassword123'
 }
 
-TABLE_NAME = "HardnessReadings"
+# Database backend: hardness_db.BACKEND_MSSQL for the plant SQL Server, or
+# hardness_db.BACKEND_SQLITE to run against a local file without SQL Server
+DB_BACKEND = hardness_db.BACKEND_MSSQL
+SQLITE_DATABASE_PATH = "hardness_readings.db"
 
-# --- Default SPC Values for initial empty database scenario ---
-DEFAULT_TOP_UCL = 340.0
-DEFAULT_TOP_MEAN = 320.0
-DEFAULT_TOP_LCL = 300.0
+# Saved samples are written here first and pushed to the database in the background,
+# so saves never wait on (or get lost to) the network
+JOURNAL_PATH = "hardness_journal.jsonl"
 
-DEFAULT_BOTTOM_UCL = 340.0
-DEFAULT_BOTTOM_MEAN = 320.0
-DEFAULT_BOTTOM_LCL = 300.0
+# Optional collector service (collector_service.py), e.g. "http://collector-pc:8765". When set, journaled
+# samples are posted to it (it batches the writes of all stations) and the startup limits come from it;
+# None writes to and reads from the database directly
+COLLECTOR_URL = None
 
+# Span timings (connect/query/fetch/statistics/render/insert per action) are written here every
+# METRICS_EXPORT_INTERVAL_MS; F9 starts/stops a cProfile capture of the UI thread into PROFILE_PATH
+METRICS_PATH = "hardness_metrics.prom"
+METRICS_JSON_PATH = "hardness_metrics.json"
+METRICS_EXPORT_INTERVAL_MS = 10000
+PROFILE_PATH = "hardness_profile.prof"
 
-def connect_db():
-    """Establishes a connection to the MSSQL database."""
-    conn_str = (
-        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
-        f"SERVER={DB_CONFIG['server']};"
-        f"DATABASE={DB_CONFIG['database']};"
-        f"UID={DB_CONFIG['username']};"
-        f"PWD={DB_CONFIG['password']}"
-    )
-    try:
-        conn = pyodbc.connect(conn_str)
-        return conn
-    except pyodbc.Error as ex:
-        sqlstate = ex.args[0]
-        messagebox.showerror("Database Connection Error", f"Failed to connect to database: {sqlstate}\n{ex}")
-        return None
-
-def create_table_if_not_exists():
-    """Creates the HardnessReadings table if it does not exist."""
-    conn = connect_db()
-    if conn:
-        cursor = conn.cursor()
-        try:
-            # SQL to create table with columns: Technician Initials, Sample ID, Top/Bottom, Position, Hardness Value, Timestamp
-            # Using NVARCHAR for text fields and FLOAT for hardness value, DATETIME for timestamp
-            cursor.execute(f"""
-                IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{TABLE_NAME}' and xtype='U')
-                CREATE TABLE {TABLE_NAME} (
-                    ID INT PRIMARY KEY IDENTITY(1,1),
-                    TechnicianInitials NVARCHAR(50) NOT NULL,
-                    SampleID NVARCHAR(100) NOT NULL,
-                    TopOrBottom NVARCHAR(10) NOT NULL,
-                    Position INT NOT NULL,
-                    HardnessValue FLOAT NOT NULL,
-                    Timestamp DATETIME DEFAULT GETDATE()
-                ); -- Added semicolon
-            """)
-            conn.commit()
-            print(f"Table '{TABLE_NAME}' checked/created successfully.")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Failed to create table: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
-
-def get_all_hardness_values():
-    """Retrieves all historical hardness values from the database, separated by Top/Bottom."""
-    conn = connect_db()
-    bottom_hardness_values = []
-    top_hardness_values = []
-    if conn:
-        cursor = conn.cursor()
+# Per-position count/mean/std dev of the last session, so the charts start with the last known limits
+LIMITS_SNAPSHOT_PATH = "hardness_limits_snapshot.json"
+
+# Directory of the memory-mapped reading history, so the history window only reads the rows saved since; None to disable
+HISTORY_STORE_PATH = "hardness_history_store"
+
+CAPABILITY_RESAMPLES = 10000 # Bootstrap resamples for the confidence intervals
+HISTORY_QUERY_PAGE_SIZE = 200 # Readings per page of the history query window
+
+
+def open_db_connection():
+    """Opens a new connection to the configured database (MSSQL, or SQLite for local testing)."""
+    if DB_BACKEND == hardness_db.BACKEND_SQLITE:
+        return hardness_db.connect_sqlite(SQLITE_DATABASE_PATH)
+    return hardness_db.connect_mssql(DB_CONFIG)
+
+# Warm connection, journal, flusher and collector client; created by start_services() from main(), not on import,
+# so that processes re-importing this file (e.g. spawned capability workers) do not open or truncate the journal
+_db_manager = None
+_collector = None
+_journal = None
+_flusher = None
+
+# Database work runs on this worker thread so the Tk mainloop never blocks on the network
+_worker = BackgroundWorker()
+
+# Exports and capability analyses can take minutes on a large history; they get their own worker
+# and connection so saves, charts and the journal flusher are not held up behind them
+_long_task_worker = BackgroundWorker()
+
+# Pages and statistics of the history query window, so flipping between technicians is answered from memory
+_history_cache = HistoryQueryCache()
+
+def on_journal_written(entries):
+    """Runs on the flusher thread after a batch is committed: drops the cached queries the new readings belong to."""
+    _history_cache.invalidate([record for entry in entries for record in journal_entry_records(entry)])
+
+def start_services():
+    """
+    Creates the warm database connection (kept for the lifetime of the app instead of a new
+    login per operation), the collector client, the journal and its flusher (not started yet).
+    """
+    global _db_manager, _collector, _journal, _flusher
+    _db_manager = ConnectionManager(open_db_connection)
+    _collector = CollectorClient(COLLECTOR_URL) if COLLECTOR_URL else None
+    _journal = OfflineJournal(JOURNAL_PATH)
+    _flusher = JournalFlusher(_journal, _db_manager, on_written=on_journal_written,
+                              apply_entries=_collector.apply_journal_entries if _collector else None)
+
+def show_database_error(ex, message):
+    """
+    Shows the message box for an exception raised by a background database operation.
+
+    Args:
+        ex (Exception): The exception raised by the operation.
+        message (str): What was being attempted, e.g. "Failed to save data to MSSQL".
+    """
+    if isinstance(ex, DatabaseConnectionError):
+        messagebox.showerror("Database Connection Error", f"Failed to connect to database: {ex}")
+    else:
+        messagebox.showerror("Database Error", f"{message}: {ex}")
+
+def import_chart_modules():
+    """
+    Runs on the background worker right after the window is shown: imports matplotlib
+    and the chart modules, which take longer than building the whole entry form.
+    """
+    import chart_renderer # noqa: F401 (imported for its side effect of loading matplotlib)
+    import matplotlib.backends.backend_tkagg # noqa: F401
+
+@instrumentation.traced_action('startup')
+def load_startup_data():
+    """
+    Runs on the background worker: creates the tables if they do not exist, writes any
+    samples left in the journal by an earlier session, and reads the COUNT/AVG/STDEV
+    per Top/Bottom and Position computed by the database server. The statistics and the
+    journal are read under the flusher's write lock, so no sample can be committed in
+    between and be counted twice or not at all.
+
+    Returns:
+        tuple: (aggregates, recent_values, recent_summaries, entries, sequence) where aggregates is
+        {(side, position): (count, mean, std_dev)}, recent_values is {side: [values]} (oldest first),
+        recent_summaries the last samples' {side: [(size, mean, std_dev)]} for the limit modes,
+        entries the journaled samples not in them yet and sequence the journal's `appended`
+        count at that point. With a collector service, the first three come from it instead of the database.
+    """
+    if _collector is not None:
         try:
-            cursor.execute(f"SELECT HardnessValue, TopOrBottom FROM {TABLE_NAME} ORDER BY Timestamp ASC;") # Added semicolon
-            for row in cursor.fetchall():
-                value, category = row
-                if category == 'Bottom':
-                    bottom_hardness_values.append(value)
-                elif category == 'Top':
-                    top_hardness_values.append(value)
-            print(f"Retrieved {len(bottom_hardness_values)} historical Bottom values and {len(top_hardness_values)} historical Top values.")
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Failed to retrieve historical data: {e}")
-        finally:
-            conn.close()
-    return bottom_hardness_values, top_hardness_values
+            _flusher.flush_once()
+        except Exception as e: # Keep loading the limits; the flusher thread retries later
+            print(f"Journal flush failed during startup: {e}")
+        with _flusher.write_lock:
+            aggregates, recent_values, recent_summaries = _collector.fetch_limits()
+            entries, sequence = _journal.snapshot()
+        return aggregates, recent_values, recent_summaries, entries, sequence
+    _db_manager.run(hardness_db.create_table)
+    _db_manager.run(hardness_db.create_journal_table)
+    print(f"Table '{TABLE_NAME}' checked/created successfully.")
+    try:
+        _flusher.flush_once()
+    except Exception as e: # Keep loading the limits; the flusher thread retries later
+        print(f"Journal flush failed during startup: {e}")
+    with _flusher.write_lock:
+        # One grouped query serves both limits: the side statistics are merged from the 12 position groups
+        aggregates = _db_manager.run(lambda conn: hardness_db.fetch_control_limit_aggregates(conn, by_position=True))
+        recent_values = _db_manager.run(lambda conn: hardness_db.fetch_recent_values(conn, LOOKBACK))
+        recent_summaries = _db_manager.run(lambda conn: hardness_db.fetch_recent_sample_summaries(conn, MODE_HISTORY_SAMPLES))
+        entries, sequence = _journal.snapshot()
+        if entries:
+            entries = _db_manager.run(lambda conn: unwritten_entries(conn, entries))
+    return aggregates, recent_values, recent_summaries, entries, sequence
 
 def calculate_control_limits(data):
     """
@@ -129,36 +230,125 @@ def calculate_control_limits(data):
 
     return mean_val, ucl, lcl
 
+def apply_control_limit_aggregates(aggregates):
+    """Builds the running per-position and Top/Bottom statistics from the server-side aggregates."""
+    global _side_statistics, _position_statistics
+    print(f"Retrieved control limit aggregates: {aggregates}")
+    _position_statistics = build_position_statistics_from_aggregates(aggregates)
+    _side_statistics = side_statistics_from_positions(_position_statistics)
+
+def fold_saved_records(records):
+    """Folds saved readings into the limit mode states and the running side and position statistics."""
+    if _mode_states is not None:
+        update_mode_states(_mode_states, records, _side_statistics) # Against the baseline before these readings
+    update_side_statistics(_side_statistics, records)
+    update_position_statistics(_position_statistics, records)
+
+def get_position_control_limits():
+    """
+    Returns each position's own mean, UCL and LCL (from the last session's snapshot while
+    the history is loading), or None for both sides if neither is available. Positions
+    without enough data have None limits.
 
-def create_plot_area():
+    Returns:
+        tuple: (bottom_position_limits, top_position_limits), each (means, ucls, lcls) in position order.
     """
-    Creates and embeds the matplotlib plot area into the Tkinter window.
-    Initializes two empty plots: one for Bottom and one for Top hardness.
+    position_statistics = _position_statistics if _position_statistics is not None else _snapshot_position_statistics
+    if position_statistics is None:
+        return None, None
+    return (position_control_limits(position_statistics, 'Bottom'),
+            position_control_limits(position_statistics, 'Top'))
+
+def get_current_control_limits():
+    """
+    Returns the current SPC limits from the running statistics (or, while they are
+    loading, the last session's snapshot), falling back to the default values for a
+    side that does not have enough data yet. In the rolling window mode the limits
+    come from the last samples only.
+
+    Returns:
+        tuple: (mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top)
+    """
+    side_statistics = _side_statistics if _side_statistics is not None else _snapshot_side_statistics
+    if _limit_mode == MODE_ROLLING and _mode_states is not None:
+        side_statistics = {side: state.window_statistics() for side, state in _mode_states.items()}
+    if side_statistics is None: # History not loaded (yet) and no snapshot; fall back to the defaults
+        mean_bottom, ucl_bottom, lcl_bottom = None, None, None
+        mean_top, ucl_top, lcl_top = None, None, None
+    else:
+        mean_bottom, ucl_bottom, lcl_bottom = side_statistics['Bottom'].control_limits()
+        mean_top, ucl_top, lcl_top = side_statistics['Top'].control_limits()
+
+    if ucl_bottom is None:
+        mean_bottom, ucl_bottom, lcl_bottom = DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, DEFAULT_BOTTOM_LCL
+        print("Using default Bottom SPC limits.") # For debugging
+
+    if ucl_top is None:
+        mean_top, ucl_top, lcl_top = DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, DEFAULT_TOP_LCL
+        print("Using default Top SPC limits.") # For debugging
+
+    return mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top
+
+def get_mode_overlays(current_bottom_values=(), current_top_values=()):
     """
-    global fig, ax_bottom, ax_top, canvas_widget
+    Returns the EWMA or CUSUM overlay of each side for the selected limit mode, including
+    the displayed readings as the next sample, or None where the mode has none (yet).
 
-    # Create a matplotlib figure with two subplots (2 rows, 1 column)
-    # Changed figsize height from 8 to 4 (half as tall)
-    fig, (ax_bottom, ax_top) = plt.subplots(2, 1, figsize=(6, 4))
+    Returns:
+        tuple: (bottom_overlay, top_overlay), each (mode, center, ucl, lcl, statistic_values) or None.
+    """
+    if _mode_states is None or _side_statistics is None:
+        return None, None
+    overlays = []
+    for side, current_values in (('Bottom', current_bottom_values), ('Top', current_top_values)):
+        overlay = _mode_states[side].overlay(_limit_mode, _side_statistics[side], current_values)
+        overlays.append(None if overlay is None else (_limit_mode,) + overlay)
+    return tuple(overlays)
+
+def on_limit_mode_changed(mode):
+    """Redraws the chart with the newly selected limit mode (from state kept in memory, no query)."""
+    global _limit_mode
+    _limit_mode = mode
+    if _chart is None:
+        return
+    mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top = get_current_control_limits()
+    bottom_position_limits, top_position_limits = get_position_control_limits()
+    bottom_mode_overlay, top_mode_overlay = get_mode_overlays(_current_displayed_bottom_values, _current_displayed_top_values)
+    bottom_violations, top_violations = (), ()
+    if _current_displayed_bottom_values and _current_displayed_top_values:
+        # The Nelson rules depend on the limits, so the circled readings may change with the mode
+        bottom_violations = violating_indices(evaluate_new_points(_recent_values['Bottom'], _current_displayed_bottom_values,
+                                                                  mean_bottom, (ucl_bottom - mean_bottom) / 3)).tolist()
+        top_violations = violating_indices(evaluate_new_points(_recent_values['Top'], _current_displayed_top_values,
+                                                               mean_top, (ucl_top - mean_top) / 3)).tolist()
+    update_plot(_current_displayed_bottom_values, _current_displayed_top_values,
+                mean_bottom, ucl_bottom, lcl_bottom,
+                mean_top, ucl_top, lcl_top,
+                bottom_violations=bottom_violations, top_violations=top_violations,
+                bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
+    for chart in _history_charts:
+        chart.set_limits('Bottom', mean_bottom, ucl_bottom, lcl_bottom)
+        chart.set_limits('Top', mean_top, ucl_top, lcl_top)
+        chart.refresh()
 
-    # Configure Bottom Hardness plot
-    ax_bottom.set_title('Bottom Hardness Readings')
-    ax_bottom.set_xlabel('Position')
-    ax_bottom.set_ylabel('Hardness - BHN') # Updated label
-    ax_bottom.grid(True)
-    ax_bottom.set_ylim(bottom=0) # Ensure y-axis starts from 0 or a reasonable minimum
 
-    # Configure Top Hardness plot
-    ax_top.set_title('Top Hardness Readings')
-    ax_top.set_xlabel('Position')
-    ax_top.set_ylabel('Hardness - BHN') # Updated label
-    ax_top.grid(True)
-    ax_top.set_ylim(bottom=0) # Ensure y-axis starts from 0 or a reasonable minimum
+def create_plot_area():
+    """
+    Creates and embeds the matplotlib plot area into the Tkinter window.
+    Initializes two empty plots: one for Bottom and one for Top hardness.
+    """
+    global _chart, canvas_widget
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg # Deferred: see import_chart_modules()
+    from chart_renderer import ChartRenderer # Artist-reusing Bottom/Top chart
 
-    fig.tight_layout(pad=3.0) # Adjust layout to prevent titles/labels from overlapping
+    # Two subplots (Bottom over Top) whose artists are created once and reused on every update
+    _chart = ChartRenderer(figsize=(6, 4))
 
     # Embed the matplotlib figure into the Tkinter window
-    canvas = FigureCanvasTkAgg(fig, master=root)
+    canvas = FigureCanvasTkAgg(_chart.fig, master=root)
+    canvas.draw = instrumentation.traced('draw', canvas.draw) # Also times the deferred draw_idle() renders
+    _chart.connect_canvas() # Re-run the layout only when the canvas is resized
     canvas_widget = canvas.get_tk_widget()
     # Place the canvas below the input fields and button
     canvas_widget.grid(row=root.grid_size()[1], column=0, columnspan=num_display_columns, padx=10, pady=10, sticky="nsew")
@@ -166,7 +356,10 @@ def create_plot_area():
 
 def update_plot(current_bottom_values, current_top_values,
                 mean_bottom, ucl_bottom, lcl_bottom,
-                mean_top, ucl_top, lcl_top):
+                mean_top, ucl_top, lcl_top,
+                bottom_violations=(), top_violations=(),
+                bottom_position_limits=None, top_position_limits=None,
+                bottom_mode_overlay=None, top_mode_overlay=None):
     """
     Updates the two line graphs with the new hardness values and separate control limits.
 
@@ -179,81 +372,26 @@ def update_plot(current_bottom_values, current_top_values,
         mean_top (float): The calculated mean for Top values.
         ucl_top (float): The calculated UCL for Top values.
         lcl_top (float): The calculated LCL for Top values.
+        bottom_violations (list): Indices of current Bottom values that break a Nelson rule.
+        top_violations (list): Indices of current Top values that break a Nelson rule.
+        bottom_position_limits (tuple): (means, ucls, lcls) of each Bottom position, or None.
+        top_position_limits (tuple): (means, ucls, lcls) of each Top position, or None.
+        bottom_mode_overlay (tuple): EWMA/CUSUM overlay of the Bottom side (see get_mode_overlays()), or None.
+        top_mode_overlay (tuple): EWMA/CUSUM overlay of the Top side, or None.
     """
-    global ax_bottom, ax_top, fig
-
-    if ax_bottom is None or ax_top is None:
+    if _chart is None:
         create_plot_area() # Recreate if not initialized (shouldn't happen)
 
-    # Clear previous plots
-    ax_bottom.clear()
-    ax_top.clear()
-
-    # X-axis labels for positions 1-6
-    x_labels = [f"{i+1}" for i in range(6)]
-    x_positions = range(6)
-
-    # --- Plot for Bottom Hardness ---
-    ax_bottom.plot(x_positions, current_bottom_values, marker='o', linestyle='-', color='skyblue', label='Current Reading')
-    ax_bottom.set_title('Bottom Hardness Readings')
-    ax_bottom.set_xlabel('Position')
-    ax_bottom.set_ylabel('Hardness - BHN') # Updated label
-    ax_bottom.grid(True)
-
-    # Add control limits and mean to Bottom plot if available
-    if ucl_bottom is not None and lcl_bottom is not None:
-        ax_bottom.axhline(y=mean_bottom, color='blue', linestyle=':', label=f'Mean ({mean_bottom:.2f})')
-        ax_bottom.axhline(y=ucl_bottom, color='red', linestyle='--', label=f'UCL ({ucl_bottom:.2f})')
-        ax_bottom.axhline(y=lcl_bottom, color='red', linestyle='--', label=f'LCL ({lcl_bottom:.2f})')
-        ax_bottom.legend(loc='best') # Add a legend for the lines
-
-    # Adjust y-limits for Bottom plot based on its data and limits
-    # Include current values and its specific control limits for y-axis scaling
-    all_bottom_data_for_ylim = list(current_bottom_values)
-    if ucl_bottom is not None:
-        all_bottom_data_for_ylim.extend([ucl_bottom, lcl_bottom, mean_bottom])
-    if all_bottom_data_for_ylim:
-        min_val_bottom = min(all_bottom_data_for_ylim)
-        max_val_bottom = max(all_bottom_data_for_ylim)
-        padding_bottom = (max_val_bottom - min_val_bottom) * 0.1 if (max_val_bottom - min_val_bottom) > 0 else 1
-        ax_bottom.set_ylim(min(0, min_val_bottom - padding_bottom), max_val_bottom + padding_bottom)
-    else:
-        # Default y-limits if no data or limits to display
-        ax_bottom.set_ylim(DEFAULT_BOTTOM_LCL - 10, DEFAULT_BOTTOM_UCL + 10)
-
-
-    # --- Plot for Top Hardness ---
-    ax_top.plot(x_positions, current_top_values, marker='o', linestyle='-', color='lightcoral', label='Current Reading')
-    ax_top.set_title('Top Hardness Readings')
-    ax_top.set_xlabel('Position')
-    ax_top.set_ylabel('Hardness - BHN') # Updated label
-    ax_top.grid(True)
-
-    # Add control limits and mean to Top plot if available
-    if ucl_top is not None and lcl_top is not None:
-        ax_top.axhline(y=mean_top, color='blue', linestyle=':', label=f'Mean ({mean_top:.2f})')
-        ax_top.axhline(y=ucl_top, color='red', linestyle='--', label=f'UCL ({ucl_top:.2f})')
-        ax_top.axhline(y=lcl_top, color='red', linestyle='--', label=f'LCL ({lcl_top:.2f})')
-        ax_top.legend(loc='best') # Add a legend for the lines
-
-    # Adjust y-limits for Top plot based on its data and limits
-    all_top_data_for_ylim = list(current_top_values)
-    if ucl_top is not None:
-        all_top_data_for_ylim.extend([ucl_top, lcl_top, mean_top])
-    if all_top_data_for_ylim:
-        min_val_top = min(all_top_data_for_ylim)
-        max_val_top = max(all_top_data_for_ylim)
-        padding_top = (max_val_top - min_val_top) * 0.1 if (max_val_top - min_val_top) > 0 else 1
-        ax_top.set_ylim(min(0, min_val_top - padding_top), max_val_top + padding_top)
-    else:
-        # Default y-limits if no data or limits to display
-        ax_top.set_ylim(DEFAULT_TOP_LCL - 10, DEFAULT_TOP_UCL + 10)
-
-
-    fig.tight_layout(pad=3.0) # Adjust layout again after plotting
-    fig.canvas.draw() # Redraw the canvas with the updated plots
+    with instrumentation.span('render'):
+        _chart.update(current_bottom_values, current_top_values,
+                      mean_bottom, ucl_bottom, lcl_bottom,
+                      mean_top, ucl_top, lcl_top,
+                      bottom_violations=bottom_violations, top_violations=top_violations,
+                      bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                      bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
 
 
+@instrumentation.traced_action('display')
 def display_on_graph():
     """
     Retrieves data from all input fields, validates it, and updates the graphs
@@ -267,19 +405,19 @@ def display_on_graph():
     _current_displayed_top_values = []
 
     # Get the values from all input fields
-    technician_initials = entry_technician_initials.get().strip()
+    technician_initials = normalize_initials(entry_technician_initials.get()) # Saved in upper case; matched in any case
     sample_id = entry_sample_id.get().strip()
     bottom_hardness_raw = [entry_bottom_hardness[i].get().strip() for i in range(6)]
     top_hardness_raw = [entry_top_hardness[i].get().strip() for i in range(6)]
 
     # Basic validation for Technician Initials length
-    if not (2 <= len(technician_initials) <= 4):
+    if not (INITIALS_MIN_LENGTH <= len(technician_initials) <= INITIALS_MAX_LENGTH):
         messagebox.showerror("Input Error", "Tech Initials must be between 2 and 4 characters long.")
         button_save_to_db['state'] = tk.DISABLED
         return
     
     # Validation for Sample ID format: three chars, hyphen, two chars (e.g., 123-ab)
-    sample_id_pattern = re.compile(r"^.{3}-.{2}$")
+    sample_id_pattern = re.compile(SAMPLE_ID_PATTERN)
     if not sample_id_pattern.match(sample_id):
         messagebox.showerror("Input Error", "Sample ID must be in the format 'XXX-YY' (e.g., '123-ab').")
         button_save_to_db['state'] = tk.DISABLED
@@ -294,7 +432,7 @@ def display_on_graph():
         try:
             hardness_value = float(val_str)
             # Hardness value range validation
-            if not (100 <= hardness_value <= 500):
+            if not (HARDNESS_MIN <= hardness_value <= HARDNESS_MAX):
                 messagebox.showerror("Input Error", f"Bottom {i+1} Hardness must be between 100 and 500.")
                 button_save_to_db['state'] = tk.DISABLED
                 return
@@ -315,7 +453,7 @@ def display_on_graph():
         try:
             hardness_value = float(val_str)
             # Hardness value range validation
-            if not (100 <= hardness_value <= 500):
+            if not (HARDNESS_MIN <= hardness_value <= HARDNESS_MAX):
                 messagebox.showerror("Input Error", f"Top {i+1} Hardness must be between 100 and 500.")
                 button_save_to_db['state'] = tk.DISABLED
                 return
@@ -327,36 +465,45 @@ def display_on_graph():
             button_save_to_db['state'] = tk.DISABLED
             return
 
-    # --- Retrieve All Data and Calculate/Set Plots with separate SPC limits ---
-    all_historical_bottom_values, all_historical_top_values = get_all_hardness_values()
-
-    # Calculate limits for Bottom
-    mean_bottom, ucl_bottom, lcl_bottom = calculate_control_limits(all_historical_bottom_values)
-    # If no data or not enough data, use default values
-    if ucl_bottom is None:
-        mean_bottom, ucl_bottom, lcl_bottom = DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, DEFAULT_BOTTOM_LCL
-        print("Using default Bottom SPC limits.") # For debugging
-
-    # Calculate limits for Top
-    mean_top, ucl_top, lcl_top = calculate_control_limits(all_historical_top_values)
-    # If no data or not enough data, use default values
-    if ucl_top is None:
-        mean_top, ucl_top, lcl_top = DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, DEFAULT_TOP_LCL
-        print("Using default Top SPC limits.") # For debugging
+    # --- Calculate/Set Plots with separate SPC limits from the running statistics ---
+    with instrumentation.span('statistics'):
+        mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top = get_current_control_limits()
+        bottom_position_limits, top_position_limits = get_position_control_limits()
+        bottom_mode_overlay, top_mode_overlay = get_mode_overlays(_current_displayed_bottom_values,
+                                                                  _current_displayed_top_values)
 
+        # Check the new readings (in the context of the latest saved ones) against the Nelson rules
+        bottom_rule_results = evaluate_new_points(_recent_values['Bottom'], _current_displayed_bottom_values,
+                                                  mean_bottom, (ucl_bottom - mean_bottom) / 3)
+        top_rule_results = evaluate_new_points(_recent_values['Top'], _current_displayed_top_values,
+                                               mean_top, (ucl_top - mean_top) / 3)
 
     update_plot(_current_displayed_bottom_values, _current_displayed_top_values,
                 mean_bottom, ucl_bottom, lcl_bottom,
-                mean_top, ucl_top, lcl_top)
-
-    messagebox.showinfo("Display Success", "Data displayed on graph. Please review before saving to database.")
+                mean_top, ucl_top, lcl_top,
+                bottom_violations=violating_indices(bottom_rule_results).tolist(),
+                top_violations=violating_indices(top_rule_results).tolist(),
+                bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
+
+    violation_lines = (describe_violations(bottom_rule_results, [f"Bottom {i+1}" for i in range(6)])
+                       + describe_violations(top_rule_results, [f"Top {i+1}" for i in range(6)]))
+    if violation_lines:
+        messagebox.showwarning("Out-of-Control Pattern",
+                               "Data displayed on graph. The circled readings break SPC rules:\n\n" + "\n".join(violation_lines)
+                               + "\n\nPlease review before saving to database.")
+    else:
+        messagebox.showinfo("Display Success", "Data displayed on graph. Please review before saving to database.")
     # Enable the save button once all validations pass and data is prepared for saving
     button_save_to_db['state'] = tk.NORMAL
 
 
+@instrumentation.traced_action('save')
 def save_to_database():
     """
-    Saves the currently displayed data (stored in _pending_records_to_save) to the MSSQL database.
+    Saves the currently displayed data (stored in _pending_records_to_save). The records are
+    written durably to the local journal right away; the journal flusher thread then writes
+    them to the MSSQL database in the background.
     """
     global _pending_records_to_save, _current_displayed_bottom_values, _current_displayed_top_values
 
@@ -364,195 +511,744 @@ def save_to_database():
         messagebox.showwarning("Save Error", "No data to save. Please display on graph first.")
         return
 
-    # --- Database Insertion ---
-    conn = connect_db()
-    if conn:
-        cursor = conn.cursor()
+    records = list(_pending_records_to_save)
+    timestamp = datetime.now().replace(microsecond=0) # As journaled
+    try:
+        _journal.append(records, timestamp)
+        sequence = _journal.appended # Tells the history load whether its journal snapshot included this save
+    except OSError as e:
+        messagebox.showerror("Save Error", f"Failed to record data locally: {e}\nData not saved.")
+        return
+    _flusher.flush_soon() # Write to the database now rather than at the next flush interval
+
+    messagebox.showinfo("Database Save", f"Successfully saved {len(records)} records. They are written to MSSQL in the background.")
+    print(f"Saved records: {records}")
+
+    # Clear the input fields after successful saving
+    entry_technician_initials.delete(0, tk.END)
+    entry_sample_id.delete(0, tk.END)
+    for i in range(6):
+        entry_bottom_hardness[i].delete(0, tk.END)
+        entry_top_hardness[i].delete(0, tk.END)
+
+    if _side_statistics is not None:
+        # Fold the saved readings into the running statistics instead of re-reading the history
+        with instrumentation.span('statistics'):
+            fold_saved_records(records)
+            extend_recent_values(records)
+    elif not _loading_statistics:
+        # The startup load failed, so there is nothing to fold into; try loading the history again.
+        # (This sample is journaled before the load reads the journal, so it is picked up from there.)
+        start_loading_statistics()
+    else:
+        _statistics_saves_while_loading.append((sequence, records)) # Folded by on_startup_data_loaded()
+    extend_history(records, timestamp, sequence)
+
+    # Clear temporary data storage after saving
+    _pending_records_to_save = []
+    _current_displayed_bottom_values = []
+    _current_displayed_top_values = []
+
+    # Recalculate limits with the new data, then apply defaults if still insufficient
+    # (current plot values will be empty lists since input fields are cleared)
+    mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top = get_current_control_limits()
+    bottom_position_limits, top_position_limits = get_position_control_limits()
+    bottom_mode_overlay, top_mode_overlay = get_mode_overlays()
+
+    update_plot([], [], # Pass empty lists for current values since fields are cleared
+                mean_bottom, ucl_bottom, lcl_bottom,
+                mean_top, ucl_top, lcl_top,
+                bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
+
+    button_save_to_db['state'] = tk.DISABLED # Disable save button after successful save
+
+def open_subgroup_charts():
+    """
+    Opens a window with X-bar/R or X-bar/S charts of the saved samples. The per-sample
+    summaries are read on the background worker and the charts drawn when they arrive.
+    """
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+    from matplotlib.figure import Figure
+
+    window = tk.Toplevel(root)
+    window.title("Subgroup Charts")
+    window.geometry("900x650")
+    chart_type = tk.StringVar(value=CHART_XBAR_R)
+    summaries = {}
+
+    figure = Figure(figsize=(9, 6))
+    chart_canvas = FigureCanvasTkAgg(figure, master=window)
+
+    def redraw():
+        if summaries:
+            draw_subgroup_charts(figure, summaries, chart_type.get())
+            chart_canvas.draw_idle()
+
+    options_frame = tk.Frame(window)
+    options_frame.pack(side=tk.TOP, pady=5)
+    tk.Radiobutton(options_frame, text="X-bar / R", variable=chart_type, value=CHART_XBAR_R,
+                   command=redraw, font=label_font).pack(side=tk.LEFT, padx=10)
+    tk.Radiobutton(options_frame, text="X-bar / S", variable=chart_type, value=CHART_XBAR_S,
+                   command=redraw, font=label_font).pack(side=tk.LEFT, padx=10)
+    chart_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+    def on_loaded(result):
+        summaries.update(result)
+        if window.winfo_exists():
+            redraw()
+
+    _worker.submit(lambda: _db_manager.run(hardness_db.fetch_sample_summaries),
+                   on_success=on_loaded,
+                   on_error=lambda ex: show_database_error(ex, "Failed to retrieve sample summaries"))
+
+def load_history_store():
+    """
+    Runs on the worker: loads the history store and appends the journaled samples that
+    are not in the database yet. Both are read under the flusher's write lock, so no
+    sample can be committed in between and end up twice or not at all.
+
+    Returns:
+        tuple: (store, sequence) where sequence is the journal's `appended` count at the
+        snapshot; saves with a larger count came later and are not in the store.
+    """
+    with _flusher.write_lock:
+        store = _db_manager.run(lambda conn: HistoryStore.load_or_fetch(conn, HISTORY_STORE_PATH))
+        entries, sequence = _journal.snapshot()
+        if entries:
+            entries = _db_manager.run(lambda conn: unwritten_entries(conn, entries))
+    for entry in entries:
+        store.append(journal_entry_records(entry))
+    return store, sequence
+
+def open_history_chart():
+    """
+    Opens a window with zoomable run charts of every saved Bottom and Top reading. The
+    history is read once on the background worker; afterwards saves extend it in place.
+    """
+    global _history_saves_while_loading
+    from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+    from matplotlib.figure import Figure
+
+    window = tk.Toplevel(root)
+    window.title("Hardness History")
+    window.geometry("1000x650")
+    figure = Figure(figsize=(10, 6))
+    chart_canvas = FigureCanvasTkAgg(figure, master=window)
+    toolbar = NavigationToolbar2Tk(chart_canvas, window) # Pan/zoom; every x-range change re-downsamples
+    toolbar.update()
+    chart_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+
+    def show_chart():
+        if not window.winfo_exists():
+            return
+        chart = HistoryRunChart(figure, _history_pyramids)
+        mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top = get_current_control_limits()
+        chart.set_limits('Bottom', mean_bottom, ucl_bottom, lcl_bottom)
+        chart.set_limits('Top', mean_top, ucl_top, lcl_top)
+        chart.refresh()
+        _history_charts.append(chart)
+
+        def on_destroy(event):
+            if event.widget is window and chart in _history_charts: # <Destroy> also fires for every child widget
+                _history_charts.remove(chart)
+        window.bind("<Destroy>", on_destroy)
+
+    def on_loaded(result):
+        global _history_store, _history_pyramids, _history_saves_while_loading
+        if _history_pyramids is None:
+            store, sequence = result
+            # Saves journaled after the load's snapshot of the journal are in neither part of it
+            for saved_sequence, records, timestamp in _history_saves_while_loading or []:
+                if saved_sequence > sequence:
+                    store.append(records, timestamp)
+            _history_saves_while_loading = None
+            _history_store = store
+            _history_pyramids = {side: HistoryPyramid(column=store.value_column(side)) for side in SIDES}
+        show_chart()
+
+    def on_failed(ex):
+        global _history_saves_while_loading
+        if _history_pyramids is None:
+            _history_saves_while_loading = None
+        show_database_error(ex, "Failed to retrieve hardness history")
+
+    if _history_pyramids is not None:
+        show_chart()
+    else:
+        if _history_saves_while_loading is None:
+            _history_saves_while_loading = []
+        _worker.submit(load_history_store, on_success=on_loaded, on_error=on_failed)
+
+def run_export(path, filters):
+    """Runs on the export worker: streams the filtered readings to path over a dedicated connection."""
+    conn = open_db_connection()
+    try:
+        return export_history.export_history(conn, path, **filters)
+    finally:
+        conn.close()
+
+def open_export_dialog():
+    """
+    Opens a window for exporting the saved readings (with technician, sample and
+    timestamp) to CSV, Parquet or Arrow, optionally filtered by date, technician and sample.
+    """
+    window = tk.Toplevel(root)
+    window.title("Export History")
+    fields = {}
+    for row, (key, text) in enumerate((('start', "From (YYYY-MM-DD[ HH:MM]):"), ('end', "To, excluding (YYYY-MM-DD[ HH:MM]):"),
+                                       ('technician', "Tech Initials:"), ('sample_id', "Sample ID (* = any):"))):
+        tk.Label(window, text=text, font=label_font).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+        fields[key] = tk.Entry(window, width=20, font=label_font)
+        fields[key].grid(row=row, column=1, padx=5, pady=2, sticky="ew")
+    status_label = tk.Label(window, text="", font=label_font)
+    status_label.grid(row=5, column=0, columnspan=2, padx=5, pady=(0, 5))
+
+    def start_export():
+        filters = {key: entry.get().strip() or None for key, entry in fields.items()}
+        for key in ('start', 'end'):
+            if filters[key] is not None:
+                try:
+                    filters[key] = export_history.parse_timestamp(filters[key])
+                except ValueError:
+                    messagebox.showerror("Input Error", "Dates must be in the format 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'.",
+                                         parent=window)
+                    return
+        path = filedialog.asksaveasfilename(parent=window, defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("Parquet", "*.parquet"), ("Arrow", "*.arrow")])
+        if not path:
+            return
+        button_export['state'] = tk.DISABLED
+        status_label.config(text="Exporting...")
+
+        def on_done(count):
+            if window.winfo_exists():
+                button_export['state'] = tk.NORMAL
+                status_label.config(text="")
+            messagebox.showinfo("Export Complete", f"Exported {count} readings to {path}.")
+
+        def on_failed(ex):
+            if window.winfo_exists():
+                button_export['state'] = tk.NORMAL
+                status_label.config(text="")
+            if isinstance(ex, hardness_db.DATABASE_ERRORS):
+                show_database_error(ex, "Failed to export the readings")
+            else:
+                messagebox.showerror("Export Error", f"Failed to export the readings: {ex}")
+
+        _long_task_worker.submit(lambda: run_export(path, filters), on_success=on_done, on_error=on_failed)
+
+    button_export = tk.Button(window, text="Export...", command=start_export, font=label_font)
+    button_export.grid(row=4, column=0, columnspan=2, padx=5, pady=10)
+
+def run_capability_analysis(spec_limits, resamples):
+    """Runs on the long-task worker: reads every sample over a dedicated connection and analyzes it."""
+    conn = open_db_connection()
+    try:
+        # Samples still in the journal are not in the database yet. Reading both under the flusher's
+        # write lock keeps a sample from being committed in between (counted twice or not at all).
+        with _flusher.write_lock:
+            matrix = hardness_db.fetch_sample_matrix(conn)
+            entries = unwritten_entries(conn, _journal.pending())
+    finally:
+        conn.close()
+    pending_records = [tuple(record) for entry in entries for record in entry['records']]
+    if pending_records:
+        pending_rows = [row[2:] for row in hardness_db.readings_to_wide_rows(pending_records)]
+        matrix = np.vstack([matrix, np.array(pending_rows, dtype=np.float64)])
+    return capability.analyze_capability(matrix, spec_limits, resamples)
+
+def open_capability_dialog():
+    """
+    Opens a window for the capability analysis (Cp/Cpk/Pp/Ppk with bootstrap confidence
+    intervals) of Bottom, Top and every position against editable spec limits.
+    """
+    window = tk.Toplevel(root)
+    window.title("Process Capability")
+    window.geometry("1100x500")
+    limits_frame = tk.Frame(window)
+    limits_frame.pack(side=tk.TOP, pady=5)
+    limit_entries = {}
+    for row, side in enumerate(('Bottom', 'Top')):
+        tk.Label(limits_frame, text=f"{side} LSL:", font=label_font).grid(row=row, column=0, padx=5, pady=2, sticky="w")
+        tk.Label(limits_frame, text="USL:", font=label_font).grid(row=row, column=2, padx=5, pady=2, sticky="w")
+        for column, value in ((1, SPEC_LIMITS[side][0]), (3, SPEC_LIMITS[side][1])):
+            entry = tk.Entry(limits_frame, width=8, font=label_font)
+            entry.insert(0, "" if value is None else f"{value:g}")
+            entry.grid(row=row, column=column, padx=5, pady=2)
+            limit_entries[(side, column)] = entry
+    report_text = tk.Text(window, font=("Courier", 10), wrap=tk.NONE)
+
+    def start_analysis():
+        spec_limits = {}
         try:
-            insert_sql = f"""
-                INSERT INTO {TABLE_NAME} (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue)
-                VALUES (?, ?, ?, ?, ?); -- Added semicolon
-            """
-            cursor.executemany(insert_sql, _pending_records_to_save)
-            conn.commit()
-            messagebox.showinfo("Database Save", f"Successfully saved {len(_pending_records_to_save)} records to MSSQL.")
-            print(f"Saved records: {_pending_records_to_save}")
-
-            # Clear the input fields after successful saving
-            entry_technician_initials.delete(0, tk.END)
-            entry_sample_id.delete(0, tk.END)
-            for i in range(6):
-                entry_bottom_hardness[i].delete(0, tk.END)
-                entry_top_hardness[i].delete(0, tk.END)
-
-            # Clear temporary data storage after saving
-            _pending_records_to_save = []
-            _current_displayed_bottom_values = []
-            _current_displayed_top_values = []
-
-            # Re-fetch all historical data and update plots to reflect new limits
-            # (current plot values will be empty lists since input fields are cleared)
-            all_historical_bottom_values, all_historical_top_values = get_all_hardness_values()
-            
-            # Recalculate limits with potentially new data, then apply defaults if still insufficient
-            mean_bottom, ucl_bottom, lcl_bottom = calculate_control_limits(all_historical_bottom_values)
-            if ucl_bottom is None:
-                mean_bottom, ucl_bottom, lcl_bottom = DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, DEFAULT_BOTTOM_LCL
-                print("Using default Bottom SPC limits after save.") # For debugging
-
-            mean_top, ucl_top, lcl_top = calculate_control_limits(all_historical_top_values)
-            if ucl_top is None:
-                mean_top, ucl_top, lcl_top = DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, DEFAULT_TOP_LCL
-                print("Using default Top SPC limits after save.") # For debugging
-
-            update_plot([], [], # Pass empty lists for current values since fields are cleared
-                        mean_bottom, ucl_bottom, lcl_bottom,
-                        mean_top, ucl_top, lcl_top)
-
-            button_save_to_db['state'] = tk.DISABLED # Disable save button after successful save
-
-        except Exception as e:
-            messagebox.showerror("Database Error", f"Failed to save data to MSSQL: {e}")
-            conn.rollback()
-        finally:
-            conn.close()
+            for side in ('Bottom', 'Top'):
+                lsl, usl = (limit_entries[(side, column)].get().strip() for column in (1, 3))
+                spec_limits[side] = (float(lsl) if lsl else None, float(usl) if usl else None)
+        except ValueError:
+            messagebox.showerror("Input Error", "Spec limits must be numbers (leave one empty for a one-sided spec).", parent=window)
+            return
+        if any(limits == (None, None) for limits in spec_limits.values()):
+            messagebox.showerror("Input Error", "Enter at least one spec limit per side.", parent=window)
+            return
+        button_analyze['state'] = tk.DISABLED
+        report_text.delete("1.0", tk.END)
+        report_text.insert(tk.END, f"Analyzing ({CAPABILITY_RESAMPLES} bootstrap resamples)...")
+
+        def on_done(results):
+            if window.winfo_exists():
+                button_analyze['state'] = tk.NORMAL
+                report_text.delete("1.0", tk.END)
+                report_text.insert(tk.END, capability.format_capability_report(results, spec_limits))
+
+        def on_failed(ex):
+            if window.winfo_exists():
+                button_analyze['state'] = tk.NORMAL
+                report_text.delete("1.0", tk.END)
+            show_database_error(ex, "Failed to analyze the capability")
+
+        _long_task_worker.submit(lambda: run_capability_analysis(spec_limits, CAPABILITY_RESAMPLES),
+                                 on_success=on_done, on_error=on_failed)
+
+    button_analyze = tk.Button(limits_frame, text="Analyze", command=start_analysis, font=label_font)
+    button_analyze.grid(row=0, column=4, rowspan=2, padx=10, pady=2)
+    report_text.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+def load_history_query(history_filter, after):
+    """
+    Runs on the worker: reads a page (and, for the first page, the statistics) of a
+    history query that was not in the cache, and caches it (unless readings were
+    committed meanwhile, which may have made it stale before it is stored).
+    """
+    generation = _history_cache.generation
+
+    def query(conn):
+        page = fetch_page(conn, history_filter, HISTORY_QUERY_PAGE_SIZE, after)
+        statistics = _history_cache.statistics(history_filter)
+        if statistics is None:
+            statistics = fetch_statistics(conn, history_filter)
+        return page, statistics
+    page, statistics = _db_manager.run(query)
+    _history_cache.store_page(history_filter, HISTORY_QUERY_PAGE_SIZE, after, page, generation)
+    _history_cache.store_statistics(history_filter, statistics, generation)
+    return page, statistics
+
+def format_history_query(page, statistics):
+    """Returns the text shown in the history query window for one page and the statistics of the filter."""
+    lines = []
+    for side in ('Bottom', 'Top'):
+        if side in statistics:
+            count, mean_val, std_dev, low, high = statistics[side]
+            std_text = "-" if std_dev is None else f"{std_dev:.2f}"
+            lines.append(f"{side:<7} n={count:<8} mean={mean_val:.2f}  std={std_text}  min={low:g}  max={high:g}")
+    if not lines:
+        lines.append("No readings match the filter.")
+    lines.append("")
+    lines.append(f"{'ID':>10}  {'Tech':<5} {'Sample ID':<10} {'Side':<7} {'Pos':>3} {'Value':>7}  Timestamp")
+    for reading_id, technician, sample_id, side, position, value, timestamp in page[0]:
+        lines.append(f"{reading_id:>10}  {technician:<5} {sample_id:<10} {side:<7} {position:>3} {value:>7g}  {timestamp}")
+    return "\n".join(lines)
+
+def open_history_query():
+    """
+    Opens a window for querying the saved readings by technician, Sample ID prefix,
+    time range, side and position, page by page. Results are cached until matching
+    readings are saved, so switching back to an earlier filter is immediate.
+    """
+    window = tk.Toplevel(root)
+    window.title("History Query")
+    window.geometry("800x600")
+    filter_frame = tk.Frame(window)
+    filter_frame.pack(side=tk.TOP, pady=5)
+    fields = {}
+    for index, (key, text) in enumerate((('technician', "Tech Initials:"), ('sample_prefix', "Sample ID starts with:"),
+                                         ('start', "From (YYYY-MM-DD[ HH:MM]):"), ('end', "To, excluding:"))):
+        row, column = divmod(index, 2)
+        tk.Label(filter_frame, text=text, font=label_font).grid(row=row, column=column * 2, padx=5, pady=2, sticky="w")
+        fields[key] = tk.Entry(filter_frame, width=16, font=label_font)
+        fields[key].grid(row=row, column=column * 2 + 1, padx=5, pady=2, sticky="ew")
+    side_choice = tk.StringVar(value="Both")
+    position_choice = tk.StringVar(value="Any")
+    tk.Label(filter_frame, text="Side:", font=label_font).grid(row=2, column=0, padx=5, pady=2, sticky="w")
+    tk.OptionMenu(filter_frame, side_choice, "Both", "Bottom", "Top").grid(row=2, column=1, padx=5, pady=2, sticky="w")
+    tk.Label(filter_frame, text="Position:", font=label_font).grid(row=2, column=2, padx=5, pady=2, sticky="w")
+    tk.OptionMenu(filter_frame, position_choice, "Any", *range(1, 7)).grid(row=2, column=3, padx=5, pady=2, sticky="w")
+    result_text = tk.Text(window, font=("Courier", 10), wrap=tk.NONE)
+    # Cursors of the pages shown so far: the last one is the current page, None being the first page
+    state = {'filter': None, 'cursors': [None], 'next': None}
+
+    def show(history_filter, after, page, statistics):
+        if not window.winfo_exists() or state['filter'] != history_filter or state['cursors'][-1] != after:
+            return # The window was closed or another query was started meanwhile
+        state['next'] = page[1]
+        result_text.delete("1.0", tk.END)
+        result_text.insert(tk.END, format_history_query(page, statistics))
+        button_previous['state'] = tk.NORMAL if len(state['cursors']) > 1 else tk.DISABLED
+        button_next['state'] = tk.NORMAL if page[1] is not None else tk.DISABLED
+
+    def load_current_page():
+        history_filter, after = state['filter'], state['cursors'][-1]
+        page = _history_cache.page(history_filter, HISTORY_QUERY_PAGE_SIZE, after)
+        statistics = _history_cache.statistics(history_filter)
+        if page is not None and statistics is not None:
+            show(history_filter, after, page, statistics)
+            return
+        button_next['state'] = tk.DISABLED
+        button_previous['state'] = tk.DISABLED
+        result_text.delete("1.0", tk.END)
+        result_text.insert(tk.END, "Loading...")
+
+        def on_failed(ex):
+            if window.winfo_exists():
+                result_text.delete("1.0", tk.END)
+            show_database_error(ex, "Failed to query the hardness history")
+
+        _worker.submit(lambda: load_history_query(history_filter, after),
+                       on_success=lambda result: show(history_filter, after, *result), on_error=on_failed)
+
+    def start_query():
+        values = {key: entry.get().strip() or None for key, entry in fields.items()}
+        for key in ('start', 'end'):
+            if values[key] is not None:
+                try:
+                    values[key] = export_history.parse_timestamp(values[key])
+                except ValueError:
+                    messagebox.showerror("Input Error", "Dates must be in the format 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM'.",
+                                         parent=window)
+                    return
+        if values['technician'] is not None:
+            values['technician'] = normalize_initials(values['technician'])
+        side = side_choice.get()
+        position = position_choice.get()
+        state['filter'] = HistoryFilter(side=None if side == "Both" else side,
+                                        position=None if position == "Any" else int(position), **values)
+        state['cursors'] = [None]
+        load_current_page()
+
+    def next_page():
+        if state['next'] is not None:
+            state['cursors'].append(state['next'])
+            load_current_page()
+
+    def previous_page():
+        if len(state['cursors']) > 1:
+            state['cursors'].pop()
+            load_current_page()
+
+    tk.Button(filter_frame, text="Search", command=start_query, font=label_font).grid(row=0, column=4, rowspan=2, padx=10, pady=2)
+    button_previous = tk.Button(filter_frame, text="< Previous", command=previous_page, state=tk.DISABLED, font=label_font)
+    button_previous.grid(row=2, column=4, padx=2, pady=2)
+    button_next = tk.Button(filter_frame, text="Next >", command=next_page, state=tk.DISABLED, font=label_font)
+    button_next.grid(row=2, column=5, padx=2, pady=2)
+    result_text.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=5, pady=5)
+    window.bind('<Return>', lambda event: start_query())
+
+def extend_history(records, timestamp, sequence):
+    """
+    Appends saved records to the history store and pyramids (if loaded) and refreshes open
+    history windows. While the store is loading they are kept for on_loaded() instead.
+
+    Args:
+        records (list): The saved (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples.
+        timestamp (datetime): Timestamp they were journaled with.
+        sequence (int): The journal's `appended` count right after they were journaled.
+    """
+    if _history_pyramids is None:
+        if _history_saves_while_loading is not None:
+            _history_saves_while_loading.append((sequence, records, timestamp))
+        return
+    _history_store.append(records, timestamp=timestamp)
+    for pyramid in _history_pyramids.values():
+        pyramid.sync()
+    mean_bottom, ucl_bottom, lcl_bottom, mean_top, ucl_top, lcl_top = get_current_control_limits()
+    for chart in _history_charts:
+        chart.set_limits('Bottom', mean_bottom, ucl_bottom, lcl_bottom)
+        chart.set_limits('Top', mean_top, ucl_top, lcl_top)
+        chart.refresh()
+
+def extend_recent_values(records):
+    """Appends saved records (in order) to the per-side recent value buffers."""
+    for record in records:
+        _recent_values[record[2]].append(record[4])
+
+def export_metrics(reschedule=True):
+    """Writes the span histograms to METRICS_PATH / METRICS_JSON_PATH; re-schedules itself."""
+    try:
+        instrumentation.write_metrics(METRICS_PATH, METRICS_JSON_PATH)
+    except OSError as e:
+        print(f"Could not write metrics: {e}")
+    if reschedule:
+        root.after(METRICS_EXPORT_INTERVAL_MS, export_metrics)
+
+def toggle_profiling(event=None):
+    """Starts or stops the cProfile capture of the UI thread (bound to F9)."""
+    if instrumentation.toggle_profiling(PROFILE_PATH):
+        print("Profiling started; press F9 again to stop.")
     else:
-        messagebox.showwarning("Database Warning", "Could not connect to database. Data not saved.")
-
-
-# Create the main application window
-root = tk.Tk()
-root.title("Hardness Data Entry App")
-# Adjusted height to better accommodate two plots
-root.geometry("800x700") # Adjusted height to 700 from 1000
-
-# Define fonts for labels and entries
-label_font = font.nametofont("TkDefaultFont")
-label_font.configure(size=12) # Set label font size to 12
-
-entry_font = font.nametofont("TkTextFont") # TkTextFont is usually for entries/text widgets
-entry_font.configure(size=24) # Set entry font size to 24 (doubled for height)
-
-# --- UI Layout Parameters ---
-# Number of columns for hardness value entries (6 for B1-B6 and T1-T6)
-num_hardness_cols = 6
-# Total columns for display (1 for labels + num_hardness_cols for entries/spanning)
-# Making it 6 columns, where Technician/Sample labels take column 0 and entries span 5 columns
-num_display_columns = num_hardness_cols
-
-# Configure grid column weights to distribute space evenly among the 6 hardness columns
-for i in range(num_display_columns):
-    root.grid_columnconfigure(i, weight=1)
-
-# Initialize current_row counter
-current_row = 0
-
-# --- Tech Initials ---
-label_technician_initials = tk.Label(root, text="Tech Initials:", font=label_font)
-# Place label in the first column, align to the left
-label_technician_initials.grid(row=current_row, column=0, padx=10, pady=5, sticky="w")
-entry_technician_initials = tk.Entry(root, font=entry_font)
-# Place entry in the second column and let it span across the remaining 5 columns
-entry_technician_initials.grid(row=current_row, column=1, columnspan=num_hardness_cols - 1, padx=10, pady=5, sticky="ew")
-current_row += 1
-
-# --- Sample ID ---
-label_sample_id = tk.Label(root, text="Sample ID:", font=label_font)
-# Place label in the first column, align to the left
-label_sample_id.grid(row=current_row, column=0, padx=10, pady=5, sticky="w")
-entry_sample_id = tk.Entry(root, font=entry_font)
-# Place entry in the second column and let it span across the remaining 5 columns
-entry_sample_id.grid(row=current_row, column=1, columnspan=num_hardness_cols - 1, padx=10, pady=5, sticky="ew")
-current_row += 1
-
-# Add a small visual separator or empty row for better grouping
-current_row += 1 # Add an empty row for spacing before hardness values
-
-# --- Bottom Hardness Labels and Entries ---
-# Labels for Bottom Hardness positions (B1, B2, ..., B6)
-label_bottom_headers = []
-for i in range(num_hardness_cols):
-    label = tk.Label(root, text=f"Bottom {i+1}", font=label_font)
-    # Labels directly above their respective entries
-    label.grid(row=current_row, column=i, padx=5, pady=2, sticky="s")
-    label_bottom_headers.append(label)
-current_row += 1 # Move to the row for entries
-
-entry_bottom_hardness = []
-for i in range(num_hardness_cols):
-    entry = tk.Entry(root, font=entry_font)
-    # Entries aligned horizontally
-    entry.grid(row=current_row, column=i, padx=5, pady=5, sticky="ew")
-    entry_bottom_hardness.append(entry)
-current_row += 1 # Move to the next row after Bottom entries
-
-# --- Top Hardness Labels and Entries ---
-# Labels for Top Hardness positions (T1, T2, ..., T6)
-label_top_headers = []
-for i in range(num_hardness_cols):
-    label = tk.Label(root, text=f"Top {i+1}", font=label_font)
-    # Labels directly above their respective entries, aligning with Bottom labels
-    label.grid(row=current_row, column=i, padx=5, pady=2, sticky="s")
-    label_top_headers.append(label)
-current_row += 1 # Move to the row for entries
-
-entry_top_hardness = []
-for i in range(num_hardness_cols):
-    entry = tk.Entry(root, font=entry_font)
-    # Entries aligned horizontally, aligning with Bottom entries
-    entry.grid(row=current_row, column=i, padx=5, pady=5, sticky="ew")
-    entry_top_hardness.append(entry)
-current_row += 1 # Move to the next row after Top entries
-
-# Configure all rows to expand (except for some spacing rows)
-# Assuming a reasonable number of rows will be used by the layout logic above
-total_rows_for_widgets = current_row
-for i in range(total_rows_for_widgets):
-    root.grid_rowconfigure(i, weight=1) # Give all widget rows some weight for responsiveness
-
-# Create a frame for buttons to easily manage their horizontal layout
-button_frame = tk.Frame(root)
-button_frame.grid(row=current_row, column=0, columnspan=num_display_columns, pady=10)
-# Configure columns within the button frame to distribute space for buttons
-button_frame.grid_columnconfigure(0, weight=1)
-button_frame.grid_columnconfigure(1, weight=1)
-
-
-# Create and place the "Display on Graph" button
-button_display_on_graph = tk.Button(button_frame, text="Display on Graph", command=display_on_graph, font=label_font)
-button_display_on_graph.grid(row=0, column=0, padx=5, pady=0, sticky="ew") # Placed in button_frame
-
-# Create and place the "Save to Database" button (initially disabled)
-button_save_to_db = tk.Button(button_frame, text="Save to Database", command=save_to_database, state=tk.DISABLED, font=label_font)
-button_save_to_db.grid(row=0, column=1, padx=5, pady=0, sticky="ew") # Placed in button_frame
-current_row += 1 # Increment current_row for the plot area
-
-# Initialize the plot area with two subplots, spanning all display columns
-create_plot_area() # This function will use `num_display_columns` for columnspan
-
-# Initial database setup (create table if not exists)
-create_table_if_not_exists()
-
-# Load initial historical data and update plots on startup
-initial_historical_bottom_values, initial_historical_top_values = get_all_hardness_values()
-
-# Calculate initial limits for Bottom
-initial_mean_bottom, initial_ucl_bottom, initial_lcl_bottom = calculate_control_limits(initial_historical_bottom_values)
-if initial_ucl_bottom is None:
-    initial_mean_bottom, initial_ucl_bottom, initial_lcl_bottom = DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, DEFAULT_BOTTOM_LCL
-    print("Using default Bottom SPC limits on startup.")
-
-# Calculate initial limits for Top
-initial_mean_top, initial_ucl_top, initial_lcl_top = calculate_control_limits(initial_historical_top_values)
-if initial_ucl_top is None:
-    initial_mean_top, initial_ucl_top, initial_lcl_top = DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, DEFAULT_TOP_LCL
-    print("Using default Top SPC limits on startup.")
-
-# Pass empty lists for current readings on startup, as none have been entered yet
-update_plot([], [],
-            initial_mean_bottom, initial_ucl_bottom, initial_lcl_bottom,
-            initial_mean_top, initial_ucl_top, initial_lcl_top)
-
-
-# Start the Tkinter event loop
-root.mainloop()
+        print(f"Profile written to '{PROFILE_PATH}'.")
+
+def update_journal_status():
+    """Shows how many saved samples are still waiting for the database; re-schedules itself."""
+    pending = _journal.pending_count()
+    if pending == 0:
+        label_journal_status.config(text="")
+    elif _flusher.last_error is not None:
+        label_journal_status.config(text=f"{pending} saved sample(s) stored locally - database unreachable, retrying.")
+    else:
+        label_journal_status.config(text=f"{pending} saved sample(s) waiting to be written to the database.")
+    root.after(1000, update_journal_status)
+
+
+def build_main_window():
+    """Creates the main window with the entry form and buttons (the chart is added once matplotlib is loaded)."""
+    global root, label_font, num_display_columns, button_save_to_db, label_journal_status
+    global entry_technician_initials, entry_sample_id, entry_bottom_hardness, entry_top_hardness
+
+    # Create the main application window
+    root = tk.Tk()
+    root.title("Hardness Data Entry App")
+    # Adjusted height to better accommodate two plots
+    root.geometry("800x700") # Adjusted height to 700 from 1000
+
+    # Define fonts for labels and entries
+    label_font = font.nametofont("TkDefaultFont")
+    label_font.configure(size=12) # Set label font size to 12
+
+    entry_font = font.nametofont("TkTextFont") # TkTextFont is usually for entries/text widgets
+    entry_font.configure(size=24) # Set entry font size to 24 (doubled for height)
+
+    # --- UI Layout Parameters ---
+    # Number of columns for hardness value entries (6 for B1-B6 and T1-T6)
+    num_hardness_cols = 6
+    # Total columns for display (1 for labels + num_hardness_cols for entries/spanning)
+    # Making it 6 columns, where Technician/Sample labels take column 0 and entries span 5 columns
+    num_display_columns = num_hardness_cols
+
+    # Configure grid column weights to distribute space evenly among the 6 hardness columns
+    for i in range(num_display_columns):
+        root.grid_columnconfigure(i, weight=1)
+
+    # Initialize current_row counter
+    current_row = 0
+
+    # --- Tech Initials ---
+    label_technician_initials = tk.Label(root, text="Tech Initials:", font=label_font)
+    # Place label in the first column, align to the left
+    label_technician_initials.grid(row=current_row, column=0, padx=10, pady=5, sticky="w")
+    entry_technician_initials = tk.Entry(root, font=entry_font)
+    # Place entry in the second column and let it span across the remaining 5 columns
+    entry_technician_initials.grid(row=current_row, column=1, columnspan=num_hardness_cols - 1, padx=10, pady=5, sticky="ew")
+    current_row += 1
+
+    # --- Sample ID ---
+    label_sample_id = tk.Label(root, text="Sample ID:", font=label_font)
+    # Place label in the first column, align to the left
+    label_sample_id.grid(row=current_row, column=0, padx=10, pady=5, sticky="w")
+    entry_sample_id = tk.Entry(root, font=entry_font)
+    # Place entry in the second column and let it span across the remaining 5 columns
+    entry_sample_id.grid(row=current_row, column=1, columnspan=num_hardness_cols - 1, padx=10, pady=5, sticky="ew")
+    current_row += 1
+
+    # Add a small visual separator or empty row for better grouping
+    current_row += 1 # Add an empty row for spacing before hardness values
+
+    # --- Bottom Hardness Labels and Entries ---
+    # Labels for Bottom Hardness positions (B1, B2, ..., B6)
+    label_bottom_headers = []
+    for i in range(num_hardness_cols):
+        label = tk.Label(root, text=f"Bottom {i+1}", font=label_font)
+        # Labels directly above their respective entries
+        label.grid(row=current_row, column=i, padx=5, pady=2, sticky="s")
+        label_bottom_headers.append(label)
+    current_row += 1 # Move to the row for entries
+
+    entry_bottom_hardness = []
+    for i in range(num_hardness_cols):
+        entry = tk.Entry(root, font=entry_font)
+        # Entries aligned horizontally
+        entry.grid(row=current_row, column=i, padx=5, pady=5, sticky="ew")
+        entry_bottom_hardness.append(entry)
+    current_row += 1 # Move to the next row after Bottom entries
+
+    # --- Top Hardness Labels and Entries ---
+    # Labels for Top Hardness positions (T1, T2, ..., T6)
+    label_top_headers = []
+    for i in range(num_hardness_cols):
+        label = tk.Label(root, text=f"Top {i+1}", font=label_font)
+        # Labels directly above their respective entries, aligning with Bottom labels
+        label.grid(row=current_row, column=i, padx=5, pady=2, sticky="s")
+        label_top_headers.append(label)
+    current_row += 1 # Move to the row for entries
+
+    entry_top_hardness = []
+    for i in range(num_hardness_cols):
+        entry = tk.Entry(root, font=entry_font)
+        # Entries aligned horizontally, aligning with Bottom entries
+        entry.grid(row=current_row, column=i, padx=5, pady=5, sticky="ew")
+        entry_top_hardness.append(entry)
+    current_row += 1 # Move to the next row after Top entries
+
+    # Configure all rows to expand (except for some spacing rows)
+    # Assuming a reasonable number of rows will be used by the layout logic above
+    total_rows_for_widgets = current_row
+    for i in range(total_rows_for_widgets):
+        root.grid_rowconfigure(i, weight=1) # Give all widget rows some weight for responsiveness
+
+    # Create a frame for buttons to easily manage their horizontal layout
+    button_frame = tk.Frame(root)
+    button_frame.grid(row=current_row, column=0, columnspan=num_display_columns, pady=10)
+    # Configure columns within the button frame to distribute space for buttons
+    button_frame.grid_columnconfigure(0, weight=1)
+    button_frame.grid_columnconfigure(1, weight=1)
+    button_frame.grid_columnconfigure(2, weight=1)
+    button_frame.grid_columnconfigure(3, weight=1)
+    button_frame.grid_columnconfigure(4, weight=1)
+    button_frame.grid_columnconfigure(5, weight=1)
+    button_frame.grid_columnconfigure(6, weight=1)
+    button_frame.grid_columnconfigure(7, weight=1)
+
+
+    # Create and place the "Display on Graph" button
+    button_display_on_graph = tk.Button(button_frame, text="Display on Graph", command=display_on_graph, font=label_font)
+    button_display_on_graph.grid(row=0, column=0, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "Save to Database" button (initially disabled)
+    button_save_to_db = tk.Button(button_frame, text="Save to Database", command=save_to_database, state=tk.DISABLED, font=label_font)
+    button_save_to_db.grid(row=0, column=1, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "Subgroup Charts" button (X-bar/R and X-bar/S charts of the saved samples)
+    button_subgroup_charts = tk.Button(button_frame, text="Subgroup Charts", command=open_subgroup_charts, font=label_font)
+    button_subgroup_charts.grid(row=0, column=2, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "History" button (run charts of every saved reading)
+    button_history = tk.Button(button_frame, text="History", command=open_history_chart, font=label_font)
+    button_history.grid(row=0, column=3, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "Export" button (saved readings to CSV/Parquet/Arrow)
+    button_export_history = tk.Button(button_frame, text="Export", command=open_export_dialog, font=label_font)
+    button_export_history.grid(row=0, column=4, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "Capability" button (Cp/Cpk/Pp/Ppk against the spec limits)
+    button_capability = tk.Button(button_frame, text="Capability", command=open_capability_dialog, font=label_font)
+    button_capability.grid(row=0, column=5, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Create and place the "Query" button (filtered history by technician, sample, time, side, position)
+    button_history_query = tk.Button(button_frame, text="Query", command=open_history_query, font=label_font)
+    button_history_query.grid(row=0, column=6, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Limit mode selector (all history, rolling window, EWMA, CUSUM); switching only redraws
+    limit_mode = tk.StringVar(value=_limit_mode)
+    option_limit_mode = tk.OptionMenu(button_frame, limit_mode, *MODES, command=on_limit_mode_changed)
+    option_limit_mode.config(font=label_font)
+    option_limit_mode.grid(row=0, column=7, padx=5, pady=0, sticky="ew") # Placed in button_frame
+
+    # Status line for samples that are journaled locally but not yet in the database
+    label_journal_status = tk.Label(button_frame, text="", font=label_font, fg="darkorange")
+    label_journal_status.grid(row=1, column=0, columnspan=8, padx=5, pady=(5, 0))
+
+def on_chart_modules_imported(result):
+    """Called on the UI thread once matplotlib is loaded: adds the chart with the best limits known so far."""
+    if _chart is not None: # A click already created it
+        return
+    create_plot_area() # This function will use `num_display_columns` for columnspan
+    bottom_position_limits, top_position_limits = get_position_control_limits()
+    bottom_mode_overlay, top_mode_overlay = get_mode_overlays(_current_displayed_bottom_values, _current_displayed_top_values)
+    # Pass the current readings (none unless the technician already clicked Display)
+    update_plot(_current_displayed_bottom_values, _current_displayed_top_values, *get_current_control_limits(),
+                bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
+
+@instrumentation.traced_action('startup_apply')
+def on_startup_data_loaded(result):
+    """Called on the UI thread when the background startup load has finished."""
+    global _loading_statistics, _mode_states, _statistics_saves_while_loading
+    aggregates, recent_values, recent_summaries, entries, sequence = result
+    _loading_statistics = False
+    with instrumentation.span('statistics'):
+        apply_control_limit_aggregates(aggregates)
+        _mode_states = build_mode_states(recent_summaries, _side_statistics)
+        for side in _recent_values:
+            _recent_values[side].clear()
+            _recent_values[side].extend(recent_values[side])
+        # Samples that were in the journal when the load read the aggregates, then the ones saved after that
+        journaled_records = [tuple(record) for entry in entries for record in entry['records']]
+        for saved_sequence, records in _statistics_saves_while_loading or []:
+            if saved_sequence > sequence:
+                journaled_records.extend(records)
+        _statistics_saves_while_loading = None
+        fold_saved_records(journaled_records)
+        extend_recent_values(journaled_records)
+    save_limits_snapshot()
+    bottom_position_limits, top_position_limits = get_position_control_limits()
+    bottom_mode_overlay, top_mode_overlay = get_mode_overlays(_current_displayed_bottom_values, _current_displayed_top_values)
+    update_plot(_current_displayed_bottom_values, _current_displayed_top_values, *get_current_control_limits(),
+                bottom_position_limits=bottom_position_limits, top_position_limits=top_position_limits,
+                bottom_mode_overlay=bottom_mode_overlay, top_mode_overlay=top_mode_overlay)
+    _flusher.start()
+
+def on_startup_data_failed(ex):
+    """Called on the UI thread when the background startup load failed."""
+    global _loading_statistics, _statistics_saves_while_loading
+    _loading_statistics = False
+    _statistics_saves_while_loading = None # The next load reads them from the database or the journal
+    show_database_error(ex, "Failed to retrieve historical data")
+    _flusher.start() # Keeps retrying the journal in the background
+
+def start_loading_statistics():
+    """Loads the tables and historical statistics on the background worker."""
+    global _loading_statistics, _statistics_saves_while_loading
+    _loading_statistics = True
+    _statistics_saves_while_loading = []
+    _worker.submit(load_startup_data, on_success=on_startup_data_loaded, on_error=on_startup_data_failed)
+
+def save_limits_snapshot():
+    """Persists the current per-position statistics for the next start (see LIMITS_SNAPSHOT_PATH)."""
+    if _position_statistics is None:
+        return
+    try:
+        save_statistics_snapshot(LIMITS_SNAPSHOT_PATH, _position_statistics)
+    except OSError as e:
+        print(f"Could not write limits snapshot: {e}")
+
+def main():
+    global _snapshot_side_statistics, _snapshot_position_statistics
+
+    start_services()
+
+    with instrumentation.action('startup'), instrumentation.span('window'):
+        build_main_window()
+        # Seed the limits with the last session's snapshot until the fresh statistics arrive
+        _snapshot_position_statistics = load_statistics_snapshot(LIMITS_SNAPSHOT_PATH)
+        if _snapshot_position_statistics is not None:
+            _snapshot_side_statistics = side_statistics_from_positions(_snapshot_position_statistics)
+        root.update_idletasks() # Map the entry form now; everything slow happens after this
+
+    # Background work, in order: load matplotlib and draw the chart, then create the tables
+    # if needed and load the historical statistics. The journal flusher starts once the
+    # statistics are loaded so it does not race the startup flush.
+    _worker.attach(root)
+    _long_task_worker.attach(root)
+    _worker.submit(import_chart_modules, on_success=on_chart_modules_imported,
+                   on_error=lambda ex: messagebox.showerror("Chart Error", f"Failed to load the charts: {ex}"))
+    start_loading_statistics()
+    update_journal_status()
+    root.after(METRICS_EXPORT_INTERVAL_MS, export_metrics)
+    root.bind("<F9>", toggle_profiling)
+
+    # Start the Tkinter event loop
+    root.mainloop()
+
+    # Let queued database work finish, then release the warm connection once the window is closed.
+    # Samples the flusher could not write stay in the journal for the next session.
+    _worker.shutdown()
+    _long_task_worker.shutdown(wait=False) # A running export or analysis still completes before the process exits
+    _flusher.stop()
+    _db_manager.close()
+    save_limits_snapshot()
+    if instrumentation.is_profiling():
+        instrumentation.stop_profiling(PROFILE_PATH)
+    export_metrics(reschedule=False)
+
+
+if __name__ == "__main__":
+    main()
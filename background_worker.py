@@ -0,0 +1,74 @@
+"""
+Background execution of database work for the Tkinter UI.
+
+Tkinter widgets may only be touched from the thread running root.mainloop(),
+so queries and inserts run on a worker thread and their results are put on a
+queue that the UI thread drains with root.after(). Callbacks therefore always
+run on the UI thread and may safely update widgets and the plots.
+"""
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class BackgroundWorker:
+    """
+    Runs operations off the UI thread and delivers their results back to it.
+
+    Args:
+        max_workers (int): Worker threads. The default of 1 keeps database work in
+            submission order and matches the single warm connection.
+    """
+
+    def __init__(self, max_workers=1):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="hardness-worker")
+        self._results = queue.Queue()
+        self._root = None
+        self._poll_interval_ms = 50
+
+    def submit(self, operation, on_success=None, on_error=None):
+        """
+        Schedules operation() on the worker thread.
+
+        Args:
+            operation (callable): Zero-argument function to run in the background.
+            on_success (callable): Called on the UI thread with the operation's return value.
+            on_error (callable): Called on the UI thread with the exception raised, if any.
+
+        Returns:
+            concurrent.futures.Future: Future of the operation.
+        """
+        future = self._executor.submit(operation)
+        future.add_done_callback(lambda done: self._results.put((done, on_success, on_error)))
+        return future
+
+    def drain(self):
+        """Runs the callbacks of every finished operation. Must be called on the UI thread."""
+        while True:
+            try:
+                future, on_success, on_error = self._results.get_nowait()
+            except queue.Empty:
+                return
+            error = future.exception()
+            if error is None:
+                if on_success is not None:
+                    on_success(future.result())
+            elif on_error is not None:
+                on_error(error)
+            else:
+                print(f"Background operation failed: {error}")
+
+    def attach(self, root, poll_interval_ms=50):
+        """Starts draining the result queue from the Tk event loop every poll_interval_ms."""
+        self._root = root
+        self._poll_interval_ms = poll_interval_ms
+        self._root.after(self._poll_interval_ms, self._poll)
+
+    def _poll(self):
+        try:
+            self.drain()
+        finally:
+            self._root.after(self._poll_interval_ms, self._poll)
+
+    def shutdown(self, wait=True):
+        """Stops the worker thread, by default after queued operations have finished."""
+        self._executor.shutdown(wait=wait)
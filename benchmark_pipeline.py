@@ -0,0 +1,296 @@
+"""
+Benchmarks of the data pipeline against growing synthetic histories.
+
+Generates realistic synthetic readings (per-position bias, technician offsets,
+slow process drift and occasional outliers, one sample every few minutes) into
+local SQLite stand-in databases of 3k, 100k and 1M readings (10M on request)
+and times the steps a station runs:
+
+    fetch_all_values     hardness_db.fetch_all_hardness_values() (full history read)
+    control_limits_full  3-sigma limits over the full history in memory
+    control_limits_db    grouped COUNT/AVG/STDEV per side and position + running statistics (startup path)
+    render               ChartRenderer.update() and a full draw on the Agg backend
+    save_journal         OfflineJournal.append() of one sample (fsync'ed; what the Save button waits for)
+    save_insert          hardness_db.apply_journal_entries() of one sample (the background insert)
+
+Results are written as JSON with min/mean/p50/p90/p99/max per benchmark. With
+--baseline they are compared against an earlier result file, and the script exits
+with status 1 when a benchmark's median is slower than the baseline by more than
+--threshold.
+
+Usage:
+    python benchmark_pipeline.py --output results.json
+    python benchmark_pipeline.py --sizes 3k,100k,1m,10m --save-baseline baseline.json
+    python benchmark_pipeline.py --baseline baseline.json --threshold 0.25
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np # For the synthetic data and percentiles
+
+import hardness_db
+from chart_renderer import ChartRenderer
+from offline_journal import OfflineJournal, journal_entry_records
+from spc_statistics import (RunningStatistics, build_position_statistics_from_aggregates,
+                            side_statistics_from_positions)
+
+DEFAULT_SIZES = "3k,100k,1m"
+DEFAULT_DATA_DIR = "benchmark_data"
+DEFAULT_THRESHOLD = 0.20 # Median more than 20% slower than the baseline counts as a regression
+
+READINGS_PER_SAMPLE = 12
+GENERATE_CHUNK_SAMPLES = 20000
+
+# Benchmark writes use these initials so they can be removed again afterwards
+BENCHMARK_INITIALS = "BNCH"
+
+SIDE_MEANS = {'Bottom': 318.0, 'Top': 322.0}
+TECHNICIANS = ["AB", "CD", "EF", "GH", "JK", "LM"]
+
+
+def parse_size(text):
+    """Parses '3k', '100k', '1m' or a plain number of readings."""
+    text = text.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * multiplier)
+
+def generate_samples(sample_count, seed=0, chunk_samples=GENERATE_CHUNK_SAMPLES):
+    """
+    Generates synthetic timestamped readings, 12 per sample (Bottom 1-6, Top 1-6).
+
+    Yields:
+        list: Chunks of (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp) tuples.
+    """
+    rng = np.random.default_rng(seed)
+    position_bias = rng.normal(0.0, 2.0, size=(2, 6)) # Fixed per side and position
+    technician_bias = rng.normal(0.0, 1.0, size=len(TECHNICIANS))
+    start_time = datetime(2024, 1, 1, 6, 0, 0)
+    side_labels = np.repeat(np.array(['Bottom', 'Top']), 6)
+    position_labels = np.tile(np.arange(1, 7), 2)
+    side_means = np.repeat([SIDE_MEANS['Bottom'], SIDE_MEANS['Top']], 6)
+
+    for first in range(0, sample_count, chunk_samples):
+        count = min(chunk_samples, sample_count - first)
+        sample_numbers = np.arange(first, first + count)
+        technicians = rng.integers(0, len(TECHNICIANS), size=count)
+        drift = 3.0 * np.sin(sample_numbers / 5000.0) # Slow process drift over the history
+        values = (side_means + position_bias.ravel())[np.newaxis, :] \
+            + (technician_bias[technicians] + drift)[:, np.newaxis] \
+            + rng.normal(0.0, 6.0, size=(count, READINGS_PER_SAMPLE))
+        outliers = rng.random(values.shape) < 0.002
+        values[outliers] += rng.choice([-1.0, 1.0], size=np.count_nonzero(outliers)) * rng.uniform(25, 40, size=np.count_nonzero(outliers))
+        values = np.clip(values, 100.0, 500.0).round(1)
+        minutes = np.cumsum(rng.integers(2, 6, size=count)) + first * 4 # Roughly one sample every 4 minutes
+
+        records = []
+        for row in range(count):
+            initials = TECHNICIANS[technicians[row]]
+            sample_id = f"{sample_numbers[row] % 1000:03d}-{sample_numbers[row] // 1000 % 100:02d}"
+            timestamp = start_time + timedelta(minutes=int(minutes[row]))
+            records.extend(zip([initials] * READINGS_PER_SAMPLE, [sample_id] * READINGS_PER_SAMPLE,
+                               side_labels.tolist(), position_labels.tolist(), values[row].tolist(),
+                               [timestamp] * READINGS_PER_SAMPLE))
+        yield records
+
+def prepare_database(data_dir, reading_count, seed=0):
+    """
+    Returns the path of a SQLite database holding reading_count synthetic readings,
+    generating it on first use (the files are reused between runs).
+    """
+    os.makedirs(data_dir, exist_ok=True)
+    path = os.path.join(data_dir, f"hardness_{reading_count}.db")
+    if os.path.exists(path):
+        return path
+    temp_path = path + ".partial"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    print(f"Generating {reading_count} synthetic readings into '{path}'...", file=sys.stderr)
+    start = time.perf_counter()
+    conn = hardness_db.connect_sqlite(temp_path)
+    try:
+        hardness_db.create_table(conn)
+        hardness_db.create_journal_table(conn)
+        for records in generate_samples(reading_count // READINGS_PER_SAMPLE, seed):
+            hardness_db.insert_timestamped_readings(conn, records)
+    finally:
+        conn.close()
+    os.replace(temp_path, path)
+    print(f"Generated in {time.perf_counter() - start:.1f}s.", file=sys.stderr)
+    return path
+
+def summarize_timings(timings):
+    """Percentile summary of a list of durations in seconds."""
+    timings = np.asarray(timings, dtype=np.float64)
+    return {
+        'runs': int(timings.size),
+        'min': float(timings.min()),
+        'mean': float(timings.mean()),
+        'p50': float(np.percentile(timings, 50)),
+        'p90': float(np.percentile(timings, 90)),
+        'p99': float(np.percentile(timings, 99)),
+        'max': float(timings.max()),
+    }
+
+def time_operation(operation, repeat, warmup=1):
+    """Runs operation warmup + repeat times and returns the summary of the timed runs."""
+    for _ in range(warmup):
+        operation()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return summarize_timings(timings)
+
+def _repeat_for(reading_count, repeat):
+    # Full-history benchmarks get fewer runs on the large databases
+    if reading_count <= 100000:
+        return repeat
+    return max(3, repeat * 100000 // reading_count)
+
+def _remove_benchmark_rows(conn):
+    cursor = conn.cursor()
+    readings_table = (hardness_db.WIDE_TABLE_NAME if hardness_db.storage_layout(conn) == hardness_db.LAYOUT_WIDE
+                      else hardness_db.TABLE_NAME)
+    cursor.execute(f"DELETE FROM {readings_table} WHERE TechnicianInitials = ?;", (BENCHMARK_INITIALS,))
+    cursor.execute(f"DELETE FROM {hardness_db.SUMMARY_TABLE_NAME} WHERE TechnicianInitials = ?;", (BENCHMARK_INITIALS,))
+    cursor.execute(f"DELETE FROM {hardness_db.JOURNAL_TABLE_NAME} WHERE SampleKey LIKE 'bench-%';")
+    conn.commit()
+
+def run_benchmarks(path, reading_count, repeat):
+    """
+    Times every pipeline step against one database.
+
+    Returns:
+        dict: {benchmark_name: percentile summary}
+    """
+    results = {}
+    conn = hardness_db.connect_sqlite(path)
+    try:
+        full_repeat = _repeat_for(reading_count, repeat)
+        results['fetch_all_values'] = time_operation(lambda: hardness_db.fetch_all_hardness_values(conn), full_repeat)
+
+        bottom_values, top_values = hardness_db.fetch_all_hardness_values(conn)
+        bottom_array, top_array = np.asarray(bottom_values), np.asarray(top_values)
+
+        def full_limits():
+            for values in (bottom_array, top_array):
+                RunningStatistics.from_values(values).control_limits()
+        results['control_limits_full'] = time_operation(full_limits, full_repeat)
+
+        def database_limits():
+            aggregates = hardness_db.fetch_control_limit_aggregates(conn, by_position=True)
+            side_statistics = side_statistics_from_positions(build_position_statistics_from_aggregates(aggregates))
+            return side_statistics['Bottom'].control_limits(), side_statistics['Top'].control_limits()
+        results['control_limits_db'] = time_operation(database_limits, full_repeat)
+
+        (mean_b, ucl_b, lcl_b), (mean_t, ucl_t, lcl_t) = database_limits()
+        renderer = ChartRenderer()
+        rng = np.random.default_rng(1)
+
+        def render():
+            current = rng.normal(320.0, 6.0, size=12).tolist()
+            renderer.update(current[:6], current[6:], mean_b, ucl_b, lcl_b, mean_t, ucl_t, lcl_t, redraw=False)
+            renderer.draw()
+        results['render'] = time_operation(render, repeat)
+
+        sample_records = [(BENCHMARK_INITIALS, "999-zz", side, position, 320.0 + position)
+                          for side in ('Bottom', 'Top') for position in range(1, 7)]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            journal = OfflineJournal(os.path.join(temp_dir, "benchmark_journal.jsonl"))
+            results['save_journal'] = time_operation(lambda: journal.append(sample_records), repeat)
+            entries = journal.pending()
+
+        counter = iter(range(len(entries)))
+
+        def insert_one():
+            entry = entries[next(counter)]
+            hardness_db.apply_journal_entries(conn, [("bench-" + entry['key'], journal_entry_records(entry))])
+        try:
+            results['save_insert'] = time_operation(insert_one, len(entries) - 1)
+        finally:
+            _remove_benchmark_rows(conn)
+    finally:
+        conn.close()
+    return results
+
+def compare_with_baseline(results, baseline, threshold):
+    """
+    Compares median timings with a baseline result file.
+
+    Returns:
+        list: (size, benchmark, baseline_p50, current_p50, ratio, regressed) tuples.
+    """
+    comparisons = []
+    for size, benchmarks in results['results'].items():
+        for name, summary in benchmarks.items():
+            baseline_summary = baseline.get('results', {}).get(size, {}).get(name)
+            if baseline_summary is None:
+                continue
+            ratio = summary['p50'] / baseline_summary['p50'] if baseline_summary['p50'] > 0 else float('inf')
+            comparisons.append((size, name, baseline_summary['p50'], summary['p50'], ratio, ratio > 1 + threshold))
+    return comparisons
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the hardness data pipeline on synthetic SQLite databases.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma-separated reading counts, e.g. 3k,100k,1m,10m.")
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per benchmark (fewer for full-history reads of large databases).")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="Where the generated databases are kept between runs.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic data generator.")
+    parser.add_argument("--output", help="Write the results JSON to this file (default: stdout).")
+    parser.add_argument("--save-baseline", help="Also write the results to this baseline file.")
+    parser.add_argument("--baseline", help="Compare against this baseline file; exit 1 on regressions.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Allowed slowdown of a median before it counts as a regression (0.2 = 20%%).")
+    args = parser.parse_args(argv)
+
+    results = {
+        'meta': {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': {},
+    }
+    for size_text in args.sizes.split(','):
+        reading_count = parse_size(size_text)
+        path = prepare_database(args.data_dir, reading_count, args.seed)
+        print(f"Benchmarking {reading_count} readings...", file=sys.stderr)
+        results['results'][str(reading_count)] = run_benchmarks(path, reading_count, args.repeat)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as baseline_file:
+            baseline_file.write(output + '\n')
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+        comparisons = compare_with_baseline(results, baseline, args.threshold)
+        regressions = [comparison for comparison in comparisons if comparison[5]]
+        for size, name, baseline_p50, current_p50, ratio, regressed in comparisons:
+            marker = "REGRESSION" if regressed else "ok"
+            print(f"{size:>10} {name:<20} {baseline_p50 * 1000:10.2f} ms -> {current_p50 * 1000:10.2f} ms  x{ratio:.2f}  {marker}",
+                  file=sys.stderr)
+        if regressions:
+            print(f"{len(regressions)} benchmark(s) slower than the baseline by more than {args.threshold:.0%}.", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
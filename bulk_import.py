@@ -0,0 +1,167 @@
+"""
+Headless bulk import of hardness readings from CSV files.
+
+Backlogs from paper sheets and other testers arrive as CSV files with one sample
+per row, laid out like the data entry window:
+
+    TechnicianInitials,SampleID,Bottom1,...,Bottom6,Top1,...,Top6[,Timestamp]
+
+Files are streamed in chunks; every chunk is validated column-wise with the same
+rules as the UI (hardness_validation) and the good rows are written with one
+batched executemany per chunk (fast_executemany on SQL Server). Rejected rows
+are reported with their line number and the same message the UI would show.
+
+Usage:
+    python bulk_import.py readings.csv --sqlite hardness_readings.db
+    python bulk_import.py sheets/*.csv --server HOST --database DB --username USER
+"""
+import argparse
+import csv
+import sys
+import time
+from itertools import islice
+
+import numpy as np # For column-wise validation of each chunk
+
+import hardness_db
+from hardness_validation import HARDNESS_COLUMNS, sample_rows_to_records, validate_sample_rows
+
+DEFAULT_CHUNK_SIZE = 20000 # Sample rows per chunk (12 readings each)
+
+REQUIRED_COLUMNS = ["TechnicianInitials", "SampleID"] + HARDNESS_COLUMNS
+TIMESTAMP_COLUMN = "Timestamp"
+
+
+def _parse_timestamps(raw_timestamps):
+    """
+    Parses ISO 8601 timestamps ('2024-05-01 13:45:00' or '2024-05-01T13:45:00').
+
+    Returns:
+        tuple: (datetime64[s] array, boolean mask of the cells that could not be parsed)
+    """
+    raw_timestamps = np.char.replace(np.char.strip(raw_timestamps), ' ', 'T')
+    try:
+        return raw_timestamps.astype('datetime64[s]'), np.zeros(raw_timestamps.shape, dtype=bool)
+    except ValueError:
+        parsed = np.full(raw_timestamps.shape, np.datetime64('NaT'), dtype='datetime64[s]')
+        for index, text in enumerate(raw_timestamps):
+            try:
+                parsed[index] = np.datetime64(text, 's')
+            except ValueError:
+                pass
+        return parsed, np.isnat(parsed)
+
+def read_chunks(path, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams a CSV file as chunks of rows.
+
+    Yields:
+        tuple: (first_line_number, rows, column_index) where rows is a list of
+        lists of strings and column_index maps header names to positions.
+    """
+    with open(path, newline='', encoding='utf-8-sig') as csv_file:
+        reader = csv.reader(csv_file)
+        header = [name.strip() for name in next(reader, [])]
+        missing = [name for name in REQUIRED_COLUMNS if name not in header]
+        if missing:
+            raise ValueError(f"{path}: missing column(s) {', '.join(missing)}")
+        column_index = {name: position for position, name in enumerate(header)}
+        line_number = 2 # Line 1 is the header
+        while True:
+            rows = list(islice(reader, chunk_size))
+            if not rows:
+                return
+            yield line_number, rows, column_index
+            line_number += len(rows)
+
+def prepare_chunk(rows, column_index):
+    """
+    Validates one chunk of CSV rows.
+
+    Returns:
+        tuple: (records, errors) where records are the narrow tuples ready for
+        insert (with a trailing Timestamp when the file has that column) and
+        errors is a list of (row_offset, message).
+    """
+    width = len(column_index)
+    errors = [(offset, f"Expected {width} columns, found {len(row)}.") for offset, row in enumerate(rows) if len(row) != width]
+    if errors:
+        bad_offsets = {offset for offset, _ in errors}
+        keep = np.array([offset not in bad_offsets for offset in range(len(rows))])
+        table = np.array([row for offset, row in enumerate(rows) if offset not in bad_offsets], dtype=str).reshape(-1, width)
+    else:
+        keep = np.ones(len(rows), dtype=bool)
+        table = np.array(rows, dtype=str).reshape(-1, width)
+    offsets = np.flatnonzero(keep)
+
+    initials = table[:, column_index["TechnicianInitials"]]
+    sample_ids = table[:, column_index["SampleID"]]
+    hardness_raw = table[:, [column_index[name] for name in HARDNESS_COLUMNS]]
+    valid_mask, hardness_values, validation_errors = validate_sample_rows(initials, sample_ids, hardness_raw)
+    errors.extend((int(offsets[row]), message) for row, message in validation_errors)
+
+    timestamps = None
+    if TIMESTAMP_COLUMN in column_index:
+        timestamps, bad_timestamp = _parse_timestamps(table[:, column_index[TIMESTAMP_COLUMN]])
+        for row in np.flatnonzero(bad_timestamp & valid_mask):
+            errors.append((int(offsets[row]), "Timestamp must be in the format 'YYYY-MM-DD HH:MM:SS'."))
+        valid_mask &= ~bad_timestamp
+
+    records = sample_rows_to_records(initials[valid_mask], sample_ids[valid_mask], hardness_values[valid_mask])
+    if timestamps is not None:
+        readings_per_row = len(HARDNESS_COLUMNS)
+        record_timestamps = np.repeat(timestamps[valid_mask], readings_per_row).astype('datetime64[us]').tolist()
+        records = [record + (timestamp,) for record, timestamp in zip(records, record_timestamps)]
+    errors.sort()
+    return records, errors
+
+def import_files(conn, paths, chunk_size=DEFAULT_CHUNK_SIZE, validate_only=False, error_stream=sys.stderr):
+    """
+    Validates and imports CSV files into HardnessReadings, one transaction per chunk.
+
+    Returns:
+        tuple: (samples_imported, samples_rejected)
+    """
+    samples_imported = 0
+    samples_rejected = 0
+    for path in paths:
+        for first_line, rows, column_index in read_chunks(path, chunk_size):
+            records, errors = prepare_chunk(rows, column_index)
+            for offset, message in errors:
+                print(f"{path}:{first_line + offset}: {message}", file=error_stream)
+            samples_rejected += len(errors)
+            if not records:
+                continue
+            if not validate_only:
+                if TIMESTAMP_COLUMN in column_index:
+                    hardness_db.insert_timestamped_readings(conn, records)
+                else:
+                    hardness_db.insert_readings(conn, records)
+            samples_imported += len(records) // len(HARDNESS_COLUMNS)
+    return samples_imported, samples_rejected
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import hardness readings from CSV files (one sample per row).")
+    parser.add_argument("csv_files", nargs="+", help="CSV files with the columns " + ",".join(REQUIRED_COLUMNS) + "[,Timestamp]")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Sample rows per validation/insert batch.")
+    parser.add_argument("--validate-only", action="store_true", help="Report errors without writing to the database.")
+    hardness_db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = None if args.validate_only else hardness_db.connect_from_args(args)
+    start = time.perf_counter()
+    try:
+        if conn is not None:
+            hardness_db.create_table(conn)
+        imported, rejected = import_files(conn, args.csv_files, args.chunk_size, args.validate_only)
+    finally:
+        if conn is not None:
+            conn.close()
+    elapsed = time.perf_counter() - start
+    action = "Validated" if args.validate_only else "Imported"
+    print(f"{action} {imported} samples ({imported * len(HARDNESS_COLUMNS)} readings), rejected {rejected}, in {elapsed:.1f}s.")
+    return 1 if rejected else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
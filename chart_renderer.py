@@ -0,0 +1,202 @@
+"""
+Top/Bottom hardness chart that reuses its matplotlib artists between updates.
+
+Clearing both axes and rebuilding titles, grids, lines, limit lines and legends
+on every update (plus a tight_layout() pass and a synchronous full draw) made
+the redraw a large part of the click-to-feedback time on the thin clients.
+ChartRenderer creates every artist once and afterwards only changes their data,
+labels and axis limits; layout is recomputed only when the canvas is resized,
+and drawing is requested with draw_idle() so several updates in one event loop
+iteration cost a single render.
+
+The renderer works on any matplotlib canvas: the Tk window embeds its figure
+with FigureCanvasTkAgg, and headless callers (benchmarks, reports) can use it
+as-is on the Agg canvas it starts with.
+"""
+import math
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.layout_engine import TightLayoutEngine
+
+NUM_POSITIONS = 6
+
+# Fallback y-range when a side has neither readings nor limits to show
+DEFAULT_Y_RANGE = (290.0, 350.0)
+
+MODE_OVERLAY_COLOR = 'purple'
+
+
+def _horizontal_segments(values):
+    """x/y data drawing each value as a horizontal line across all positions (NaN-separated)."""
+    x, y = [], []
+    for value in values:
+        x.extend([-0.5, NUM_POSITIONS - 0.5, float('nan')])
+        y.extend([value, value, float('nan')])
+    return x, y
+
+
+class _SidePanel:
+    """The artists of one axis (Bottom or Top): current reading line, mean/UCL/LCL lines,
+    per-position limit ticks, EWMA/CUSUM overlay and legend."""
+
+    def __init__(self, ax, title, reading_color):
+        self.ax = ax
+        ax.set_title(title)
+        ax.set_xlabel('Position')
+        ax.set_ylabel('Hardness - BHN')
+        ax.grid(True)
+        ax.set_xticks(range(NUM_POSITIONS))
+        ax.set_xticklabels([f"{i+1}" for i in range(NUM_POSITIONS)])
+        ax.set_xlim(-0.5, NUM_POSITIONS - 0.5)
+
+        self.reading_line, = ax.plot([], [], marker='o', linestyle='-', color=reading_color, label='Current Reading')
+        self.mean_line = ax.axhline(y=0, color='blue', linestyle=':', label='Mean')
+        self.ucl_line = ax.axhline(y=0, color='red', linestyle='--', label='UCL')
+        self.lcl_line = ax.axhline(y=0, color='red', linestyle='--', label='LCL')
+        self.limit_lines = (self.mean_line, self.ucl_line, self.lcl_line)
+        # Rings around readings that complete an out-of-control pattern (kept out of the legend)
+        self.violation_markers, = ax.plot([], [], linestyle='none', marker='o', markersize=12, markerfacecolor='none',
+                                          markeredgecolor='red', markeredgewidth=2, label='_nolegend_')
+        # Each position's own mean, UCL and LCL as short horizontal ticks at its x position
+        self.position_mean_markers, = ax.plot([], [], linestyle='none', marker='_', markersize=18, markeredgewidth=2,
+                                              color='steelblue', label='Position Mean')
+        self.position_limit_markers, = ax.plot([], [], linestyle='none', marker='_', markersize=18, markeredgewidth=2,
+                                               color='darkorange', label='Position UCL/LCL')
+        # EWMA or CUSUM statistic(s) and their limits; only in the legend while a mode shows them
+        self.mode_statistic_line, = ax.plot([], [], linestyle='-', linewidth=2, color=MODE_OVERLAY_COLOR, label='_nolegend_')
+        self.mode_limit_line, = ax.plot([], [], linestyle='-.', linewidth=1, color=MODE_OVERLAY_COLOR, label='_nolegend_')
+        self.legend = ax.legend(loc='best', fontsize='small')
+        self._limits = None
+        self._mode_name = None
+
+    def _set_mode_overlay(self, mode_overlay):
+        """Draws (name, center, ucl, lcl, statistic_values) or clears the overlay; returns its y-values."""
+        name = mode_overlay[0] if mode_overlay is not None else None
+        if name != self._mode_name:
+            # The legend is rebuilt only when the overlay appears, disappears or changes mode
+            self.mode_statistic_line.set_label(name if name else '_nolegend_')
+            self.mode_limit_line.set_label(f'{name} Limits' if name else '_nolegend_')
+            self.legend.remove()
+            self.legend = self.ax.legend(loc='best', fontsize='small')
+            self._limits = None # The new legend's texts still need the limit values
+            self._mode_name = name
+        if mode_overlay is None:
+            self.mode_statistic_line.set_data([], [])
+            self.mode_limit_line.set_data([], [])
+            return []
+        _, _, ucl, lcl, statistic_values = mode_overlay
+        self.mode_statistic_line.set_data(*_horizontal_segments(statistic_values))
+        self.mode_limit_line.set_data(*_horizontal_segments([ucl, lcl]))
+        out_of_control = any(value > ucl or value < lcl for value in statistic_values)
+        self.mode_statistic_line.set_color('red' if out_of_control else MODE_OVERLAY_COLOR)
+        return list(statistic_values) + [ucl, lcl]
+
+    def update(self, current_values, mean_val, ucl, lcl, violations=(), position_limits=None, mode_overlay=None):
+        """Moves the existing artists to the new readings, limits, rule violations,
+        per-position limits ((means, ucls, lcls) lists in position order, None where unknown)
+        and EWMA/CUSUM overlay ((name, center, ucl, lcl, statistic_values) or None)."""
+        overlay_y = self._set_mode_overlay(mode_overlay)
+        self.reading_line.set_data(range(len(current_values)), current_values)
+        self.violation_markers.set_data(list(violations), [current_values[index] for index in violations])
+
+        mean_x, mean_y, position_x, position_y = [], [], [], []
+        if position_limits is not None:
+            for index, (position_mean, position_ucl, position_lcl) in enumerate(zip(*position_limits)):
+                if position_ucl is not None and position_lcl is not None:
+                    mean_x.append(index)
+                    mean_y.append(position_mean)
+                    position_x.extend([index, index])
+                    position_y.extend([position_ucl, position_lcl])
+        self.position_mean_markers.set_data(mean_x, mean_y)
+        self.position_limit_markers.set_data(position_x, position_y)
+
+        has_limits = ucl is not None and lcl is not None
+        if has_limits and (mean_val, ucl, lcl) != self._limits:
+            legend_texts = self.legend.get_texts()
+            for index, (line, name, value) in enumerate(zip(self.limit_lines, ('Mean', 'UCL', 'LCL'), (mean_val, ucl, lcl))):
+                line.set_ydata([value, value])
+                legend_texts[index + 1].set_text(f'{name} ({value:.2f})')
+        for line in self.limit_lines:
+            line.set_visible(has_limits)
+        self.legend.set_visible(has_limits)
+        self._limits = (mean_val, ucl, lcl) if has_limits else None
+
+        # Include current values and the side's own control limits for y-axis scaling
+        ylim_data = list(current_values) + position_y + overlay_y
+        if has_limits:
+            ylim_data.extend([ucl, lcl, mean_val])
+        ylim_data = [value for value in ylim_data if not math.isnan(value)] # Positions missing from a sample
+        if ylim_data:
+            min_val = min(ylim_data)
+            max_val = max(ylim_data)
+            padding = (max_val - min_val) * 0.1 if (max_val - min_val) > 0 else 1
+            self.ax.set_ylim(min(0, min_val - padding), max_val + padding)
+        else:
+            self.ax.set_ylim(*DEFAULT_Y_RANGE)
+
+
+class ChartRenderer:
+    """
+    Owns the two-axis (Bottom over Top) hardness figure and updates it in place.
+
+    Args:
+        figsize (tuple): Figure size in inches.
+    """
+
+    def __init__(self, figsize=(6, 4)):
+        self.fig = Figure(figsize=figsize)
+        FigureCanvasAgg(self.fig) # Headless canvas until a GUI canvas takes the figure over
+        ax_bottom, ax_top = self.fig.subplots(2, 1)
+        self.panels = {
+            'Bottom': _SidePanel(ax_bottom, 'Bottom Hardness Readings', 'skyblue'),
+            'Top': _SidePanel(ax_top, 'Top Hardness Readings', 'lightcoral'),
+        }
+        self._resize_connection = None
+        self.relayout()
+
+    @property
+    def ax_bottom(self):
+        return self.panels['Bottom'].ax
+
+    @property
+    def ax_top(self):
+        return self.panels['Top'].ax
+
+    def relayout(self, event=None):
+        """Recomputes the layout (only needed at creation and when the canvas is resized)."""
+        # Same as fig.tight_layout(pad=3.0), minus the placeholder layout engine it leaves on the
+        # figure, which makes every savefig() (e.g. batch reports) run an extra layout draw
+        TightLayoutEngine(pad=3.0).execute(self.fig)
+
+    def connect_canvas(self):
+        """
+        Hooks the layout pass to the current canvas' resize events. Call this after
+        embedding the figure in a GUI canvas (e.g. FigureCanvasTkAgg).
+        """
+        if self._resize_connection is not None:
+            self.fig.canvas.mpl_disconnect(self._resize_connection)
+        self._resize_connection = self.fig.canvas.mpl_connect('resize_event', self.relayout)
+
+    def update(self, current_bottom_values, current_top_values,
+               mean_bottom, ucl_bottom, lcl_bottom,
+               mean_top, ucl_top, lcl_top,
+               bottom_violations=(), top_violations=(),
+               bottom_position_limits=None, top_position_limits=None,
+               bottom_mode_overlay=None, top_mode_overlay=None, redraw=True):
+        """
+        Updates both charts with the current readings and control limits and
+        schedules a redraw. Arguments are the same as update_plot()'s; pass
+        redraw=False when the caller renders itself (e.g. with savefig), since
+        the plain Agg canvas draws synchronously inside draw_idle().
+        """
+        self.panels['Bottom'].update(current_bottom_values, mean_bottom, ucl_bottom, lcl_bottom,
+                                     bottom_violations, bottom_position_limits, bottom_mode_overlay)
+        self.panels['Top'].update(current_top_values, mean_top, ucl_top, lcl_top,
+                                  top_violations, top_position_limits, top_mode_overlay)
+        if redraw:
+            self.fig.canvas.draw_idle()
+
+    def draw(self):
+        """Renders synchronously (for headless use, e.g. before savefig or timing)."""
+        self.fig.canvas.draw()
@@ -0,0 +1,430 @@
+"""
+Optional collector service between the stations and the database.
+
+Without it, every station running Hardness_UI_Application.py opens its own
+connections, writes each sample in its own small transaction and reads the
+whole history at startup to compute the same limits as every other station.
+With COLLECTOR_URL set, a station posts its journaled samples to this service
+instead and gets its startup limits from it.
+
+The collector:
+  - Accepts journal entries (see offline_journal.py) over HTTP and writes them
+    through one warm connection. Entries posted within BATCH_DELAY seconds of
+    each other, by any number of stations, go into one transaction. A post is
+    answered once its transaction has committed, so the station only
+    acknowledges samples that are in the database. SampleKeys keep retries from
+    inserting a sample twice, as before.
+  - Reads the limit aggregates, recent values and recent sample summaries once
+    at startup and folds every committed sample into them. GET /limits serves
+    them to all stations, so a station starting up causes no database query.
+
+Endpoints (JSON):
+    POST /samples   {"entries": [journal entry, ...]} -> {"applied": [key, ...]}
+    GET  /limits    {"aggregates": [[side, position, count, mean, std_dev], ...],
+                     "recent_values": {side: [...]}, "recent_summaries": {side: [[size, mean, std_dev], ...]}}
+    GET  /health    {"status": "ok", "batches": n, "samples": n, "queued": n}
+
+Usage:
+    python collector_service.py --host 0.0.0.0 --port 8765 --server HOST --database DB --username USER
+    python collector_service.py --sqlite hardness_readings.db
+    python collector_service.py --simulate 8 --url http://localhost:8765   (stand-in stations)
+"""
+import argparse
+import json
+import queue
+import random
+import re
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import hardness_db
+from db_connection import ConnectionManager
+from hardness_validation import (HARDNESS_MAX, HARDNESS_MIN, INITIALS_MAX_LENGTH, INITIALS_MIN_LENGTH,
+                                 SAMPLE_ID_PATTERN, normalize_initials)
+from offline_journal import TIMESTAMP_FORMAT, journal_entry_records
+from spc_modes import MODE_HISTORY_SAMPLES
+from spc_rules import LOOKBACK
+from spc_statistics import (POSITIONS, SIDES, build_position_statistics_from_aggregates,
+                            update_position_statistics)
+
+DEFAULT_HOST = "127.0.0.1" # Use --host 0.0.0.0 to accept stations from the network
+DEFAULT_PORT = 8765
+BATCH_DELAY = 0.05 # Seconds the writer waits for more samples after the first one of a batch
+BATCH_MAX_SAMPLES = 500 # Samples per transaction (keeps the SampleKey IN (...) list well below 2100 parameters)
+REQUEST_TIMEOUT = 30.0 # Seconds a post waits for its transaction before it fails
+MAX_BODY_BYTES = 1024 * 1024 # Largest accepted request body
+
+
+def validate_entry(entry):
+    """
+    Checks a posted journal entry with the same rules as the data entry window and
+    normalizes its Tech Initials in place (stations journaling before the window did
+    so may post them in any case). Raises ValueError if it is malformed or a reading is invalid.
+    """
+    try:
+        key, timestamp, records = entry['key'], entry['timestamp'], entry['records']
+    except (KeyError, TypeError):
+        raise ValueError("Entries need 'key', 'timestamp' and 'records'.")
+    if not isinstance(key, str) or not 0 < len(key) <= 32: # SampleKey is NVARCHAR(32)
+        raise ValueError(f"Invalid SampleKey: {key!r}")
+    datetime.strptime(timestamp, TIMESTAMP_FORMAT) # Raises ValueError
+    if not isinstance(records, list) or not records:
+        raise ValueError(f"Sample {key} has no readings.")
+    for record in records:
+        if not isinstance(record, list) or len(record) != 5:
+            raise ValueError(f"Sample {key}: readings must be [initials, sample_id, side, position, value].")
+        initials, sample_id, side, position, value = record
+        if not isinstance(initials, str) or not INITIALS_MIN_LENGTH <= len(initials.strip()) <= INITIALS_MAX_LENGTH:
+            raise ValueError(f"Sample {key}: Tech Initials must be between {INITIALS_MIN_LENGTH} and {INITIALS_MAX_LENGTH} characters long.")
+        if not isinstance(sample_id, str) or not re.match(SAMPLE_ID_PATTERN, sample_id):
+            raise ValueError(f"Sample {key}: Sample ID must be in the format 'XXX-YY' (e.g., '123-ab').")
+        if side not in SIDES or position not in POSITIONS:
+            raise ValueError(f"Sample {key}: invalid side/position {side!r} {position!r}.")
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not HARDNESS_MIN <= value <= HARDNESS_MAX:
+            raise ValueError(f"Sample {key}: hardness must be between {HARDNESS_MIN:g} and {HARDNESS_MAX:g}.")
+    for record in records: # Only once every reading passed, so a rejected entry is left as posted
+        record[0] = normalize_initials(record[0])
+
+
+class CollectorState:
+    """
+    Limit aggregates, recent values and recent sample summaries shared by all
+    stations, in the form load_startup_data() returns them. Thread-safe.
+
+    Args:
+        aggregates (dict): {(side, position): (count, mean, std_dev)} from fetch_control_limit_aggregates().
+        recent_values (dict): {side: [values]} from fetch_recent_values(), oldest first.
+        recent_summaries (dict): {side: [(size, mean, std_dev)]} from fetch_recent_sample_summaries().
+    """
+
+    def __init__(self, aggregates, recent_values, recent_summaries):
+        self._lock = threading.Lock()
+        self._position_statistics = build_position_statistics_from_aggregates(aggregates)
+        self._recent_values = {side: deque(recent_values.get(side, []), maxlen=LOOKBACK) for side in SIDES}
+        self._recent_summaries = {side: deque(recent_summaries.get(side, []), maxlen=MODE_HISTORY_SAMPLES)
+                                  for side in SIDES}
+
+    @classmethod
+    def load(cls, conn):
+        """Reads the state from the database (the same three queries as a station's startup)."""
+        return cls(hardness_db.fetch_control_limit_aggregates(conn, by_position=True),
+                   hardness_db.fetch_recent_values(conn, LOOKBACK),
+                   hardness_db.fetch_recent_sample_summaries(conn, MODE_HISTORY_SAMPLES))
+
+    def add_records(self, records):
+        """
+        Folds committed readings in, in the order they were written (a sample
+        journaled offline for a while lands after newer ones, unlike in the
+        Timestamp order of a fresh database read).
+        """
+        summaries = hardness_db.summarize_subgroups(records)
+        with self._lock:
+            update_position_statistics(self._position_statistics, records)
+            for record in records:
+                self._recent_values[record[2]].append(float(record[4]))
+            for summary in summaries:
+                self._recent_summaries[summary[2]].append((summary[3], summary[4], summary[6]))
+
+    def to_json(self):
+        with self._lock:
+            return {
+                'aggregates': [[side, position, statistics.count, statistics.mean, statistics.std_dev]
+                               for (side, position), statistics in self._position_statistics.items()
+                               if statistics.count],
+                'recent_values': {side: list(values) for side, values in self._recent_values.items()},
+                'recent_summaries': {side: [list(summary) for summary in summaries]
+                                     for side, summaries in self._recent_summaries.items()},
+            }
+
+
+class _WriteRequest:
+    __slots__ = ('entries', 'done', 'error')
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.done = threading.Event()
+        self.error = None
+
+
+class BatchWriter:
+    """
+    Thread that coalesces the entries posted by all stations into batched transactions.
+
+    Args:
+        connection_manager (db_connection.ConnectionManager): The collector's warm connection.
+        state (CollectorState): Updated with every committed sample.
+        batch_delay (float): Seconds to wait for more samples once one has arrived.
+        max_samples (int): Samples per transaction.
+    """
+
+    def __init__(self, connection_manager, state, batch_delay=BATCH_DELAY, max_samples=BATCH_MAX_SAMPLES):
+        self._connection_manager = connection_manager
+        self._state = state
+        self._batch_delay = batch_delay
+        self._max_samples = max_samples
+        self._queue = queue.Queue()
+        self._thread = None
+        self.batches = 0
+        self.samples = 0
+
+    def queued(self):
+        return self._queue.qsize()
+
+    def write(self, entries, timeout=REQUEST_TIMEOUT):
+        """
+        Queues entries for the next batch and waits until it has committed.
+        Called on the HTTP handler threads.
+
+        Returns:
+            list: The keys of the entries (all of them are now in the database).
+        """
+        request = _WriteRequest(entries)
+        self._queue.put(request)
+        if not request.done.wait(timeout):
+            raise TimeoutError(f"The database did not commit within {timeout:g}s.")
+        if request.error is not None:
+            raise request.error
+        return [entry['key'] for entry in entries]
+
+    def _next_batch(self):
+        """Blocks for the first request, then collects more for up to batch_delay. None means stop."""
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        sample_count = len(first.entries)
+        deadline = time.monotonic() + self._batch_delay
+        while sample_count < self._max_samples:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None) # Stop after this batch
+                break
+            batch.append(request)
+            sample_count += len(request.entries)
+        return batch
+
+    def _write_batch(self, batch):
+        entries = [(entry['key'], journal_entry_records(entry)) for request in batch for entry in request.entries]
+        try:
+            new_entries = self._connection_manager.run(lambda conn: hardness_db.apply_new_journal_entries(conn, entries))
+            self._state.add_records([record for _, records in new_entries for record in records])
+            self.batches += 1
+            self.samples += len(new_entries)
+        except Exception as e: # Every station of the batch gets the error and keeps its journal
+            print(f"Batch of {len(entries)} sample(s) failed: {e}")
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done.set()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._write_batch(batch)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="collector-batch-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        """Stops the writer after the requests already queued."""
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+class CollectorHandler(BaseHTTPRequestHandler):
+    """HTTP endpoints of the collector; the server carries `writer` and `state`."""
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/limits":
+            self._send_json(200, self.server.state.to_json())
+        elif self.path == "/health":
+            writer = self.server.writer
+            self._send_json(200, {'status': 'ok', 'batches': writer.batches, 'samples': writer.samples,
+                                  'queued': writer.queued()})
+        else:
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/samples":
+            self._send_json(404, {'error': f"Unknown path {self.path}"})
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        if length > MAX_BODY_BYTES:
+            self._send_json(413, {'error': f"Request body larger than {MAX_BODY_BYTES} bytes."})
+            return
+        try:
+            entries = json.loads(self.rfile.read(length))['entries']
+            if not isinstance(entries, list):
+                raise ValueError("'entries' must be a list.")
+            for entry in entries:
+                validate_entry(entry)
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        if not entries:
+            self._send_json(200, {'applied': []})
+            return
+        try:
+            keys = self.server.writer.write(entries)
+        except Exception as e: # Database down or too slow; the station retries from its journal
+            self._send_json(503, {'error': str(e)})
+            return
+        self._send_json(200, {'applied': keys})
+
+    def log_message(self, format, *args):
+        pass # One line per post would flood the console
+
+
+def create_server(connection_manager, host=DEFAULT_HOST, port=DEFAULT_PORT, batch_delay=BATCH_DELAY):
+    """
+    Prepares the tables, loads the shared state and returns the (not yet serving)
+    ThreadingHTTPServer with its BatchWriter started.
+    """
+    connection_manager.run(hardness_db.create_table)
+    connection_manager.run(hardness_db.create_journal_table)
+    state = connection_manager.run(CollectorState.load)
+    writer = BatchWriter(connection_manager, state, batch_delay)
+    writer.start()
+    server = ThreadingHTTPServer((host, port), CollectorHandler)
+    server.daemon_threads = True
+    server.writer = writer
+    server.state = state
+    return server
+
+
+class CollectorClient:
+    """
+    Station side of the collector protocol.
+
+    Args:
+        url (str): Base URL of the collector, e.g. 'http://collector-pc:8765'.
+        timeout (float): Seconds to wait for an answer.
+    """
+
+    def __init__(self, url, timeout=REQUEST_TIMEOUT + 5):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+
+    def _request(self, path, payload=None):
+        data = None if payload is None else json.dumps(payload).encode('utf-8')
+        request = urllib.request.Request(self.url + path, data=data, headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            try:
+                message = json.loads(e.read()).get('error', e.reason)
+            except ValueError:
+                message = e.reason
+            raise RuntimeError(f"Collector returned {e.code}: {message}") from None
+
+    def apply_journal_entries(self, entries):
+        """Posts journal entries (see JournalFlusher's apply_entries) and returns the keys committed."""
+        return self._request("/samples", {'entries': entries})['applied']
+
+    def fetch_limits(self):
+        """
+        Returns:
+            tuple: (aggregates, recent_values, recent_summaries) like the station's load_startup_data().
+        """
+        limits = self._request("/limits")
+        aggregates = {(side, position): (count, mean_val, std_dev)
+                      for side, position, count, mean_val, std_dev in limits['aggregates']}
+        recent_summaries = {side: [tuple(summary) for summary in summaries]
+                            for side, summaries in limits['recent_summaries'].items()}
+        return aggregates, limits['recent_values'], recent_summaries
+
+    def health(self):
+        return self._request("/health")
+
+
+def simulate_stations(url, stations, samples, seed=None):
+    """
+    Stand-in for `stations` stations that each post `samples` random valid samples
+    one at a time, like JournalFlusher after every save.
+
+    Returns:
+        tuple: (samples posted, seconds)
+    """
+    rng = random.Random(seed)
+    keys = [f"sim{rng.getrandbits(96):024x}" for _ in range(stations * samples)]
+    seeds = [rng.random() for _ in range(stations)]
+
+    def station(index):
+        client = CollectorClient(url)
+        station_rng = random.Random(seeds[index])
+        for sample in range(samples):
+            sample_id = f"{station_rng.randint(100, 999)}-s{index % 10}"
+            records = [[f"S{index % 100:02d}", sample_id, side, position, round(station_rng.gauss(320, 8), 1)]
+                       for side in SIDES for position in POSITIONS]
+            entry = {'key': keys[index * samples + sample], 'timestamp': datetime.now().strftime(TIMESTAMP_FORMAT),
+                     'records': records}
+            client.apply_journal_entries([entry])
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=station, args=(index,)) for index in range(stations)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stations * samples, time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Collector service: batched writes and shared SPC limits for all stations.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on (0.0.0.0 for all interfaces).")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--batch-delay", type=float, default=BATCH_DELAY,
+                        help="Seconds to wait for more samples before committing a batch.")
+    parser.add_argument("--simulate", type=int, metavar="STATIONS",
+                        help="Instead of serving, post random samples from this many stand-in stations to --url.")
+    parser.add_argument("--samples", type=int, default=50, help="Samples per stand-in station.")
+    parser.add_argument("--url", default=f"http://localhost:{DEFAULT_PORT}", help="Collector URL for --simulate.")
+    hardness_db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.simulate:
+        count, elapsed = simulate_stations(args.url, args.simulate, args.samples)
+        print(f"Posted {count} samples from {args.simulate} stations in {elapsed:.1f}s "
+              f"({count / elapsed:.0f} samples/s). Collector: {CollectorClient(args.url).health()}")
+        return 0
+
+    connection_manager = ConnectionManager(lambda: hardness_db.connect_from_args(args))
+    server = create_server(connection_manager, args.host, args.port, args.batch_delay)
+    print(f"Collector listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.writer.stop()
+        connection_manager.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
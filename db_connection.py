@@ -0,0 +1,140 @@
+"""
+Persistent database connection for the lifetime of the application.
+
+Opening a pyodbc connection to SQL Server costs a full login handshake, which
+on the plant network is the largest part of a Display/Save round trip. The
+ConnectionManager keeps one warm connection, checks it with a cheap
+"SELECT 1" after it has been idle for a while, and transparently reconnects
+when the connection has been dropped.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+from hardness_db import DATABASE_ERRORS
+from instrumentation import span
+
+
+class DatabaseConnectionError(Exception):
+    """Raised when no connection to the database could be established."""
+
+
+class ConnectionManager:
+    """
+    Keeps a single warm connection and hands it out to one caller at a time.
+
+    Args:
+        connect (callable): Zero-argument factory returning a new DB-API connection.
+        health_check_interval (float): Seconds a connection may sit idle before it is
+            verified with "SELECT 1" on the next use.
+    """
+
+    def __init__(self, connect, health_check_interval=30.0):
+        self._connect = connect
+        self._health_check_interval = health_check_interval
+        self._conn = None
+        self._last_used = 0.0
+        self._lock = threading.RLock() # One caller at a time; pyodbc connections are not shared across threads
+        self._counters = {'opened': 0, 'reused': 0, 'reconnects': 0, 'health_checks': 0, 'failed_connects': 0}
+
+    @property
+    def stats(self):
+        """Returns a copy of the open/reuse/reconnect counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def _open(self):
+        try:
+            with span('connect'):
+                self._conn = self._connect()
+        except DATABASE_ERRORS as ex:
+            self._conn = None
+            self._counters['failed_connects'] += 1
+            raise DatabaseConnectionError(ex) from ex
+        self._counters['opened'] += 1
+        self._last_used = time.monotonic()
+        return self._conn
+
+    def _discard(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except DATABASE_ERRORS:
+                pass # Already broken; nothing else to release
+            self._conn = None
+
+    def _is_healthy(self):
+        self._counters['health_checks'] += 1
+        try:
+            with span('health_check'):
+                cursor = self._conn.cursor()
+                cursor.execute("SELECT 1;")
+                cursor.fetchall()
+            return True
+        except DATABASE_ERRORS:
+            return False
+
+    def _acquire(self):
+        if self._conn is None:
+            return self._open()
+        idle_seconds = time.monotonic() - self._last_used
+        if idle_seconds >= self._health_check_interval and not self._is_healthy():
+            self._discard()
+            self._counters['reconnects'] += 1
+            return self._open()
+        self._counters['reused'] += 1
+        return self._conn
+
+    @contextmanager
+    def connection(self):
+        """
+        Context manager yielding the warm connection. If the body raises
+        anything, uncommitted statements are rolled back, so the next caller's
+        commit() cannot commit them. The connection is discarded (to be reopened
+        on next use) only when a database error left it dropped.
+        """
+        with self._lock:
+            conn = self._acquire()
+            try:
+                yield conn
+            except BaseException as ex:
+                if isinstance(ex, DATABASE_ERRORS) and not self._is_healthy():
+                    self._discard()
+                else:
+                    try:
+                        conn.rollback()
+                    except DATABASE_ERRORS:
+                        self._discard() # Cannot roll back; never hand out a connection with a half-done transaction
+                raise
+            finally:
+                self._last_used = time.monotonic()
+
+    def run(self, operation, retry_on_drop=True):
+        """
+        Runs operation(conn) on the warm connection.
+
+        Args:
+            operation (callable): Function taking the connection, e.g. hardness_db.create_table.
+            retry_on_drop (bool): Reconnect and run once more if the connection turned
+                out to be dropped (as opposed to the statement itself failing).
+
+        Returns:
+            Whatever operation returns.
+        """
+        try:
+            with self.connection() as conn:
+                return operation(conn)
+        except DATABASE_ERRORS:
+            with self._lock:
+                dropped = self._conn is None
+                if dropped:
+                    self._counters['reconnects'] += 1
+            if not (retry_on_drop and dropped):
+                raise
+        with self.connection() as conn:
+            return operation(conn)
+
+    def close(self):
+        """Closes the warm connection (called when the application exits)."""
+        with self._lock:
+            self._discard()
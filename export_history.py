@@ -0,0 +1,216 @@
+"""
+Streaming export of the saved readings to CSV, Parquet or Arrow.
+
+Quality and R&D want the raw data with technician, sample and timestamp.
+fetch_all_hardness_values() keeps only the values and holds all of them in
+memory. The export reads HardnessReadings (or the compatibility view of the
+wide layout) through one cursor with fetchmany() and writes each chunk before
+reading the next. Memory use depends on the chunk size, not the table size.
+
+Output formats:
+  - CSV: the HardnessReadings columns with a header row.
+  - Parquet: one row group per chunk, typed columns (requires pyarrow).
+  - Arrow IPC file (.arrow/.feather): one record batch per chunk (requires pyarrow).
+
+Rows can be filtered by time range, technician and SampleID (with * as a
+wildcard). The file is written next to its destination and renamed when
+complete, so an interrupted export never leaves a truncated file behind.
+
+Usage:
+    python export_history.py readings.csv --sqlite hardness_readings.db
+    python export_history.py readings.parquet --start 2024-05-01 --end 2024-06-01 --technician AB \\
+        --server HOST --database DB --username USER
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np # For parsing the SQLite timestamp text of a chunk at once
+
+import hardness_db
+from hardness_validation import normalize_initials
+
+try:
+    import pyarrow as pa # For the Parquet and Arrow formats
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+except ImportError: # pyarrow is only needed for the columnar formats
+    pa = None
+
+DEFAULT_CHUNK_SIZE = 50000 # Readings per fetchmany() call
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_ARROW = 'arrow'
+FORMAT_EXTENSIONS = {'.csv': FORMAT_CSV, '.parquet': FORMAT_PARQUET, '.arrow': FORMAT_ARROW, '.feather': FORMAT_ARROW}
+
+EXPORT_COLUMNS = ["ID", "TechnicianInitials", "SampleID", "TopOrBottom", "Position", "HardnessValue", "Timestamp"]
+
+
+def format_for_path(path):
+    """Returns the export format matching the file extension (CSV for unknown extensions)."""
+    return FORMAT_EXTENSIONS.get(os.path.splitext(path)[1].lower(), FORMAT_CSV)
+
+def parse_timestamp(text):
+    """Parses 'YYYY-MM-DD' or 'YYYY-MM-DD HH:MM[:SS]' (also with a 'T'). Raises ValueError if invalid."""
+    return datetime.fromisoformat(text.strip())
+
+def build_export_query(conn, start=None, end=None, technician=None, sample_id=None):
+    """
+    Builds the filtered, time-ordered SELECT of the export.
+
+    Args:
+        conn: Open database connection.
+        start (datetime): Only readings at or after this time.
+        end (datetime): Only readings before this time.
+        technician (str): Only readings of these initials (in any case).
+        sample_id (str): Only readings of this SampleID; * matches any characters, everything else literally.
+
+    Returns:
+        tuple: (sql, params)
+    """
+    conditions = []
+    params = []
+    is_sqlite = hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE
+    for column, operator, value in (("Timestamp", ">=", start), ("Timestamp", "<", end)):
+        if value is not None:
+            conditions.append(f"{column} {operator} ?")
+            # SQLite stores the 'YYYY-MM-DD HH:MM:SS' text, which compares correctly as text
+            params.append(value.isoformat(sep=' ', timespec='seconds') if is_sqlite else value)
+    if technician:
+        conditions.append(hardness_db.TECHNICIAN_CONDITION)
+        params.append(normalize_initials(technician))
+    if sample_id:
+        if '*' in sample_id:
+            conditions.append("SampleID LIKE ? ESCAPE '\\'")
+            params.append(hardness_db.escape_like(sample_id.strip()).replace('*', '%'))
+        else:
+            conditions.append("SampleID = ?")
+            params.append(sample_id.strip())
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    sql = f"SELECT {', '.join(EXPORT_COLUMNS)} FROM {hardness_db.TABLE_NAME}{where} ORDER BY Timestamp ASC, ID ASC;"
+    return sql, params
+
+def iter_chunks(conn, sql, params, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Executes sql and yields the result in lists of at most chunk_size rows."""
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        cursor.close()
+
+def _write_csv(chunks, path):
+    count = 0
+    with open(path, 'w', newline='', encoding='utf-8') as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(EXPORT_COLUMNS)
+        for rows in chunks:
+            writer.writerows(rows)
+            count += len(rows)
+    return count
+
+def _arrow_schema():
+    return pa.schema([
+        ("ID", pa.int64()),
+        ("TechnicianInitials", pa.string()),
+        ("SampleID", pa.string()),
+        ("TopOrBottom", pa.string()),
+        ("Position", pa.int8()),
+        ("HardnessValue", pa.float64()),
+        ("Timestamp", pa.timestamp('s')),
+    ])
+
+def _timestamp_array(values):
+    """Timestamps of a chunk as datetime64[s] (SQLite returns text, pyodbc datetimes)."""
+    if values and isinstance(values[0], str):
+        return np.char.replace(np.array(values, dtype=str), ' ', 'T').astype('datetime64[s]')
+    return np.array(values, dtype='datetime64[s]')
+
+def _record_batch(rows, schema):
+    columns = list(zip(*rows))
+    arrays = [pa.array(column, type=field.type) for column, field in zip(columns[:-1], schema)]
+    arrays.append(pa.array(_timestamp_array(columns[-1]), type=schema.field("Timestamp").type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+def _write_columnar(chunks, path, export_format):
+    schema = _arrow_schema()
+    count = 0
+    if export_format == FORMAT_PARQUET:
+        writer = pq.ParquetWriter(path, schema) # Every write_batch() becomes a row group
+    else:
+        writer = ipc.new_file(path, schema)
+    try:
+        for rows in chunks:
+            writer.write_batch(_record_batch(rows, schema))
+            count += len(rows)
+    finally:
+        writer.close()
+    return count
+
+def export_history(conn, path, export_format=None, start=None, end=None, technician=None, sample_id=None,
+                   chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Streams the (filtered) readings to a file.
+
+    Args:
+        conn: Open database connection.
+        path (str): Destination file.
+        export_format (str): FORMAT_CSV, FORMAT_PARQUET or FORMAT_ARROW; by default taken from the extension.
+        start, end, technician, sample_id: Filters, see build_export_query().
+        chunk_size (int): Rows per fetchmany() call.
+
+    Returns:
+        int: Number of readings written.
+    """
+    export_format = export_format or format_for_path(path)
+    if export_format != FORMAT_CSV and pa is None:
+        raise RuntimeError("Parquet and Arrow export need the pyarrow package (pip install pyarrow).")
+    sql, params = build_export_query(conn, start, end, technician, sample_id)
+    chunks = iter_chunks(conn, sql, params, chunk_size)
+    temp_path = path + ".tmp"
+    try:
+        if export_format == FORMAT_CSV:
+            count = _write_csv(chunks, temp_path)
+        else:
+            count = _write_columnar(chunks, temp_path, export_format)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    os.replace(temp_path, path)
+    return count
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export saved hardness readings to CSV, Parquet or Arrow.")
+    parser.add_argument("output", help="Destination file (.csv, .parquet, .arrow or .feather).")
+    parser.add_argument("--format", choices=[FORMAT_CSV, FORMAT_PARQUET, FORMAT_ARROW],
+                        help="Output format (default: from the file extension).")
+    parser.add_argument("--start", type=parse_timestamp, help="Only readings at or after this time (YYYY-MM-DD[ HH:MM:SS]).")
+    parser.add_argument("--end", type=parse_timestamp, help="Only readings before this time (YYYY-MM-DD[ HH:MM:SS]).")
+    parser.add_argument("--technician", help="Only readings of these technician initials (any case).")
+    parser.add_argument("--sample-id", help="Only readings of this SampleID (* matches any characters).")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Rows per fetch.")
+    hardness_db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = hardness_db.connect_from_args(args)
+    start = time.perf_counter()
+    try:
+        count = export_history(conn, args.output, args.format, args.start, args.end, args.technician,
+                               args.sample_id, args.chunk_size)
+    finally:
+        conn.close()
+    print(f"Exported {count} readings to {args.output} in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
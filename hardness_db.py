@@ -0,0 +1,875 @@
+"""
+Database helpers for the HardnessReadings table.
+
+Every function takes an open connection, which is either a pyodbc connection to
+SQL Server (what the stations use) or a sqlite3 connection created with
+connect_sqlite() (a local stand-in so the queries can be exercised without a
+SQL Server instance). The SQL is kept identical between the two wherever
+possible; the SQLite connection gets a STDEV() aggregate registered so the
+control-limit aggregate query runs unchanged on both backends.
+
+A database can also use the wide layout (one HardnessSamples row per saved
+sample with columns B1-B6 and T1-T6, see migrate_to_wide.py). There
+HardnessReadings is a view with the old row-per-reading shape, so ad-hoc
+queries and reports keep working. The functions below detect the layout and
+read and write HardnessSamples directly.
+"""
+import math
+import os
+import sqlite3
+from itertools import groupby
+
+import numpy as np # For per-subgroup summaries of inserted readings
+
+from instrumentation import span # Query/fetch/insert timings per user action
+
+try:
+    import pyodbc # For MSSQL database connection
+except ImportError: # pyodbc is only needed for the SQL Server backend
+    pyodbc = None
+
+TABLE_NAME = "HardnessReadings"
+JOURNAL_TABLE_NAME = "HardnessJournalApplied" # SampleKeys of journaled samples already written
+SUMMARY_TABLE_NAME = "HardnessSampleSummary" # One row per saved sample and side (subgroup mean/range/stddev)
+
+# Supporting indexes for the grouped statistics: (TopOrBottom, Position) covers the
+# per-position COUNT/AVG/STDEV query, (TopOrBottom, Timestamp) the time-ordered reads per side
+READINGS_INDEXES = {
+    f"IX_{TABLE_NAME}_Side_Position": ("TopOrBottom, Position", "HardnessValue"),
+    f"IX_{TABLE_NAME}_Side_Timestamp": ("TopOrBottom, Timestamp", "HardnessValue"),
+}
+
+# Alternative one-row-per-sample layout (see migrate_to_wide.py). Once a database is switched,
+# HardnessReadings is a view over HardnessSamples and the original table is kept as HardnessReadingsNarrow.
+WIDE_TABLE_NAME = "HardnessSamples"
+NARROW_ARCHIVE_TABLE_NAME = "HardnessReadingsNarrow"
+WIDE_COLUMNS = [f"B{i+1}" for i in range(6)] + [f"T{i+1}" for i in range(6)] # Bottom 1-6, then Top 1-6
+
+LAYOUT_NARROW = 'narrow' # HardnessReadings is a table with one row per reading
+LAYOUT_WIDE = 'wide' # HardnessReadings is the compatibility view over HardnessSamples
+
+BACKEND_MSSQL = 'mssql'
+BACKEND_SQLITE = 'sqlite'
+
+# SampleKeys per IN (...) list; SQL Server allows at most 2100 parameters per statement
+APPLIED_KEYS_PER_QUERY = 1000
+
+# Filter on technician initials, matching them case-insensitively (older rows may be lower case);
+# the parameter is hardness_validation.normalize_initials() of the wanted initials
+TECHNICIAN_CONDITION = "UPPER(TechnicianInitials) = ?"
+
+# Exceptions raised by either backend, for callers that need to catch "any database error"
+DATABASE_ERRORS = (sqlite3.Error,) + ((pyodbc.Error,) if pyodbc is not None else ())
+
+
+class _SampleStdevAggregate:
+    """SQLite aggregate matching SQL Server's STDEV() (sample standard deviation, NULL below 2 rows)."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def step(self, value):
+        if value is None:
+            return
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def finalize(self):
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+
+def build_connection_string(db_config):
+    """Builds the ODBC connection string for SQL Server from a DB_CONFIG dictionary."""
+    return (
+        f"DRIVER={{ODBC Driver 17 for SQL Server}};"
+        f"SERVER={db_config['server']};"
+        f"DATABASE={db_config['database']};"
+        f"UID={db_config['username']};"
+        f"PWD={db_config['password']}"
+    )
+
+def connect_mssql(db_config):
+    """Opens a pyodbc connection to SQL Server. Raises pyodbc.Error on failure."""
+    if pyodbc is None:
+        raise RuntimeError("pyodbc is not installed; install it to use the SQL Server backend.")
+    return pyodbc.connect(build_connection_string(db_config))
+
+def connect_sqlite(path):
+    """
+    Opens a SQLite connection that understands the same queries as SQL Server.
+
+    Args:
+        path (str): Database file path, or ':memory:'.
+
+    Returns:
+        sqlite3.Connection: Connection with the STDEV() aggregate registered.
+    """
+    # Callers serialise access themselves (see db_connection.ConnectionManager), so the
+    # connection may be used from the background worker thread as well as the UI thread
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.create_aggregate("STDEV", 1, _SampleStdevAggregate)
+    return conn
+
+def add_connection_arguments(parser):
+    """
+    Adds the database connection options shared by the command-line tools.
+    With --sqlite the tool works on a local SQLite file; otherwise it connects
+    to SQL Server (the password may also come from HARDNESS_DB_PASSWORD).
+    """
+    group = parser.add_argument_group("database connection")
+    group.add_argument("--sqlite", metavar="PATH", help="Use a local SQLite database file instead of SQL Server.")
+    group.add_argument("--server", help="SQL Server name, e.g. 'localhost\\SQLEXPRESS'.")
+    group.add_argument("--database", help="SQL Server database name.")
+    group.add_argument("--username", help="SQL Server user name.")
+    group.add_argument("--password", default=os.environ.get("HARDNESS_DB_PASSWORD"),
+                       help="SQL Server password (default: $HARDNESS_DB_PASSWORD).")
+
+def connect_from_args(args):
+    """Opens the connection described by the options from add_connection_arguments()."""
+    if args.sqlite:
+        return connect_sqlite(args.sqlite)
+    return connect_mssql({
+        'server': args.server,
+        'database': args.database,
+        'username': args.username,
+        'password': args.password,
+    })
+
+def backend_of(conn):
+    """Returns BACKEND_SQLITE or BACKEND_MSSQL for an open connection."""
+    return BACKEND_SQLITE if isinstance(conn, sqlite3.Connection) else BACKEND_MSSQL
+
+
+def escape_like(text):
+    """Escapes the LIKE wildcards of text for a "LIKE ? ESCAPE '\\'" pattern."""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def storage_layout(conn):
+    """Returns LAYOUT_WIDE if HardnessReadings is the compatibility view over HardnessSamples, else LAYOUT_NARROW."""
+    cursor = conn.cursor()
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute("SELECT type FROM sqlite_master WHERE name = ?;", (TABLE_NAME,))
+        row = cursor.fetchone()
+        return LAYOUT_WIDE if row is not None and row[0] == 'view' else LAYOUT_NARROW
+    cursor.execute("SELECT type FROM sys.objects WHERE name = ?;", (TABLE_NAME,))
+    row = cursor.fetchone()
+    return LAYOUT_WIDE if row is not None and row[0].strip() == 'V' else LAYOUT_NARROW
+
+def create_table(conn):
+    """Creates the HardnessReadings table (or, in the wide layout, HardnessSamples) if it does not exist and commits."""
+    cursor = conn.cursor()
+    if storage_layout(conn) == LAYOUT_WIDE:
+        create_wide_table(conn)
+        create_summary_table(conn)
+        conn.commit()
+        backfill_sample_summary(conn)
+        return
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE_NAME} (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+                TopOrBottom NVARCHAR(10) NOT NULL,
+                Position INT NOT NULL,
+                HardnessValue FLOAT NOT NULL,
+                Timestamp DATETIME DEFAULT (datetime('now', 'localtime'))
+            );
+        """)
+    else:
+        # SQL to create table with columns: Technician Initials, Sample ID, Top/Bottom, Position, Hardness Value, Timestamp
+        # Using NVARCHAR for text fields and FLOAT for hardness value, DATETIME for timestamp
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{TABLE_NAME}' and xtype='U')
+            CREATE TABLE {TABLE_NAME} (
+                ID INT PRIMARY KEY IDENTITY(1,1),
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+                TopOrBottom NVARCHAR(10) NOT NULL,
+                Position INT NOT NULL,
+                HardnessValue FLOAT NOT NULL,
+                Timestamp DATETIME DEFAULT GETDATE()
+            );
+        """)
+    create_summary_table(conn)
+    create_readings_indexes(conn)
+    conn.commit()
+    backfill_sample_summary(conn)
+
+def create_summary_table(conn):
+    """Creates the HardnessSampleSummary table if it does not exist (does not commit)."""
+    cursor = conn.cursor()
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {SUMMARY_TABLE_NAME} (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+                TopOrBottom NVARCHAR(10) NOT NULL,
+                SubgroupSize INT NOT NULL,
+                MeanValue FLOAT NOT NULL,
+                RangeValue FLOAT NOT NULL,
+                StdDevValue FLOAT NULL,
+                Timestamp DATETIME DEFAULT (datetime('now', 'localtime'))
+            );
+        """)
+    else:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{SUMMARY_TABLE_NAME}' and xtype='U')
+            CREATE TABLE {SUMMARY_TABLE_NAME} (
+                ID INT PRIMARY KEY IDENTITY(1,1),
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+                TopOrBottom NVARCHAR(10) NOT NULL,
+                SubgroupSize INT NOT NULL,
+                MeanValue FLOAT NOT NULL,
+                RangeValue FLOAT NOT NULL,
+                StdDevValue FLOAT NULL,
+                Timestamp DATETIME DEFAULT GETDATE()
+            );
+        """)
+
+def create_wide_table(conn):
+    """
+    Creates HardnessSamples (one row per saved sample, B1-B6 and T1-T6) and its
+    (Timestamp, ID) index if they do not exist (does not commit). The hardness
+    columns are nullable so that incomplete samples found during migration fit.
+    """
+    cursor = conn.cursor()
+    hardness_columns = ",\n".join(f"                {column} FLOAT NULL" for column in WIDE_COLUMNS)
+    index_name = f"IX_{WIDE_TABLE_NAME}_Timestamp"
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {WIDE_TABLE_NAME} (
+                ID INTEGER PRIMARY KEY AUTOINCREMENT,
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+{hardness_columns},
+                Timestamp DATETIME DEFAULT (datetime('now', 'localtime'))
+            );
+        """)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {WIDE_TABLE_NAME} (Timestamp, ID);")
+    else:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{WIDE_TABLE_NAME}' and xtype='U')
+            CREATE TABLE {WIDE_TABLE_NAME} (
+                ID INT PRIMARY KEY IDENTITY(1,1),
+                TechnicianInitials NVARCHAR(50) NOT NULL,
+                SampleID NVARCHAR(100) NOT NULL,
+{hardness_columns},
+                Timestamp DATETIME DEFAULT GETDATE()
+            );
+        """)
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{index_name}')
+            CREATE INDEX {index_name} ON {WIDE_TABLE_NAME} (Timestamp, ID);
+        """)
+
+def compatibility_view_sql(view_name=TABLE_NAME):
+    """
+    CREATE VIEW statement presenting HardnessSamples as the original one-row-per-reading
+    HardnessReadings, so existing queries (and reports) keep working unchanged. Reading IDs
+    are derived as SampleRowID * 12 + column index, which keeps the (Timestamp, ID) order.
+    """
+    selects = []
+    for index, column in enumerate(WIDE_COLUMNS):
+        side = 'Bottom' if column.startswith('B') else 'Top'
+        selects.append(f"SELECT ID * 12 + {index} AS ID, TechnicianInitials, SampleID, '{side}' AS TopOrBottom, "
+                       f"{column[1:]} AS Position, {column} AS HardnessValue, Timestamp "
+                       f"FROM {WIDE_TABLE_NAME} WHERE {column} IS NOT NULL")
+    return f"CREATE VIEW {view_name} AS\n" + "\nUNION ALL\n".join(selects) + ";"
+
+def readings_to_wide_rows(records):
+    """
+    Folds narrow reading records into one row per sample: consecutive records of the same
+    technician and SampleID form a sample until a side/position repeats.
+
+    Args:
+        records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue[, Timestamp]) tuples.
+
+    Returns:
+        list: (TechnicianInitials, SampleID, B1..B6, T1..T6[, Timestamp]) tuples, None for missing positions.
+    """
+    rows = []
+    current_key = None
+    values = None
+    timestamp = None
+    has_timestamp = bool(records) and len(records[0]) > 5
+
+    def finish():
+        if values is not None:
+            row = current_key + tuple(values)
+            rows.append(row + (timestamp,) if has_timestamp else row)
+
+    for record in records:
+        column = (0 if record[2] == 'Bottom' else 6) + int(record[3]) - 1
+        if tuple(record[:2]) != current_key or values[column] is not None:
+            finish()
+            current_key = tuple(record[:2])
+            values = [None] * len(WIDE_COLUMNS)
+            timestamp = record[5] if has_timestamp else None
+        values[column] = record[4]
+    finish()
+    return rows
+
+def insert_wide_rows(conn, rows):
+    """Inserts rows from readings_to_wide_rows() into HardnessSamples (does not commit)."""
+    if not rows:
+        return
+    columns = "TechnicianInitials, SampleID, " + ", ".join(WIDE_COLUMNS)
+    if len(rows[0]) > 2 + len(WIDE_COLUMNS):
+        columns += ", Timestamp"
+    placeholders = ", ".join("?" for _ in rows[0])
+    cursor = _insert_cursor(conn)
+    cursor.executemany(f"INSERT INTO {WIDE_TABLE_NAME} ({columns}) VALUES ({placeholders});", rows)
+
+def create_readings_indexes(conn):
+    """
+    Creates the READINGS_INDEXES on HardnessReadings if they do not exist. On SQL Server
+    HardnessValue is an INCLUDE column so the grouped statistics are answered from the index
+    alone; SQLite gets it as a trailing key column for the same effect.
+    """
+    cursor = conn.cursor()
+    for index_name, (key_columns, included_column) in READINGS_INDEXES.items():
+        if backend_of(conn) == BACKEND_SQLITE:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {TABLE_NAME} ({key_columns}, {included_column});")
+        else:
+            cursor.execute(f"""
+                IF NOT EXISTS (SELECT * FROM sys.indexes WHERE name='{index_name}')
+                CREATE INDEX {index_name} ON {TABLE_NAME} ({key_columns}) INCLUDE ({included_column});
+            """)
+
+def backfill_sample_summary(conn):
+    """
+    Fills HardnessSampleSummary from HardnessReadings with one server-side
+    INSERT ... SELECT when the summary is still empty (first start after upgrading).
+    Like summarize_subgroups(), every run of consecutive readings (in ID order) with
+    the same technician, SampleID and side is one subgroup, so a SampleID saved twice
+    gives two subgroups of 6 and not one of 12.
+    """
+    cursor = conn.cursor()
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute(f"SELECT 1 FROM {SUMMARY_TABLE_NAME} LIMIT 1;")
+    else:
+        cursor.execute(f"SELECT TOP 1 1 FROM {SUMMARY_TABLE_NAME};")
+    if cursor.fetchone() is not None:
+        return
+    # A run starts where technician, SampleID or side differs from the previous reading;
+    # the running count of run starts numbers the runs
+    cursor.execute(f"""
+        WITH Marked AS (
+            SELECT ID, TechnicianInitials, SampleID, TopOrBottom, HardnessValue, Timestamp,
+                   CASE WHEN LAG(TechnicianInitials) OVER (ORDER BY ID) = TechnicianInitials
+                             AND LAG(SampleID) OVER (ORDER BY ID) = SampleID
+                             AND LAG(TopOrBottom) OVER (ORDER BY ID) = TopOrBottom
+                        THEN 0 ELSE 1 END AS RunStart
+            FROM {TABLE_NAME}
+        ), Runs AS (
+            SELECT *, SUM(RunStart) OVER (ORDER BY ID ROWS UNBOUNDED PRECEDING) AS RunNumber
+            FROM Marked
+        )
+        INSERT INTO {SUMMARY_TABLE_NAME}
+            (TechnicianInitials, SampleID, TopOrBottom, SubgroupSize, MeanValue, RangeValue, StdDevValue, Timestamp)
+        SELECT TechnicianInitials, SampleID, TopOrBottom, COUNT(*), AVG(HardnessValue),
+               MAX(HardnessValue) - MIN(HardnessValue), STDEV(HardnessValue), MIN(Timestamp)
+        FROM Runs
+        GROUP BY RunNumber, TechnicianInitials, SampleID, TopOrBottom
+        ORDER BY RunNumber;
+    """)
+    conn.commit()
+
+def create_journal_table(conn):
+    """Creates the table of applied journal SampleKeys (see offline_journal.py) if it does not exist."""
+    cursor = conn.cursor()
+    if backend_of(conn) == BACKEND_SQLITE:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS {JOURNAL_TABLE_NAME} (
+                SampleKey NVARCHAR(32) PRIMARY KEY,
+                AppliedAt DATETIME DEFAULT (datetime('now', 'localtime'))
+            );
+        """)
+    else:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{JOURNAL_TABLE_NAME}' and xtype='U')
+            CREATE TABLE {JOURNAL_TABLE_NAME} (
+                SampleKey NVARCHAR(32) PRIMARY KEY,
+                AppliedAt DATETIME DEFAULT GETDATE()
+            );
+        """)
+    conn.commit()
+
+def fetch_all_hardness_values(conn):
+    """
+    Reads every historical hardness value, separated by Top/Bottom, in time order.
+
+    Returns:
+        tuple: (bottom_hardness_values, top_hardness_values) as lists of floats.
+    """
+    if storage_layout(conn) == LAYOUT_WIDE:
+        return _fetch_all_wide_values(conn)
+    bottom_hardness_values = []
+    top_hardness_values = []
+    cursor = conn.cursor()
+    with span('query'):
+        cursor.execute(f"SELECT HardnessValue, TopOrBottom FROM {TABLE_NAME} ORDER BY Timestamp ASC, ID ASC;")
+    with span('fetch'):
+        rows = cursor.fetchall()
+    for value, category in rows:
+        if category == 'Bottom':
+            bottom_hardness_values.append(value)
+        elif category == 'Top':
+            top_hardness_values.append(value)
+    return bottom_hardness_values, top_hardness_values
+
+def _wide_value_matrix(rows):
+    """(len(rows), 12) float array of B1..T6 rows, NaN where a position is missing."""
+    if not rows:
+        return np.empty((0, len(WIDE_COLUMNS)))
+    return np.array([[np.nan if value is None else value for value in row] for row in rows], dtype=np.float64)
+
+def _side_values(matrix, side):
+    """A side's readings from a wide value matrix, sample by sample in position order."""
+    values = (matrix[:, :6] if side == 'Bottom' else matrix[:, 6:]).ravel()
+    return values[~np.isnan(values)]
+
+def _fetch_all_wide_values(conn):
+    cursor = conn.cursor()
+    with span('query'):
+        cursor.execute(f"SELECT {', '.join(WIDE_COLUMNS)} FROM {WIDE_TABLE_NAME} ORDER BY Timestamp ASC, ID ASC;")
+    with span('fetch'):
+        rows = cursor.fetchall()
+    matrix = _wide_value_matrix(rows)
+    return _side_values(matrix, 'Bottom').tolist(), _side_values(matrix, 'Top').tolist()
+
+def fetch_sample_matrix(conn):
+    """
+    Reads every saved sample as one row of its 12 readings, in time order.
+
+    Returns:
+        np.ndarray: (samples, 12) float array with columns B1-B6, T1-T6 (WIDE_COLUMNS),
+        NaN where a sample lacks a position.
+    """
+    cursor = conn.cursor()
+    if storage_layout(conn) == LAYOUT_WIDE:
+        with span('query'):
+            cursor.execute(f"SELECT {', '.join(WIDE_COLUMNS)} FROM {WIDE_TABLE_NAME} ORDER BY Timestamp ASC, ID ASC;")
+        with span('fetch'):
+            rows = cursor.fetchall()
+        return _wide_value_matrix(rows)
+    with span('query'):
+        cursor.execute(f"SELECT TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue FROM {TABLE_NAME} "
+                       f"ORDER BY Timestamp ASC, ID ASC;")
+    with span('fetch'):
+        rows = cursor.fetchall()
+    return _wide_value_matrix([row[2:] for row in readings_to_wide_rows(rows)])
+
+def fetch_samples(conn, end=None):
+    """
+    Reads every saved sample (before `end`, if given) with its technician, SampleID
+    and timestamp, in time order, in one query.
+
+    Args:
+        conn: Open database connection.
+        end (datetime): Only samples saved before this time.
+
+    Returns:
+        tuple: (samples, matrix) where samples is a list of (TechnicianInitials, SampleID, Timestamp)
+        tuples and matrix the (samples, 12) float array of their readings as in fetch_sample_matrix().
+    """
+    wide = storage_layout(conn) == LAYOUT_WIDE
+    where, params = "", []
+    if end is not None:
+        where = " WHERE Timestamp < ?"
+        # SQLite stores the 'YYYY-MM-DD HH:MM:SS' text, which compares correctly as text
+        params.append(end.isoformat(sep=' ', timespec='seconds') if backend_of(conn) == BACKEND_SQLITE else end)
+    cursor = conn.cursor()
+    with span('query'):
+        if wide:
+            cursor.execute(f"SELECT TechnicianInitials, SampleID, {', '.join(WIDE_COLUMNS)}, Timestamp "
+                           f"FROM {WIDE_TABLE_NAME}{where} ORDER BY Timestamp ASC, ID ASC;", params)
+        else:
+            cursor.execute(f"SELECT TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp "
+                           f"FROM {TABLE_NAME}{where} ORDER BY Timestamp ASC, ID ASC;", params)
+    with span('fetch'):
+        rows = cursor.fetchall()
+    if not wide:
+        rows = readings_to_wide_rows(rows)
+    samples = [(row[0], row[1], row[-1]) for row in rows]
+    return samples, _wide_value_matrix([row[2:-1] for row in rows])
+
+def fetch_readings_since(conn, after_id=0):
+    """
+    Reads the readings with a storage ID above after_id, with technician, SampleID and
+    timestamp, in time order. The ID is the one of the storage table: HardnessReadings in
+    the narrow layout, HardnessSamples (one ID per sample) in the wide one.
+
+    Args:
+        conn: Open database connection.
+        after_id (int): Storage ID to read after (0 for everything).
+
+    Returns:
+        tuple: (records, ids) where records are (TechnicianInitials, SampleID, TopOrBottom,
+        Position, HardnessValue, Timestamp) tuples and ids the storage ID of each record.
+    """
+    cursor = conn.cursor()
+    if storage_layout(conn) == LAYOUT_WIDE:
+        with span('query'):
+            cursor.execute(f"SELECT TechnicianInitials, SampleID, {', '.join(WIDE_COLUMNS)}, Timestamp, ID "
+                           f"FROM {WIDE_TABLE_NAME} WHERE ID > ? ORDER BY Timestamp ASC, ID ASC;", (after_id,))
+        with span('fetch'):
+            rows = cursor.fetchall()
+        records, ids = [], []
+        for row in rows:
+            for index, value in enumerate(row[2:2 + len(WIDE_COLUMNS)]):
+                if value is not None:
+                    records.append((row[0], row[1], 'Bottom' if index < 6 else 'Top', index % 6 + 1, value, row[-2]))
+                    ids.append(row[-1])
+    else:
+        with span('query'):
+            cursor.execute(f"SELECT TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp, ID "
+                           f"FROM {TABLE_NAME} WHERE ID > ? ORDER BY Timestamp ASC, ID ASC;", (after_id,))
+        with span('fetch'):
+            rows = cursor.fetchall()
+        records = [tuple(row[:6]) for row in rows]
+        ids = [row[-1] for row in rows]
+    return records, ids
+
+def _merge_aggregates(aggregates):
+    """
+    Pools (count, mean, std_dev) tuples of disjoint groups into one (Chan et al.'s
+    parallel variance formula), so per-column results give the per-side ones.
+    """
+    count, mean_val, m2 = 0, 0.0, 0.0
+    for group_count, group_mean, group_std in aggregates:
+        if group_count == 0:
+            continue
+        group_m2 = 0.0 if group_std is None else group_std ** 2 * (group_count - 1)
+        total = count + group_count
+        delta = group_mean - mean_val
+        mean_val += delta * group_count / total
+        m2 += group_m2 + delta ** 2 * count * group_count / total
+        count = total
+    return count, mean_val, math.sqrt(m2 / (count - 1)) if count > 1 else None
+
+def _fetch_wide_control_limit_aggregates(conn, by_position):
+    selects = ", ".join(f"COUNT({column}), AVG({column}), STDEV({column})" for column in WIDE_COLUMNS)
+    cursor = conn.cursor()
+    with span('query'):
+        cursor.execute(f"SELECT {selects} FROM {WIDE_TABLE_NAME};")
+    with span('fetch'):
+        row = cursor.fetchone()
+    position_aggregates = {}
+    for index, column in enumerate(WIDE_COLUMNS):
+        count, mean_val, std_dev = row[3 * index:3 * index + 3]
+        if count:
+            side = 'Bottom' if column.startswith('B') else 'Top'
+            position_aggregates[(side, int(column[1:]))] = (int(count), float(mean_val),
+                                                             None if std_dev is None else float(std_dev))
+    if by_position:
+        return position_aggregates
+    aggregates = {}
+    for side in ('Bottom', 'Top'):
+        side_groups = [value for (group_side, _), value in position_aggregates.items() if group_side == side]
+        if side_groups:
+            aggregates[side] = _merge_aggregates(side_groups)
+    return aggregates
+
+def fetch_control_limit_aggregates(conn, by_position=False):
+    """
+    Asks the database for COUNT, AVG and STDEV of the hardness values grouped by
+    TopOrBottom (and optionally Position), so only a handful of rows cross the
+    network no matter how large the table is.
+
+    Args:
+        conn: Open database connection.
+        by_position (bool): Also group by Position (1-6).
+
+    Returns:
+        dict: {side: (count, mean, std_dev)} or, with by_position,
+              {(side, position): (count, mean, std_dev)}. std_dev is None for
+              groups with fewer than 2 values.
+    """
+    if storage_layout(conn) == LAYOUT_WIDE:
+        # One row of per-column aggregates instead of a GROUP BY over the compatibility view
+        return _fetch_wide_control_limit_aggregates(conn, by_position)
+    group_columns = "TopOrBottom, Position" if by_position else "TopOrBottom"
+    cursor = conn.cursor()
+    with span('query'):
+        cursor.execute(f"""
+            SELECT {group_columns}, COUNT(*), AVG(HardnessValue), STDEV(HardnessValue)
+            FROM {TABLE_NAME}
+            GROUP BY {group_columns};
+        """)
+    with span('fetch'):
+        rows = cursor.fetchall()
+    aggregates = {}
+    for row in rows:
+        if by_position:
+            key = (row[0], int(row[1]))
+            count, mean_val, std_dev = row[2], row[3], row[4]
+        else:
+            key = row[0]
+            count, mean_val, std_dev = row[1], row[2], row[3]
+        aggregates[key] = (int(count), float(mean_val), None if std_dev is None else float(std_dev))
+    return aggregates
+
+def fetch_recent_values(conn, count):
+    """
+    Reads the most recent hardness values of each side (context for the Nelson rules).
+
+    Args:
+        conn: Open database connection.
+        count (int): Values per side.
+
+    Returns:
+        dict: {'Bottom': [...], 'Top': [...]}, oldest first.
+    """
+    is_sqlite = backend_of(conn) == BACKEND_SQLITE
+    cursor = conn.cursor()
+    if storage_layout(conn) == LAYOUT_WIDE:
+        sample_count = -(-count // 6) + 2 # Enough samples for `count` readings even if a few are incomplete
+        columns = ", ".join(WIDE_COLUMNS)
+        with span('query'):
+            if is_sqlite:
+                cursor.execute(f"SELECT {columns} FROM {WIDE_TABLE_NAME} ORDER BY Timestamp DESC, ID DESC LIMIT ?;",
+                               (sample_count,))
+            else:
+                cursor.execute(f"SELECT TOP (?) {columns} FROM {WIDE_TABLE_NAME} ORDER BY Timestamp DESC, ID DESC;",
+                               (sample_count,))
+        with span('fetch'):
+            matrix = _wide_value_matrix(cursor.fetchall()[::-1])
+        return {side: _side_values(matrix, side)[-count:].tolist() if count else [] for side in ('Bottom', 'Top')}
+    recent_values = {}
+    for side in ('Bottom', 'Top'):
+        with span('query'):
+            if is_sqlite:
+                cursor.execute(f"SELECT HardnessValue FROM {TABLE_NAME} WHERE TopOrBottom = ? "
+                               f"ORDER BY Timestamp DESC, ID DESC LIMIT ?;", (side, count))
+            else:
+                cursor.execute(f"SELECT TOP (?) HardnessValue FROM {TABLE_NAME} WHERE TopOrBottom = ? "
+                               f"ORDER BY Timestamp DESC, ID DESC;", (count, side))
+        with span('fetch'):
+            recent_values[side] = [row[0] for row in cursor.fetchall()][::-1]
+    return recent_values
+
+def fetch_sample_summaries(conn):
+    """
+    Reads the per-sample subgroup summaries in time order.
+
+    Returns:
+        dict: {side: {'sample_ids': [...], 'sizes': np.ndarray, 'means': np.ndarray,
+               'ranges': np.ndarray, 'std_devs': np.ndarray (NaN where undefined)}}
+    """
+    cursor = conn.cursor()
+    with span('query'):
+        cursor.execute(f"""
+            SELECT TopOrBottom, SampleID, SubgroupSize, MeanValue, RangeValue, StdDevValue
+            FROM {SUMMARY_TABLE_NAME}
+            ORDER BY Timestamp ASC, ID ASC;
+        """)
+    with span('fetch'):
+        rows = cursor.fetchall()
+    rows_by_side = {'Bottom': [], 'Top': []}
+    for side, sample_id, size, mean_val, range_val, std_dev in rows:
+        if side in rows_by_side:
+            rows_by_side[side].append((sample_id, size, mean_val, range_val, np.nan if std_dev is None else std_dev))
+    summaries = {}
+    for side, rows in rows_by_side.items():
+        summaries[side] = {
+            'sample_ids': [row[0] for row in rows],
+            'sizes': np.array([row[1] for row in rows], dtype=np.int64),
+            'means': np.array([row[2] for row in rows], dtype=np.float64),
+            'ranges': np.array([row[3] for row in rows], dtype=np.float64),
+            'std_devs': np.array([row[4] for row in rows], dtype=np.float64),
+        }
+    return summaries
+
+def fetch_recent_sample_summaries(conn, count):
+    """
+    Reads the subgroup summaries of the `count` most recent samples of each side.
+
+    Returns:
+        dict: {'Bottom': [(size, mean, std_dev), ...], 'Top': [...]}, oldest first;
+              std_dev is None for single-reading subgroups.
+    """
+    is_sqlite = backend_of(conn) == BACKEND_SQLITE
+    cursor = conn.cursor()
+    recent_summaries = {}
+    for side in ('Bottom', 'Top'):
+        with span('query'):
+            if is_sqlite:
+                cursor.execute(f"SELECT SubgroupSize, MeanValue, StdDevValue FROM {SUMMARY_TABLE_NAME} "
+                               f"WHERE TopOrBottom = ? ORDER BY Timestamp DESC, ID DESC LIMIT ?;", (side, count))
+            else:
+                cursor.execute(f"SELECT TOP (?) SubgroupSize, MeanValue, StdDevValue FROM {SUMMARY_TABLE_NAME} "
+                               f"WHERE TopOrBottom = ? ORDER BY Timestamp DESC, ID DESC;", (count, side))
+        with span('fetch'):
+            recent_summaries[side] = [(int(size), float(mean_val), None if std_dev is None else float(std_dev))
+                                      for size, mean_val, std_dev in cursor.fetchall()][::-1]
+    return recent_summaries
+
+def summarize_subgroups(records):
+    """
+    Computes the subgroup summary of each run of consecutive records that share
+    technician, SampleID and side (one save = one Bottom and one Top subgroup).
+
+    Args:
+        records (list): Reading tuples starting with
+            (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue[, Timestamp]).
+
+    Returns:
+        list: (TechnicianInitials, SampleID, TopOrBottom, SubgroupSize, Mean, Range, StdDev[, Timestamp])
+        tuples; StdDev is None for single-reading subgroups.
+    """
+    if not records:
+        return []
+    keys = []
+    sizes = []
+    for key, group in groupby(records, key=lambda record: record[:3]):
+        keys.append(key)
+        sizes.append(sum(1 for _ in group))
+    sizes = np.array(sizes)
+    starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+    values = np.fromiter((record[4] for record in records), dtype=np.float64, count=len(records))
+
+    means = np.add.reduceat(values, starts) / sizes
+    ranges = np.maximum.reduceat(values, starts) - np.minimum.reduceat(values, starts)
+    squared_deviations = np.add.reduceat(np.square(values - np.repeat(means, sizes)), starts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        std_devs = np.sqrt(squared_deviations / (sizes - 1))
+
+    has_timestamp = len(records[0]) > 5
+    summaries = []
+    for index, key in enumerate(keys):
+        summary = key + (int(sizes[index]), float(means[index]), float(ranges[index]),
+                         float(std_devs[index]) if sizes[index] > 1 else None)
+        if has_timestamp:
+            summary += (records[starts[index]][5],)
+        summaries.append(summary)
+    return summaries
+
+def insert_sample_summaries(conn, summaries):
+    """Inserts rows produced by summarize_subgroups() (does not commit)."""
+    if not summaries:
+        return
+    columns = "TechnicianInitials, SampleID, TopOrBottom, SubgroupSize, MeanValue, RangeValue, StdDevValue"
+    placeholders = "?, ?, ?, ?, ?, ?, ?"
+    if len(summaries[0]) > 7:
+        columns += ", Timestamp"
+        placeholders += ", ?"
+        if backend_of(conn) == BACKEND_SQLITE:
+            summaries = [summary[:7] + (summary[7].isoformat(sep=' ', timespec='seconds'),) for summary in summaries]
+    cursor = _insert_cursor(conn)
+    cursor.executemany(f"INSERT INTO {SUMMARY_TABLE_NAME} ({columns}) VALUES ({placeholders});", summaries)
+
+def _insert_cursor(conn):
+    cursor = conn.cursor()
+    if backend_of(conn) == BACKEND_MSSQL:
+        cursor.fast_executemany = True # Send the parameter array in one round trip instead of one per row
+    return cursor
+
+def insert_readings(conn, records, commit=True):
+    """
+    Inserts (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue)
+    tuples, plus their per-sample summary rows, in one transaction and commits
+    (unless commit is False).
+    """
+    insert_sql = f"""
+        INSERT INTO {TABLE_NAME} (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue)
+        VALUES (?, ?, ?, ?, ?);
+    """
+    wide = storage_layout(conn) == LAYOUT_WIDE
+    with span('insert'):
+        if wide:
+            insert_wide_rows(conn, readings_to_wide_rows(records))
+        else:
+            cursor = _insert_cursor(conn)
+            cursor.executemany(insert_sql, records)
+        insert_sample_summaries(conn, summarize_subgroups(records))
+        if commit:
+            conn.commit()
+
+def insert_timestamped_readings(conn, records, commit=True):
+    """
+    Inserts (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp)
+    tuples, for readings taken earlier than they are written (imports, offline capture),
+    plus their per-sample summary rows. Timestamp is a datetime. Commits unless commit is False.
+    """
+    insert_sql = f"""
+        INSERT INTO {TABLE_NAME} (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp)
+        VALUES (?, ?, ?, ?, ?, ?);
+    """
+    summaries = summarize_subgroups(records)
+    if backend_of(conn) == BACKEND_SQLITE:
+        # Store the same 'YYYY-MM-DD HH:MM:SS' text as the column default produces
+        records = [record[:5] + (record[5].isoformat(sep=' ', timespec='seconds'),) for record in records]
+    wide = storage_layout(conn) == LAYOUT_WIDE
+    with span('insert'):
+        if wide:
+            insert_wide_rows(conn, readings_to_wide_rows(records))
+        else:
+            cursor = _insert_cursor(conn)
+            cursor.executemany(insert_sql, records)
+        insert_sample_summaries(conn, summaries)
+        if commit:
+            conn.commit()
+
+def fetch_applied_journal_keys(conn, keys):
+    """
+    Returns:
+        set: The SampleKeys among keys that are in HardnessJournalApplied (already written).
+    """
+    keys = list(dict.fromkeys(keys))
+    applied = set()
+    cursor = conn.cursor()
+    for start in range(0, len(keys), APPLIED_KEYS_PER_QUERY):
+        chunk = keys[start:start + APPLIED_KEYS_PER_QUERY]
+        placeholders = ", ".join("?" for _ in chunk)
+        with span('query'):
+            cursor.execute(f"SELECT SampleKey FROM {JOURNAL_TABLE_NAME} WHERE SampleKey IN ({placeholders});", chunk)
+            applied.update(row[0] for row in cursor.fetchall())
+    return applied
+
+def apply_journal_entries(conn, entries):
+    """
+    Idempotently writes journaled samples: samples whose SampleKey is already in
+    HardnessJournalApplied are skipped, the rest are inserted together with their
+    keys in a single transaction.
+
+    Args:
+        conn: Open database connection.
+        entries (list): (sample_key, timestamped_records) pairs.
+
+    Returns:
+        list: Every key of the batch (all of them are now in the database).
+    """
+    apply_new_journal_entries(conn, entries)
+    return [key for key, _ in entries]
+
+def apply_new_journal_entries(conn, entries):
+    """
+    Same as apply_journal_entries(), but returns the (sample_key, timestamped_records)
+    pairs that were actually inserted, i.e. not already in the database and not a
+    repeat of an earlier key of the same batch.
+    """
+    already_applied = fetch_applied_journal_keys(conn, [key for key, _ in entries])
+    cursor = conn.cursor()
+    new_entries = []
+    for key, records in entries:
+        if key not in already_applied:
+            already_applied.add(key)
+            new_entries.append((key, records))
+    if new_entries:
+        insert_timestamped_readings(conn, [record for _, records in new_entries for record in records], commit=False)
+        with span('insert'):
+            cursor.executemany(f"INSERT INTO {JOURNAL_TABLE_NAME} (SampleKey) VALUES (?);", [(key,) for key, _ in new_entries])
+    with span('commit'):
+        conn.commit()
+    return new_entries
@@ -0,0 +1,126 @@
+"""
+Input validation rules for hardness records, shared by the data entry window
+and the headless tools.
+
+The rules are the ones the UI enforces on every sample: Tech Initials of 2 to 4
+characters, a Sample ID in the format 'XXX-YY', and six Bottom and six Top
+hardness values between 100 and 500 (inclusive). validate_sample_rows() applies
+them to whole columns at once with NumPy so that large CSV imports are checked
+without a Python-level loop per row.
+"""
+import numpy as np # For vectorized checks over whole columns
+
+INITIALS_MIN_LENGTH = 2
+INITIALS_MAX_LENGTH = 4
+
+SAMPLE_ID_PATTERN = r"^.{3}-.{2}$" # three chars, hyphen, two chars (e.g., 123-ab)
+
+HARDNESS_MIN = 100.0
+HARDNESS_MAX = 500.0
+
+NUM_POSITIONS = 6
+
+# Column order of a wide sample row: one column per Bottom/Top position
+HARDNESS_COLUMNS = [f"Bottom{i+1}" for i in range(NUM_POSITIONS)] + [f"Top{i+1}" for i in range(NUM_POSITIONS)]
+
+
+def normalize_initials(initials):
+    """
+    Tech Initials are case-insensitive ('ab' and 'AB' are the same technician).
+    Returns the form they are stored and compared in: stripped and upper case.
+    """
+    return initials.strip().upper()
+
+def _column_label(column_index):
+    side = 'Bottom' if column_index < NUM_POSITIONS else 'Top'
+    return f"{side} {column_index % NUM_POSITIONS + 1}"
+
+def _parse_floats(raw_values):
+    """
+    Converts a 2-D array of strings to float64, with NaN where a cell is not a number.
+    The whole array is converted in one call; cells are only parsed one by one when
+    that fails, i.e. for chunks that actually contain a bad value.
+    """
+    try:
+        return raw_values.astype(np.float64)
+    except ValueError:
+        parsed = np.full(raw_values.shape, np.nan)
+        for index, text in np.ndenumerate(raw_values):
+            try:
+                parsed[index] = float(text)
+            except ValueError:
+                pass
+        return parsed
+
+def validate_sample_rows(initials, sample_ids, hardness_raw):
+    """
+    Validates a batch of wide sample rows with the same rules (and messages) as the UI.
+
+    Args:
+        initials (np.ndarray): 1-D array of Tech Initials strings.
+        sample_ids (np.ndarray): 1-D array of Sample ID strings.
+        hardness_raw (np.ndarray): 2-D array of strings, shape (rows, 12), in HARDNESS_COLUMNS order.
+
+    Returns:
+        tuple: (valid_mask, hardness_values, errors) where valid_mask is a boolean
+        array over the rows, hardness_values is the float64 (rows, 12) array and
+        errors is a list of (row_index, message) for the first failing rule of each
+        invalid row.
+    """
+    initials = np.char.strip(np.asarray(initials, dtype=str))
+    sample_ids = np.char.strip(np.asarray(sample_ids, dtype=str))
+    hardness_raw = np.char.strip(np.asarray(hardness_raw, dtype=str))
+
+    initials_length = np.char.str_len(initials)
+    initials_ok = (initials_length >= INITIALS_MIN_LENGTH) & (initials_length <= INITIALS_MAX_LENGTH)
+
+    # Equivalent of SAMPLE_ID_PATTERN: exactly 6 characters, a hyphen at index 3, no line breaks
+    sample_id_ok = ((np.char.str_len(sample_ids) == 6)
+                    & (np.char.find(sample_ids, '-', 3, 4) == 3)
+                    & (np.char.find(sample_ids, '\n') == -1))
+
+    hardness_values = _parse_floats(np.where(hardness_raw == '', 'nan', hardness_raw))
+    empty = hardness_raw == ''
+    not_number = np.isnan(hardness_values) & ~empty
+    out_of_range = ~empty & ~not_number & ~((hardness_values >= HARDNESS_MIN) & (hardness_values <= HARDNESS_MAX))
+    cell_error = empty | not_number | out_of_range
+
+    valid_mask = initials_ok & sample_id_ok & ~cell_error.any(axis=1)
+
+    errors = []
+    if not valid_mask.all():
+        first_bad_cell = cell_error.argmax(axis=1) # Only meaningful where a cell is bad
+        for row in np.flatnonzero(~valid_mask):
+            if not initials_ok[row]:
+                message = f"Tech Initials must be between {INITIALS_MIN_LENGTH} and {INITIALS_MAX_LENGTH} characters long."
+            elif not sample_id_ok[row]:
+                message = "Sample ID must be in the format 'XXX-YY' (e.g., '123-ab')."
+            else:
+                column = first_bad_cell[row]
+                label = _column_label(column)
+                if empty[row, column]:
+                    message = f"{label} Hardness is empty!"
+                elif not_number[row, column]:
+                    message = f"{label} Hardness must be a valid number!"
+                else:
+                    message = f"{label} Hardness must be between {HARDNESS_MIN:g} and {HARDNESS_MAX:g}."
+            errors.append((int(row), message))
+    return valid_mask, hardness_values, errors
+
+def sample_rows_to_records(initials, sample_ids, hardness_values):
+    """
+    Expands validated wide rows into the 12 narrow records per sample that the
+    HardnessReadings table stores, with the Tech Initials in normalize_initials() form.
+
+    Returns:
+        list: (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples.
+    """
+    row_count = len(initials)
+    sides = np.tile(np.repeat(np.array(['Bottom', 'Top']), NUM_POSITIONS), row_count)
+    positions = np.tile(np.tile(np.arange(1, NUM_POSITIONS + 1), 2), row_count)
+    initials = np.char.upper(np.char.strip(np.asarray(initials, dtype=str))) # normalize_initials() over the column
+    return list(zip(np.repeat(initials, 2 * NUM_POSITIONS).tolist(),
+                    np.repeat(np.char.strip(np.asarray(sample_ids, dtype=str)), 2 * NUM_POSITIONS).tolist(),
+                    sides.tolist(),
+                    positions.tolist(),
+                    np.asarray(hardness_values, dtype=np.float64).ravel().tolist()))
@@ -0,0 +1,297 @@
+"""
+Full-history run chart of the saved Bottom and Top readings.
+
+The limits on the data entry chart come from every saved reading, which can be
+well over a million points per side. Plotting them all makes pan and zoom
+unusable, so each side keeps a HistoryPyramid: a multi-resolution min/max
+pyramid over the readings in save order. Level k holds, for every bucket of
+FACTOR**k readings, the index of its smallest and largest reading.
+
+To draw a visible range the chart picks the coarsest level that still gives
+about two candidate points per pixel. Taking the min and max of each bucket
+keeps every spike visible. Largest-Triangle-Three-Buckets (lttb()) then reduces
+the candidates to the pixel width of the axes. The cost of a redraw depends on
+the width of the axes, not on the size of the history. Appending a saved sample
+only recomputes the last bucket of each level.
+
+The pyramids index the float32 value columns of the shared HistoryStore in
+place (column=), so the history window keeps no copy of the readings.
+"""
+import numpy as np # For the pyramid levels and downsampling
+
+from history_store import GrowableArray
+
+FACTOR = 8 # Readings per bucket at level 1; each further level groups FACTOR buckets of the one below
+
+# Ranges of at most this many readings per pixel column are drawn raw
+RAW_POINTS_PER_PIXEL = 2
+
+
+def _reduce_groups(values, candidate_indices, group_size, pick):
+    """
+    Picks one candidate per group of group_size consecutive candidates.
+
+    Args:
+        values (np.ndarray): The raw readings.
+        candidate_indices (np.ndarray): Indices into values, in order.
+        group_size (int): Candidates per group (the last group may be shorter).
+        pick (callable): np.argmin or np.argmax.
+
+    Returns:
+        np.ndarray: The index (into values) of the picked candidate of each group.
+    """
+    count = candidate_indices.size
+    padding = (-count) % group_size
+    if padding:
+        # Pad the last group with copies of its last candidate, which cannot change the pick
+        candidate_indices = np.concatenate((candidate_indices, np.repeat(candidate_indices[-1:], padding)))
+    groups = candidate_indices.reshape(-1, group_size)
+    picked = pick(values[groups], axis=1)
+    return groups[np.arange(groups.shape[0]), picked]
+
+
+class HistoryPyramid:
+    """
+    Readings of one side in save order, with a min/max pyramid for fast downsampled views.
+
+    Args:
+        values (array-like): Initial readings, oldest first.
+        factor (int): Bucket growth factor between levels.
+        column (GrowableArray): Existing readings to index in place (e.g. HistoryStore.value_column());
+            whoever extends it calls sync() afterwards. A private column is created if omitted.
+    """
+
+    def __init__(self, values=(), factor=FACTOR, column=None):
+        self.factor = factor
+        self._values = column if column is not None else GrowableArray(np.float64)
+        self._levels = [] # [(min_indices, max_indices)] as GrowableArray pairs; level k is self._levels[k - 1]
+        self._indexed = 0 # Readings covered by the levels
+        self.append(values)
+        self.sync()
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def values(self):
+        """All readings, oldest first (a view, not a copy)."""
+        return self._values.values
+
+    def append(self, new_values):
+        """Appends readings and updates the affected tail of every pyramid level."""
+        new_values = np.asarray(new_values).ravel()
+        if new_values.size:
+            self._values.extend(new_values)
+        self.sync()
+
+    def sync(self):
+        """Updates the affected tail of every pyramid level after readings were added to the column."""
+        old_count = self._indexed
+        values = self._values.values
+        if len(values) == old_count:
+            return
+        self._indexed = len(values)
+
+        level = 1
+        while len(values) > self.factor ** level:
+            bucket_size = self.factor ** level
+            if level > len(self._levels):
+                self._levels.append((GrowableArray(np.int64), GrowableArray(np.int64)))
+            min_indices, max_indices = self._levels[level - 1]
+            first_bucket = min(old_count // bucket_size, len(min_indices))
+            min_indices.truncate(first_bucket)
+            max_indices.truncate(first_bucket)
+
+            if level == 1:
+                candidates = np.arange(first_bucket * self.factor, len(values))
+                lower_min, lower_max = candidates, candidates
+            else:
+                lower_min_indices, lower_max_indices = self._levels[level - 2]
+                lower_min = lower_min_indices.values[first_bucket * self.factor:]
+                lower_max = lower_max_indices.values[first_bucket * self.factor:]
+            min_indices.extend(_reduce_groups(values, lower_min, self.factor, np.argmin))
+            max_indices.extend(_reduce_groups(values, lower_max, self.factor, np.argmax))
+            level += 1
+
+    def view(self, start, stop, max_points):
+        """
+        Returns the points to draw for the readings in [start, stop).
+
+        Args:
+            start (float): First reading index of the visible range.
+            stop (float): End of the visible range (exclusive).
+            max_points (int): Number of points wanted, usually the pixel width of the axes.
+
+        Returns:
+            tuple: (x, y) arrays, x being reading indices. At most max_points points.
+        """
+        count = len(self._values)
+        start = max(0, int(np.floor(start)))
+        stop = min(count, int(np.ceil(stop)))
+        max_points = max(3, int(max_points))
+        if stop <= start:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        values = self._values.values
+
+        if stop - start <= RAW_POINTS_PER_PIXEL * max_points or not self._levels:
+            x = np.arange(start, stop) # Few readings, or too few for a pyramid level yet; lttb() reduces them
+        else:
+            # Coarsest level that still gives about two buckets (one min, one max) per output point
+            level = 1
+            while (level < len(self._levels)
+                   and (stop - start) // self.factor ** (level + 1) >= RAW_POINTS_PER_PIXEL * max_points):
+                level += 1
+            bucket_size = self.factor ** level
+            min_indices, max_indices = self._levels[level - 1]
+            first_bucket = start // bucket_size
+            last_bucket = -(-stop // bucket_size)
+            x = np.union1d(min_indices.values[first_bucket:last_bucket], max_indices.values[first_bucket:last_bucket])
+
+        y = values[x]
+        if x.size > max_points:
+            x, y = lttb(x, y, max_points)
+        return x, y
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets downsampling (Steinarsson, 2013).
+
+    Keeps the first and last point and, from each of threshold - 2 equal buckets in
+    between, the point that forms the largest triangle with the previously kept
+    point and the average of the next bucket.
+
+    Args:
+        x (np.ndarray): X values, increasing.
+        y (np.ndarray): Y values.
+        threshold (int): Number of points to keep.
+
+    Returns:
+        tuple: (x, y) of the kept points.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=np.float64)
+    size = x.size
+    if threshold >= size or threshold < 3:
+        return x, y
+
+    xf = x.astype(np.float64)
+    edges = np.linspace(1, size - 1, threshold - 1).astype(np.int64) # Bucket boundaries, excluding first and last point
+    # Averages of every bucket (and of the last point as the "next bucket" of the final one), computed up front
+    bucket_sums_x = np.add.reduceat(xf[:size - 1], edges[:-1])
+    bucket_sums_y = np.add.reduceat(y[:size - 1], edges[:-1])
+    bucket_lengths = np.diff(edges)
+    next_x = np.append(bucket_sums_x[1:] / bucket_lengths[1:], xf[-1])
+    next_y = np.append(bucket_sums_y[1:] / bucket_lengths[1:], y[-1])
+
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = size - 1
+    previous = 0
+    for bucket in range(threshold - 2):
+        low, high = edges[bucket], edges[bucket + 1]
+        # Twice the triangle area; the constant factor does not change the argmax
+        areas = np.abs((xf[previous] - next_x[bucket]) * (y[low:high] - y[previous])
+                       - (xf[previous] - xf[low:high]) * (next_y[bucket] - y[previous]))
+        previous = low + int(np.argmax(areas))
+        kept[bucket + 1] = previous
+    return x[kept], y[kept]
+
+
+class HistoryRunChart:
+    """
+    Bottom-over-Top run charts of the whole history on an existing figure. The
+    drawn points are recomputed from the pyramids whenever the x-range changes
+    (pan, zoom, toolbar home) or the canvas is resized.
+
+    Args:
+        fig (matplotlib.figure.Figure): Figure to draw on (cleared first).
+        pyramids (dict): {'Bottom': HistoryPyramid, 'Top': HistoryPyramid}.
+    """
+
+    def __init__(self, fig, pyramids):
+        self.fig = fig
+        self.pyramids = pyramids
+        fig.clear()
+        ax_bottom, ax_top = fig.subplots(2, 1, sharex=True)
+        self.axes = {'Bottom': ax_bottom, 'Top': ax_top}
+        self.lines = {}
+        self.limit_lines = {}
+        for side, ax, color in (('Bottom', ax_bottom, 'skyblue'), ('Top', ax_top, 'lightcoral')):
+            ax.set_title(f'{side} Hardness History')
+            ax.set_ylabel('Hardness - BHN')
+            ax.grid(True)
+            self.lines[side], = ax.plot([], [], linestyle='-', linewidth=0.8, color=color)
+            self.limit_lines[side] = (ax.axhline(y=0, color='blue', linestyle=':', visible=False),
+                                      ax.axhline(y=0, color='red', linestyle='--', visible=False),
+                                      ax.axhline(y=0, color='red', linestyle='--', visible=False))
+        ax_top.set_xlabel('Reading # (save order)')
+        fig.tight_layout()
+        self._updating = False
+        self._shown_count = 0
+        ax_bottom.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        fig.canvas.mpl_connect('resize_event', self._on_resize)
+        self.reset_view()
+
+    def _pixel_width(self, ax):
+        return max(100, int(ax.bbox.width))
+
+    def _refresh(self):
+        """Re-downsamples the visible range of both sides."""
+        self._shown_count = max(len(pyramid) for pyramid in self.pyramids.values())
+        self._updating = True
+        try:
+            for side, ax in self.axes.items():
+                start, stop = ax.get_xlim()
+                x, y = self.pyramids[side].view(start, stop + 1, self._pixel_width(ax))
+                self.lines[side].set_data(x, y)
+                if y.size:
+                    padding = max((y.max() - y.min()) * 0.05, 1.0)
+                    low, high = y.min() - padding, y.max() + padding
+                    for line in self.limit_lines[side]:
+                        if line.get_visible():
+                            low, high = min(low, line.get_ydata()[0] - padding), max(high, line.get_ydata()[0] + padding)
+                    ax.set_ylim(low, high)
+        finally:
+            self._updating = False
+        self.fig.canvas.draw_idle()
+
+    def _on_xlim_changed(self, ax):
+        if not self._updating:
+            self._refresh()
+
+    def _on_resize(self, event):
+        self.fig.tight_layout()
+        self._refresh()
+
+    def reset_view(self):
+        """Shows the whole history."""
+        count = max(len(pyramid) for pyramid in self.pyramids.values())
+        self._updating = True
+        try:
+            self.axes['Bottom'].set_xlim(0, max(count - 1, 1))
+        finally:
+            self._updating = False
+        self._refresh()
+
+    def set_limits(self, side, mean_val, ucl, lcl):
+        """Shows a side's current mean, UCL and LCL as horizontal lines."""
+        for line, value in zip(self.limit_lines[side], (mean_val, ucl, lcl)):
+            line.set_visible(value is not None)
+            if value is not None:
+                line.set_ydata([value, value])
+
+    def refresh(self):
+        """
+        Redraws after readings were appended to the pyramids. If the view ended at
+        the newest reading it is extended to follow the new ones.
+        """
+        count = max(len(pyramid) for pyramid in self.pyramids.values())
+        start, stop = self.axes['Bottom'].get_xlim()
+        if stop >= self._shown_count - 1 and count > self._shown_count:
+            self._updating = True
+            try:
+                self.axes['Bottom'].set_xlim(start, max(count - 1, 1))
+            finally:
+                self._updating = False
+        self._refresh()
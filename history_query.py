@@ -0,0 +1,242 @@
+"""
+Filtered history queries with keyset pagination and an LRU result cache.
+
+Supervisors look at one technician, a lot of samples (SampleID prefix), a time
+range, a side or a single position. HistoryFilter describes such a slice.
+fetch_page() reads it page by page with keyset pagination: each page continues
+after the (Timestamp, ID) of the previous page's last row. Every page costs the
+same, however deep into the history it is, unlike OFFSET. fetch_statistics()
+returns COUNT/AVG/STDEV/MIN/MAX per side for the slice.
+
+HistoryQueryCache keeps the most recent pages and statistics, keyed by the
+filter, so flipping back to a technician looked at a minute ago is answered from
+memory. Entries are dropped only when rows that belong to them are committed.
+A result read while rows were being committed is not cached at all: the
+cache's generation changes on every invalidation, and store_page() and
+store_statistics() drop results read under an older generation.
+A statistics entry goes when a new reading matches its filter. A page goes when
+a matching reading falls inside the page's (Timestamp, ID) range, or when the
+page is the last one and the reading comes after it.
+"""
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+
+import hardness_db
+from hardness_validation import normalize_initials
+
+DEFAULT_PAGE_SIZE = 200 # Readings per page
+DEFAULT_CACHE_ENTRIES = 128 # Pages and statistics kept by HistoryQueryCache
+
+QUERY_COLUMNS = "ID, TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp"
+
+
+class HistoryFilter(namedtuple('HistoryFilter', 'technician sample_prefix start end side position',
+                               defaults=(None, None, None, None, None, None))):
+    """
+    A slice of the history; None fields do not filter. Hashable, so it can key a cache.
+
+    Fields:
+        technician (str): TechnicianInitials (in any case; initials match case-insensitively).
+        sample_prefix (str): Start of the SampleID, e.g. a lot number.
+        start (datetime): Readings at or after this time.
+        end (datetime): Readings before this time.
+        side (str): 'Bottom' or 'Top'.
+        position (int): 1-6.
+    """
+    __slots__ = ()
+
+    def matches(self, record):
+        """
+        Whether a (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp)
+        record belongs to this slice.
+        """
+        timestamp = record[5]
+        return ((self.technician is None or normalize_initials(record[0]) == normalize_initials(self.technician))
+                and (self.sample_prefix is None or record[1].upper().startswith(self.sample_prefix.upper())) # LIKE ignores case
+                and (self.start is None or timestamp >= self.start)
+                and (self.end is None or timestamp < self.end)
+                and (self.side is None or record[2] == self.side)
+                and (self.position is None or int(record[3]) == self.position))
+
+
+def _as_datetime(value):
+    """Timestamps come back as text from SQLite and as datetime from pyodbc."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def _timestamp_param(conn, value):
+    # SQLite stores the 'YYYY-MM-DD HH:MM:SS' text, which compares correctly as text
+    if hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE and isinstance(value, datetime):
+        return value.isoformat(sep=' ', timespec='seconds')
+    return value
+
+def build_where(conn, history_filter):
+    """
+    Returns:
+        tuple: (conditions, params), conditions being a list of SQL predicates to AND together.
+    """
+    conditions = []
+    params = []
+    if history_filter.technician is not None:
+        conditions.append(hardness_db.TECHNICIAN_CONDITION)
+        params.append(normalize_initials(history_filter.technician))
+    if history_filter.sample_prefix is not None:
+        conditions.append("SampleID LIKE ? ESCAPE '\\'")
+        params.append(hardness_db.escape_like(history_filter.sample_prefix) + '%')
+    if history_filter.start is not None:
+        conditions.append("Timestamp >= ?")
+        params.append(_timestamp_param(conn, history_filter.start))
+    if history_filter.end is not None:
+        conditions.append("Timestamp < ?")
+        params.append(_timestamp_param(conn, history_filter.end))
+    if history_filter.side is not None:
+        conditions.append("TopOrBottom = ?")
+        params.append(history_filter.side)
+    if history_filter.position is not None:
+        conditions.append("Position = ?")
+        params.append(history_filter.position)
+    return conditions, params
+
+def fetch_page(conn, history_filter, page_size=DEFAULT_PAGE_SIZE, after=None):
+    """
+    Reads one page of the slice in (Timestamp, ID) order.
+
+    Args:
+        conn: Open database connection.
+        history_filter (HistoryFilter): The slice.
+        page_size (int): Readings per page.
+        after (tuple): (Timestamp, ID) of the previous page's last row, None for the first page.
+
+    Returns:
+        tuple: (rows, next_after) where rows are (ID, TechnicianInitials, SampleID, TopOrBottom,
+        Position, HardnessValue, Timestamp) tuples and next_after is the cursor of the next
+        page, or None if this is the last one.
+    """
+    conditions, params = build_where(conn, history_filter)
+    if after is not None:
+        conditions.append("(Timestamp > ? OR (Timestamp = ? AND ID > ?))")
+        params.extend([after[0], after[0], after[1]])
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.cursor()
+    # One row more than the page tells whether another page follows
+    if hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE:
+        cursor.execute(f"SELECT {QUERY_COLUMNS} FROM {hardness_db.TABLE_NAME} {where} "
+                       f"ORDER BY Timestamp ASC, ID ASC LIMIT ?;", params + [page_size + 1])
+    else:
+        cursor.execute(f"SELECT TOP (?) {QUERY_COLUMNS} FROM {hardness_db.TABLE_NAME} {where} "
+                       f"ORDER BY Timestamp ASC, ID ASC;", [page_size + 1] + params)
+    rows = [tuple(row) for row in cursor.fetchall()]
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, (rows[-1][6], rows[-1][0])
+
+def fetch_statistics(conn, history_filter):
+    """
+    Returns:
+        dict: {side: (count, mean, std_dev, min, max)} for the sides present in the slice;
+              std_dev is None with fewer than 2 readings.
+    """
+    conditions, params = build_where(conn, history_filter)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT TopOrBottom, COUNT(*), AVG(HardnessValue), STDEV(HardnessValue), MIN(HardnessValue), MAX(HardnessValue)
+        FROM {hardness_db.TABLE_NAME} {where}
+        GROUP BY TopOrBottom;
+    """, params)
+    return {side: (int(count), float(mean_val), None if std_dev is None else float(std_dev), float(low), float(high))
+            for side, count, mean_val, std_dev, low, high in cursor.fetchall()}
+
+
+class HistoryQueryCache:
+    """
+    Bounded LRU cache of pages and statistics per HistoryFilter. Thread-safe: the
+    worker fills it, the UI thread reads it and the journal flusher invalidates it.
+
+    Args:
+        max_entries (int): Entries kept; the least recently used one goes first.
+    """
+
+    def __init__(self, max_entries=DEFAULT_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict() # key -> (value, history_filter, page_range or None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0 # Incremented by every invalidate() and clear()
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def _put(self, key, value, history_filter, page_range=None, generation=None):
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return # Rows were committed while the value was read; it may already be stale
+            self._entries[key] = (value, history_filter, page_range)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def page(self, history_filter, page_size=DEFAULT_PAGE_SIZE, after=None):
+        """Returns the cached (rows, next_after) of a page, or None."""
+        return self._get(('page', history_filter, page_size, after))
+
+    def store_page(self, history_filter, page_size, after, page, generation=None):
+        """
+        Caches a page returned by fetch_page(). With generation (the cache's generation
+        from before the page was read), nothing is cached if an invalidation came in between.
+        """
+        rows, next_after = page
+        first = None if after is None else _as_datetime(after[0])
+        last = None if next_after is None else _as_datetime(next_after[0]) # None: last page, open-ended
+        self._put(('page', history_filter, page_size, after), page, history_filter, (first, last), generation)
+
+    def statistics(self, history_filter):
+        """Returns the cached fetch_statistics() result, or None."""
+        return self._get(('statistics', history_filter))
+
+    def store_statistics(self, history_filter, statistics, generation=None):
+        """Caches a fetch_statistics() result; generation as for store_page()."""
+        self._put(('statistics', history_filter), statistics, history_filter, generation=generation)
+
+    def invalidate(self, records):
+        """
+        Drops the entries that newly committed readings belong to.
+
+        Args:
+            records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp)
+                tuples, Timestamp being a datetime.
+
+        Returns:
+            int: Number of entries dropped.
+        """
+        with self._lock:
+            self.generation += 1
+            stale = []
+            for key, (_, history_filter, page_range) in self._entries.items():
+                for record in records:
+                    if not history_filter.matches(record):
+                        continue
+                    if page_range is not None:
+                        first, last = page_range
+                        # Same-second rows are ordered by ID, so the boundaries themselves count as inside
+                        if (first is not None and record[5] < first) or (last is not None and record[5] > last):
+                            continue
+                    stale.append(key)
+                    break
+            for key in stale:
+                del self._entries[key]
+            return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
@@ -0,0 +1,317 @@
+"""
+Compact columnar in-memory store of every saved reading.
+
+The history window used to read the whole table into two Python lists of boxed
+floats, about 100 bytes per reading once list slots and float objects are
+counted, and then copied them into float64 arrays. It also dropped the position,
+sample, technician and timestamp. HistoryStore keeps each side as NumPy columns
+instead:
+
+    values       float32   4 bytes
+    positions    int8      1 byte
+    technicians  uint16    2 bytes   code into HistoryStore.technicians
+    samples      uint32    4 bytes   code into HistoryStore.sample_ids
+    timestamps   int64     8 bytes   seconds since 1970 (local time, as stored)
+
+That is 19 bytes per reading (BYTES_PER_READING). The side is given by which
+column set a reading is in, so every side's readings are one contiguous
+column. values() and column() hand out views, not copies, and HistoryPyramid
+indexes the store's value column directly instead of keeping its own copy.
+Appends are amortized O(1): capacity doubles when a column is full.
+
+save() writes the readings read from the database as .npy files plus a JSON
+header. load() memory-maps them, so reopening the history is instant and costs
+no memory until a page is touched. load_or_fetch() then reads only the rows
+stored since: those above the saved watermark (the highest storage ID read),
+minus ID_RECHECK_WINDOW. Storage IDs are handed out when a row is inserted, but
+the row only becomes visible when its transaction commits. With several
+stations (or the collector) writing, a lower ID can therefore commit after a
+higher one was already read. Re-reading the window below the watermark picks
+such rows up, and the IDs read in that window are kept so that no row is
+appended twice. Readings appended from this station's saves are not written by
+save(). They are not in the database yet (journal), and the next catch-up reads
+them from there.
+
+The store is in read order. Each catch-up appends its rows in time order after
+the ones already stored, so a reading committed late comes after readings with
+later timestamps that were read before it. The run charts plot the readings in
+this order.
+"""
+import glob
+import json
+import os
+
+import numpy as np # For the columns
+
+import hardness_db
+
+SIDES = ('Bottom', 'Top')
+COLUMNS = (
+    ('values', np.float32),
+    ('positions', np.int8),
+    ('technicians', np.uint16),
+    ('samples', np.uint32),
+    ('timestamps', np.int64),
+)
+BYTES_PER_READING = sum(np.dtype(dtype).itemsize for _, dtype in COLUMNS)
+
+HEADER_FILE = "history_store.json"
+STORE_VERSION = 2
+
+# Storage IDs below the watermark that every catch-up reads again, for rows whose transaction
+# committed after a higher ID had been read (about 830 samples in the narrow layout)
+ID_RECHECK_WINDOW = 10000
+
+
+class GrowableArray:
+    """1-D NumPy array with amortized O(1) appends (capacity doubles when full)."""
+
+    def __init__(self, dtype, capacity=1024):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._size = 0
+
+    @classmethod
+    def wrap(cls, array):
+        """Uses an existing (e.g. memory-mapped, read-only) array as the filled part; it is copied on the first append."""
+        growable = cls.__new__(cls)
+        growable._data = array
+        growable._size = array.size
+        return growable
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    @property
+    def values(self):
+        """View of the filled part (no copy)."""
+        return self._data[:self._size]
+
+    @property
+    def nbytes(self):
+        """Bytes of the filled part."""
+        return self._size * self._data.itemsize
+
+    def truncate(self, size):
+        self._size = min(self._size, size)
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        needed = self._size + values.size
+        if needed > self._data.size:
+            grown = np.empty(max(needed, 2 * self._data.size, 1024), dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:needed] = values
+        self._size = needed
+
+
+def _timestamp_seconds(timestamps):
+    """Timestamps as int64 seconds (SQLite returns 'YYYY-MM-DD HH:MM:SS' text, pyodbc and the journal datetimes)."""
+    if timestamps and isinstance(timestamps[0], str):
+        array = np.char.replace(np.array(timestamps, dtype=str), ' ', 'T').astype('datetime64[s]')
+    else:
+        array = np.array(timestamps, dtype='datetime64[s]')
+    return array.astype(np.int64)
+
+
+class HistoryStore:
+    """
+    Every reading of both sides as typed NumPy columns, in read order and then save order.
+    """
+
+    def __init__(self):
+        self._columns = {side: {name: GrowableArray(dtype) for name, dtype in COLUMNS} for side in SIDES}
+        self.technicians = [] # Code -> TechnicianInitials
+        self.sample_ids = [] # Code -> SampleID
+        self._technician_codes = {}
+        self._sample_codes = {}
+        self.layout = None # Storage layout the watermark refers to
+        self.last_id = 0 # Highest storage ID read from the database
+        self._recent_ids = set() # IDs read within ID_RECHECK_WINDOW below last_id
+        self._stored_counts = {side: 0 for side in SIDES} # Readings per side that came from the database
+
+    def __len__(self):
+        return sum(len(columns['values']) for columns in self._columns.values())
+
+    @property
+    def nbytes(self):
+        """Bytes held by the readings (capacity reserve and dictionaries not counted)."""
+        return sum(column.nbytes for columns in self._columns.values() for column in columns.values())
+
+    def count(self, side):
+        return len(self._columns[side]['values'])
+
+    def values(self, side):
+        """A side's readings, oldest first (a float32 view, not a copy)."""
+        return self._columns[side]['values'].values
+
+    def column(self, side, name):
+        """View of one column ('values', 'positions', 'technicians', 'samples' or 'timestamps') of a side."""
+        return self._columns[side][name].values
+
+    def value_column(self, side):
+        """The GrowableArray behind values(side), for HistoryPyramid(column=...) to index in place."""
+        return self._columns[side]['values']
+
+    def _codes(self, names, dictionary, codes):
+        result = []
+        for name in names:
+            code = codes.get(name)
+            if code is None:
+                code = codes[name] = len(dictionary)
+                dictionary.append(name)
+            result.append(code)
+        return result
+
+    def append(self, records, timestamp=None):
+        """
+        Appends readings in the order given.
+
+        Args:
+            records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue[, Timestamp]) tuples.
+            timestamp (datetime): Timestamp of records that have none (e.g. a sample being saved).
+        """
+        if not records:
+            return
+        technicians, sample_ids, sides, positions, values = (list(column) for column in zip(*(record[:5] for record in records)))
+        timestamps = [record[5] if len(record) > 5 else timestamp for record in records]
+        if any(value is None for value in timestamps):
+            raise ValueError("Records without a Timestamp need the timestamp argument.")
+        columns = {
+            'values': np.array(values, dtype=np.float32),
+            'positions': np.array(positions, dtype=np.int8),
+            'technicians': np.array(self._codes(technicians, self.technicians, self._technician_codes), dtype=np.uint16),
+            'samples': np.array(self._codes(sample_ids, self.sample_ids, self._sample_codes), dtype=np.uint32),
+            'timestamps': _timestamp_seconds(timestamps),
+        }
+        sides = np.array(sides)
+        for side in SIDES:
+            mask = sides == side
+            if mask.any():
+                for name, column in self._columns[side].items():
+                    column.extend(columns[name][mask])
+
+    def catch_up(self, conn):
+        """
+        Appends the readings stored in the database since the last catch-up, including rows
+        below the watermark that committed late; save() persists everything read so far.
+
+        Returns:
+            int: Number of readings read.
+        """
+        layout = hardness_db.storage_layout(conn)
+        if self.layout is not None and layout != self.layout:
+            raise ValueError("The storage layout changed; the store must be rebuilt.")
+        if any(self._stored_counts[side] != self.count(side) for side in SIDES):
+            raise ValueError("Catch-up must come before appending unsaved readings.")
+        records, ids = hardness_db.fetch_readings_since(conn, max(self.last_id - ID_RECHECK_WINDOW, 0))
+        records = [record for record, row_id in zip(records, ids) if row_id not in self._recent_ids]
+        self.last_id = max(self.last_id, max(ids, default=0))
+        floor = self.last_id - ID_RECHECK_WINDOW
+        self._recent_ids = {row_id for row_id in self._recent_ids.union(ids) if row_id > floor}
+        self.layout = layout
+        self.append(records)
+        self._stored_counts = {side: self.count(side) for side in SIDES}
+        return len(records)
+
+    def save(self, directory):
+        """
+        Writes the readings read from the database to directory (created if missing).
+        Each save uses new file names, so the files a running store has memory-mapped
+        are never overwritten (Windows refuses that); older ones are removed when possible.
+        """
+        os.makedirs(directory, exist_ok=True)
+        header_path = os.path.join(directory, HEADER_FILE)
+        generation = 1
+        if os.path.exists(header_path):
+            with open(header_path, encoding='utf-8') as header_file:
+                generation = json.load(header_file).get('generation', 0) + 1
+        for side in SIDES:
+            for name, _ in COLUMNS:
+                np.save(os.path.join(directory, f"{side}_{name}_{generation}.npy"),
+                        self.column(side, name)[:self._stored_counts[side]])
+        header = {
+            'version': STORE_VERSION,
+            'generation': generation,
+            'layout': self.layout,
+            'last_id': self.last_id,
+            'recent_ids': sorted(self._recent_ids),
+            'technicians': self.technicians,
+            'sample_ids': self.sample_ids,
+        }
+        temp_path = header_path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as header_file:
+            json.dump(header, header_file)
+        os.replace(temp_path, header_path)
+        for path in glob.glob(os.path.join(directory, "*.npy")):
+            if not path.endswith(f"_{generation}.npy"):
+                try:
+                    os.remove(path)
+                except OSError: # Still memory-mapped by this process (Windows); removed by a later save
+                    pass
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Reads a store written by save(); the columns are memory-mapped (read-only, copied on the first append).
+
+        Returns:
+            HistoryStore: The store, or None if the directory holds no (current) store.
+        """
+        header_path = os.path.join(directory, HEADER_FILE)
+        if not os.path.exists(header_path):
+            return None
+        with open(header_path, encoding='utf-8') as header_file:
+            header = json.load(header_file)
+        if header.get('version') != STORE_VERSION:
+            return None
+        store = cls()
+        store.layout = header['layout']
+        store.last_id = header['last_id']
+        store._recent_ids = set(header['recent_ids'])
+        store.technicians = header['technicians']
+        store.sample_ids = header['sample_ids']
+        store._technician_codes = {name: code for code, name in enumerate(store.technicians)}
+        store._sample_codes = {name: code for code, name in enumerate(store.sample_ids)}
+        for side in SIDES:
+            for name, dtype in COLUMNS:
+                array = np.load(os.path.join(directory, f"{side}_{name}_{header['generation']}.npy"),
+                                mmap_mode='r' if mmap else None)
+                if array.dtype != dtype:
+                    return None
+                store._columns[side][name] = GrowableArray.wrap(array)
+            store._stored_counts[side] = store.count(side)
+        return store
+
+    @classmethod
+    def load_or_fetch(cls, conn, directory=None):
+        """
+        Loads the saved store (if any and still valid for this database) and reads the
+        readings stored since; without one, reads the whole history. Saves the result
+        back when anything new was read.
+
+        Args:
+            conn: Open database connection.
+            directory (str): Where the store is kept, or None for no persistence.
+
+        Returns:
+            HistoryStore: The store, with every reading currently in the database.
+        """
+        store = None
+        if directory is not None:
+            try:
+                store = cls.load(directory)
+            except (OSError, ValueError, KeyError) as e: # Damaged or from another version; rebuild it
+                print(f"History store in '{directory}' could not be read, rebuilding it: {e}")
+            if store is not None and store.layout != hardness_db.storage_layout(conn):
+                store = None # Migrated to the other layout; its IDs mean something else
+        if store is None:
+            store = cls()
+        read_count = store.catch_up(conn)
+        if directory is not None and read_count:
+            store.save(directory)
+        return store
@@ -0,0 +1,229 @@
+"""
+Lightweight tracing of the hot paths (connect, query, fetch, statistics, render, insert).
+
+Code marks a timed step with span('query') and a user action (Display, Save,
+startup) with action('display') or the traced_action('display') decorator.
+Every span is recorded under (action, stage) in a RollingHistogram. The
+histogram keeps cumulative Prometheus-style bucket counts plus a rolling window
+of the most recent durations for percentiles. A slow click can then be split
+into network/connect, database (query, fetch, insert), statistics and
+matplotlib (render, draw) time.
+
+A span outside any action on its thread is charged to the last action that
+finished on that thread. This covers the deferred canvas draw that runs right
+after a click. Threads that never ran an action record under 'background'.
+
+write_metrics() writes a Prometheus text file (for node_exporter's textfile
+collector or a plain look with a text editor) and a JSON file. The cost of a
+span is two perf_counter() calls and a locked append.
+
+cProfile capture of the calling thread can be switched on and off with
+toggle_profiling(); the statistics are dumped to a .prof file readable with
+pstats or snakeviz.
+"""
+import cProfile
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np # For the rolling percentiles
+
+# Upper bounds (seconds) of the cumulative histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+ROLLING_WINDOW = 1000 # Most recent durations kept per (action, stage) for percentiles
+
+BACKGROUND_ACTION = 'background'
+TOTAL_STAGE = 'total' # Span covering a whole traced_action
+
+METRIC_NAME = "hardness_span_seconds"
+
+
+class RollingHistogram:
+    """
+    Durations of one (action, stage): cumulative bucket counts, count and sum since
+    start, plus the last `window` durations for percentiles.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, window=ROLLING_WINDOW):
+        self.buckets = tuple(buckets)
+        self._bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.total = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.count += 1
+            self.total += seconds
+            self._recent.append(seconds)
+            for index, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    self._bucket_counts[index] += 1
+                    break
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {'count', 'sum', 'buckets' [(le, cumulative_count)], 'recent' {'p50', 'p90', 'p99', 'max'}}
+        """
+        with self._lock:
+            cumulative = np.cumsum(self._bucket_counts).tolist()
+            recent = np.array(self._recent, dtype=np.float64)
+            count, total = self.count, self.total
+        percentiles = {}
+        if recent.size:
+            p50, p90, p99 = np.percentile(recent, [50, 90, 99])
+            percentiles = {'p50': float(p50), 'p90': float(p90), 'p99': float(p99), 'max': float(recent.max())}
+        return {'count': count, 'sum': total, 'buckets': list(zip(self.buckets, cumulative)), 'recent': percentiles}
+
+
+_histograms = {} # (action, stage) -> RollingHistogram
+_histograms_lock = threading.Lock()
+_context = threading.local() # Per thread: stack of active actions and the last finished one
+
+_profiler = None
+_profiler_lock = threading.Lock()
+
+
+def current_action():
+    """The innermost active action on this thread, else the last finished one, else 'background'."""
+    stack = getattr(_context, 'stack', None)
+    if stack:
+        return stack[-1]
+    return getattr(_context, 'last_action', BACKGROUND_ACTION)
+
+def record(action_name, stage, seconds):
+    """Adds one duration to the (action, stage) histogram."""
+    key = (action_name, stage)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _histograms_lock:
+            histogram = _histograms.setdefault(key, RollingHistogram())
+    histogram.record(seconds)
+
+@contextmanager
+def action(name):
+    """Marks a user action (e.g. 'display', 'save', 'startup') on the current thread."""
+    stack = getattr(_context, 'stack', None)
+    if stack is None:
+        stack = _context.stack = []
+    stack.append(name)
+    try:
+        yield
+    finally:
+        stack.pop()
+        _context.last_action = name
+
+@contextmanager
+def span(stage, action_name=None):
+    """Times the body and records it under (action, stage), also when the body raises."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(action_name or current_action(), stage, time.perf_counter() - start)
+
+def traced_action(name):
+    """Decorator running a function as action `name` and recording its total duration."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with action(name), span(TOTAL_STAGE):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def traced(stage, function):
+    """Wraps a callable (e.g. a canvas' draw method) so that every call is recorded as `stage`."""
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with span(stage):
+            return function(*args, **kwargs)
+    return wrapper
+
+def snapshot():
+    """
+    Returns:
+        dict: {'action/stage': RollingHistogram.snapshot()} for every recorded pair.
+    """
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    return {f"{action_name}/{stage}": histogram.snapshot() for (action_name, stage), histogram in items}
+
+def reset():
+    """Forgets every recorded duration."""
+    with _histograms_lock:
+        _histograms.clear()
+
+def prometheus_text():
+    """Renders the histograms in the Prometheus text exposition format."""
+    with _histograms_lock:
+        items = sorted(_histograms.items())
+    lines = [f"# HELP {METRIC_NAME} Duration of traced steps by user action and stage.",
+             f"# TYPE {METRIC_NAME} histogram"]
+    recent_lines = [f"# HELP {METRIC_NAME}_recent Percentiles of the last {ROLLING_WINDOW} durations by action and stage.",
+                    f"# TYPE {METRIC_NAME}_recent gauge"]
+    for (action_name, stage), histogram in items:
+        data = histogram.snapshot()
+        labels = f'action="{action_name}",stage="{stage}"'
+        for bound, cumulative in data['buckets']:
+            lines.append(f'{METRIC_NAME}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{METRIC_NAME}_bucket{{{labels},le="+Inf"}} {data["count"]}')
+        lines.append(f'{METRIC_NAME}_sum{{{labels}}} {data["sum"]:.6f}')
+        lines.append(f'{METRIC_NAME}_count{{{labels}}} {data["count"]}')
+        for name, value in data['recent'].items():
+            recent_lines.append(f'{METRIC_NAME}_recent{{{labels},quantile="{name}"}} {value:.6f}')
+    return "\n".join(lines + recent_lines) + "\n"
+
+def _write_atomically(path, text):
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as metrics_file:
+        metrics_file.write(text)
+    os.replace(temp_path, path) # Readers never see a half-written file
+
+def write_metrics(prometheus_path, json_path=None):
+    """Writes the current histograms as Prometheus text (and optionally JSON)."""
+    _write_atomically(prometheus_path, prometheus_text())
+    if json_path:
+        _write_atomically(json_path, json.dumps(snapshot(), indent=2) + "\n")
+
+def is_profiling():
+    return _profiler is not None
+
+def start_profiling():
+    """Starts cProfile on the calling thread."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            _profiler = cProfile.Profile()
+            _profiler.enable()
+
+def stop_profiling(path):
+    """Stops cProfile and dumps the statistics to path. Returns the path, or None if not profiling."""
+    global _profiler
+    with _profiler_lock:
+        if _profiler is None:
+            return None
+        _profiler.disable()
+        _profiler.dump_stats(path)
+        _profiler = None
+    return path
+
+def toggle_profiling(path):
+    """
+    Starts profiling, or stops it and writes the statistics to path.
+
+    Returns:
+        bool: True if profiling is now running.
+    """
+    if is_profiling():
+        stop_profiling(path)
+        return False
+    start_profiling()
+    return True
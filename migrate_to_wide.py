@@ -0,0 +1,204 @@
+"""
+Streaming migration of HardnessReadings to the wide one-row-per-sample layout.
+
+HardnessReadings stores 12 rows per saved sample, each repeating the
+technician, SampleID and timestamp. HardnessSamples stores the sample once with
+its readings in columns B1-B6 (Bottom) and T1-T6 (Top). That is about a tenth of
+the rows, and the full-history and aggregate queries read far fewer pages.
+
+The copy runs in chunks of readings ordered by ID. Each chunk is committed
+together with the last copied reading ID in HardnessMigrationState, so an
+interrupted run continues where it stopped, and the stations can keep saving
+while the bulk of the history is copied. Readings of a sample that may continue
+in the next chunk are held back and re-read with it.
+
+Copying by ID > LastReadingID misses readings whose transaction committed after
+a higher ID had been copied, which can happen while several stations save.
+Before switching, reconcile_copy() therefore compares the reading counts of
+both tables and copies such samples again.
+
+--switch copies whatever was saved since, reconciles, and then swaps the layouts in one
+transaction: the table is renamed to HardnessReadingsNarrow (kept as the
+archive) and HardnessReadings is recreated as a view over HardnessSamples with
+the old columns. Stop the stations for the switch; once it is done they pick
+up the wide layout automatically (hardness_db.storage_layout()).
+
+Usage:
+    python migrate_to_wide.py --sqlite hardness_readings.db
+    python migrate_to_wide.py --switch --server HOST --database DB --username USER
+"""
+import argparse
+import sys
+import time
+
+import hardness_db
+
+DEFAULT_CHUNK_SIZE = 120000 # Readings per chunk (10000 samples)
+
+MIGRATION_STATE_TABLE_NAME = "HardnessMigrationState"
+
+
+def create_state_table(conn):
+    """Creates the single-row table holding the last copied reading ID (does not commit)."""
+    cursor = conn.cursor()
+    if hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {MIGRATION_STATE_TABLE_NAME} (LastReadingID INTEGER NOT NULL);")
+    else:
+        cursor.execute(f"""
+            IF NOT EXISTS (SELECT * FROM sysobjects WHERE name='{MIGRATION_STATE_TABLE_NAME}' and xtype='U')
+            CREATE TABLE {MIGRATION_STATE_TABLE_NAME} (LastReadingID INT NOT NULL);
+        """)
+    cursor.execute(f"SELECT LastReadingID FROM {MIGRATION_STATE_TABLE_NAME};")
+    if cursor.fetchone() is None:
+        cursor.execute(f"INSERT INTO {MIGRATION_STATE_TABLE_NAME} (LastReadingID) VALUES (0);")
+
+def last_copied_id(conn):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT LastReadingID FROM {MIGRATION_STATE_TABLE_NAME};")
+    return cursor.fetchone()[0]
+
+def read_chunk(conn, after_id, chunk_size):
+    """
+    Returns up to chunk_size readings with ID > after_id in ID order, as
+    (ID, TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp) rows.
+    """
+    columns = "ID, TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp"
+    cursor = conn.cursor()
+    if hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE:
+        cursor.execute(f"SELECT {columns} FROM {hardness_db.TABLE_NAME} WHERE ID > ? ORDER BY ID LIMIT ?;",
+                       (after_id, chunk_size))
+    else:
+        cursor.execute(f"SELECT TOP (?) {columns} FROM {hardness_db.TABLE_NAME} WHERE ID > ? ORDER BY ID;",
+                       (chunk_size, after_id))
+    return cursor.fetchall()
+
+def copy_chunk(conn, rows, is_last):
+    """
+    Writes one chunk to HardnessSamples and records the progress (does not commit).
+
+    Args:
+        rows (list): Rows from read_chunk().
+        is_last (bool): True if there are no readings after this chunk, so the
+            final sample is complete and is copied too.
+
+    Returns:
+        int: Number of readings copied (the held-back tail is re-read next time).
+    """
+    copy_count = len(rows)
+    if not is_last:
+        # Hold back the final sample's readings: it may continue in the next chunk
+        tail_key = tuple(rows[-1][1:3])
+        while copy_count > 0 and tuple(rows[copy_count - 1][1:3]) == tail_key:
+            copy_count -= 1
+        if copy_count == 0: # A single "sample" larger than the chunk; copy it as is
+            copy_count = len(rows)
+    records = [tuple(row[1:]) for row in rows[:copy_count]]
+    hardness_db.insert_wide_rows(conn, hardness_db.readings_to_wide_rows(records))
+    cursor = conn.cursor()
+    cursor.execute(f"UPDATE {MIGRATION_STATE_TABLE_NAME} SET LastReadingID = ?;", (rows[copy_count - 1][0],))
+    return copy_count
+
+def copy_readings(conn, chunk_size=DEFAULT_CHUNK_SIZE, progress_stream=sys.stderr):
+    """
+    Copies every reading not yet copied, one transaction per chunk.
+
+    Returns:
+        int: Number of readings copied by this call.
+    """
+    copied = 0
+    after_id = last_copied_id(conn)
+    while True:
+        rows = read_chunk(conn, after_id, chunk_size)
+        if not rows:
+            return copied
+        count = copy_chunk(conn, rows, is_last=len(rows) < chunk_size)
+        conn.commit()
+        copied += count
+        after_id = rows[count - 1][0]
+        print(f"Copied {copied} readings (up to ID {after_id}).", file=progress_stream)
+
+def reconcile_copy(conn):
+    """
+    Copies again the samples whose readings were skipped by copy_readings() because they
+    committed after a higher reading ID had been copied. The reading counts of
+    HardnessReadings (up to LastReadingID) and HardnessSamples are compared first; only if
+    they differ are they compared per technician and SampleID, and every pair that differs
+    is deleted from HardnessSamples and copied again from HardnessReadings. Commits.
+
+    Returns:
+        int: Number of readings copied again (0 when the copy was complete).
+    """
+    last_id = last_copied_id(conn)
+    non_null = " + ".join(f"CASE WHEN {column} IS NULL THEN 0 ELSE 1 END" for column in hardness_db.WIDE_COLUMNS)
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {hardness_db.TABLE_NAME} WHERE ID <= ?;", (last_id,))
+    narrow_count = cursor.fetchone()[0]
+    cursor.execute(f"SELECT COALESCE(SUM({non_null}), 0) FROM {hardness_db.WIDE_TABLE_NAME};")
+    if cursor.fetchone()[0] == narrow_count:
+        return 0
+
+    cursor.execute(f"SELECT TechnicianInitials, SampleID, COUNT(*) FROM {hardness_db.TABLE_NAME} "
+                   "WHERE ID <= ? GROUP BY TechnicianInitials, SampleID;", (last_id,))
+    narrow_counts = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    cursor.execute(f"SELECT TechnicianInitials, SampleID, SUM({non_null}) FROM {hardness_db.WIDE_TABLE_NAME} "
+                   "GROUP BY TechnicianInitials, SampleID;")
+    wide_counts = {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+    recopied = 0
+    for (technician, sample_id), count in narrow_counts.items():
+        if wide_counts.get((technician, sample_id)) == count:
+            continue
+        cursor.execute(f"DELETE FROM {hardness_db.WIDE_TABLE_NAME} WHERE TechnicianInitials = ? AND SampleID = ?;",
+                       (technician, sample_id))
+        cursor.execute(f"SELECT TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue, Timestamp "
+                       f"FROM {hardness_db.TABLE_NAME} WHERE TechnicianInitials = ? AND SampleID = ? AND ID <= ? ORDER BY ID;",
+                       (technician, sample_id, last_id))
+        records = [tuple(row) for row in cursor.fetchall()]
+        hardness_db.insert_wide_rows(conn, hardness_db.readings_to_wide_rows(records))
+        recopied += len(records)
+    conn.commit()
+    return recopied
+
+def switch_to_wide(conn):
+    """Renames HardnessReadings to HardnessReadingsNarrow and creates the compatibility view, then commits."""
+    cursor = conn.cursor()
+    if hardness_db.backend_of(conn) == hardness_db.BACKEND_SQLITE:
+        cursor.execute(f"ALTER TABLE {hardness_db.TABLE_NAME} RENAME TO {hardness_db.NARROW_ARCHIVE_TABLE_NAME};")
+    else:
+        cursor.execute(f"EXEC sp_rename '{hardness_db.TABLE_NAME}', '{hardness_db.NARROW_ARCHIVE_TABLE_NAME}';")
+    cursor.execute(hardness_db.compatibility_view_sql())
+    conn.commit()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Copy HardnessReadings into the one-row-per-sample HardnessSamples table.")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE, help="Readings per copy transaction.")
+    parser.add_argument("--switch", action="store_true",
+                        help="After copying, replace HardnessReadings with a view over HardnessSamples (stop the stations first).")
+    hardness_db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = hardness_db.connect_from_args(args)
+    start = time.perf_counter()
+    try:
+        if hardness_db.storage_layout(conn) == hardness_db.LAYOUT_WIDE:
+            print("The database already uses the wide layout.")
+            return 0
+        hardness_db.create_table(conn) # Also makes sure the summary table exists
+        hardness_db.create_wide_table(conn)
+        create_state_table(conn)
+        conn.commit()
+        copied = copy_readings(conn, args.chunk_size)
+        if args.switch:
+            copied += copy_readings(conn, args.chunk_size) # Anything saved while the last chunk was written
+            recopied = reconcile_copy(conn)
+            if recopied:
+                print(f"Copied {recopied} readings again that had committed after later ones.")
+            switch_to_wide(conn)
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"Copied {copied} readings in {elapsed:.1f}s." + (" HardnessReadings is now a view." if args.switch else ""))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
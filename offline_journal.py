@@ -0,0 +1,263 @@
+"""
+Local write-ahead journal for saved samples.
+
+"Save to Database" used to write straight to SQL Server, so a slow network made
+every save slow and an unreachable server lost the technician's 12 readings.
+Saves now go to an append-only JSON-lines file first (fsync'ed, so a sample is
+durable as soon as the save returns), and a JournalFlusher thread pushes the
+journaled samples to HardnessReadings in batches whenever the database can be
+reached.
+
+Every journaled sample carries a unique SampleKey. The flusher records the keys
+it has written in the HardnessJournalApplied table in the same transaction as
+the readings, so a retry after a lost commit acknowledgement never inserts a
+sample twice.
+
+File format, one JSON object per line:
+    {"key": "<uuid>", "timestamp": "YYYY-MM-DD HH:MM:SS", "records": [[initials, sample_id, side, position, value], ...]}
+    {"ack": "<uuid>"}   (written once the sample is in the database)
+"""
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+import hardness_db
+import instrumentation
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Rewrite the journal once this many acknowledged samples have piled up behind a pending one
+COMPACT_AFTER_ACKS = 1000
+
+
+class OfflineJournal:
+    """
+    Append-only, fsync'ed journal of samples waiting to be written to the database.
+
+    Args:
+        path (str): Journal file; created if missing, replayed if it exists.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._pending = OrderedDict() # key -> entry dict, in save order
+        self._acked_in_file = 0
+        self.appended = 0 # Entries appended by this process; snapshot() tells which came after a read
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        self._truncate_torn_tail()
+        with open(self.path, encoding='utf-8') as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue # Unreadable line (damaged file); torn last lines are already cut off above
+                if 'ack' in entry:
+                    self._pending.pop(entry['ack'], None)
+                    self._acked_in_file += 1
+                elif 'key' in entry:
+                    self._pending[entry['key']] = entry
+        if self._pending:
+            print(f"Journal '{self.path}' has {len(self._pending)} sample(s) waiting to be written to the database.")
+
+    def _truncate_torn_tail(self):
+        """
+        Cuts a last line without its newline (a crash mid-write) off the file. Otherwise
+        the next append would continue that line and the new entry would be unreadable.
+        """
+        with open(self.path, 'rb+') as journal_file:
+            content = journal_file.read()
+            if not content or content.endswith(b'\n'):
+                return
+            complete_length = content.rfind(b'\n') + 1
+            print(f"Journal '{self.path}' ends in an incomplete line ({len(content) - complete_length} bytes); "
+                  f"that save never completed and is dropped.")
+            journal_file.truncate(complete_length)
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def _append_lines(self, entries):
+        with open(self.path, 'a', encoding='utf-8') as journal_file:
+            for entry in entries:
+                journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+
+    def append(self, records, timestamp=None):
+        """
+        Durably records one saved sample.
+
+        Args:
+            records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples.
+            timestamp (datetime): When the readings were taken (default: now).
+
+        Returns:
+            str: The SampleKey of the journaled sample.
+        """
+        entry = {
+            'key': uuid.uuid4().hex,
+            'timestamp': (timestamp or datetime.now()).strftime(TIMESTAMP_FORMAT),
+            'records': [list(record) for record in records],
+        }
+        with self._lock, instrumentation.span('journal'):
+            self._append_lines([entry])
+            self._pending[entry['key']] = entry
+            self.appended += 1
+        return entry['key']
+
+    def pending(self, limit=None):
+        """Returns up to limit pending entries, oldest first."""
+        with self._lock:
+            entries = list(self._pending.values())
+        return entries if limit is None else entries[:limit]
+
+    def snapshot(self):
+        """
+        Returns:
+            tuple: (pending entries oldest first, appended) at the same instant; entries appended
+            later are the ones whose `appended` value right after their append() is larger.
+        """
+        with self._lock:
+            return list(self._pending.values()), self.appended
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def acknowledge(self, keys):
+        """Marks samples as written to the database and compacts the file when possible."""
+        with self._lock:
+            keys = [key for key in keys if key in self._pending]
+            if not keys:
+                return
+            for key in keys:
+                del self._pending[key]
+            if not self._pending:
+                # Everything is in the database; start a fresh, empty journal
+                self._rewrite([])
+            elif self._acked_in_file + len(keys) >= COMPACT_AFTER_ACKS:
+                self._rewrite(list(self._pending.values()))
+            else:
+                self._append_lines([{'ack': key} for key in keys])
+                self._acked_in_file += len(keys)
+
+    def _rewrite(self, entries):
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as journal_file:
+            for entry in entries:
+                journal_file.write(json.dumps(entry) + '\n')
+            journal_file.flush()
+            os.fsync(journal_file.fileno())
+        os.replace(temp_path, self.path)
+        self._acked_in_file = 0
+
+
+def unwritten_entries(conn, entries):
+    """
+    Returns the entries whose SampleKey is not in the database yet. A pending entry can
+    already be there when a batch committed but its acknowledgement was lost.
+    """
+    applied = hardness_db.fetch_applied_journal_keys(conn, [entry['key'] for entry in entries])
+    return [entry for entry in entries if entry['key'] not in applied]
+
+def journal_entry_records(entry):
+    """
+    Returns the timestamped records of a journal entry, ready for
+    hardness_db.insert_timestamped_readings().
+    """
+    timestamp = datetime.strptime(entry['timestamp'], TIMESTAMP_FORMAT)
+    return [tuple(record) + (timestamp,) for record in entry['records']]
+
+
+class JournalFlusher:
+    """
+    Background thread that writes journaled samples to the database in batches.
+
+    Args:
+        journal (OfflineJournal): The journal to drain.
+        connection_manager (db_connection.ConnectionManager): Shared warm connection.
+        interval (float): Seconds between attempts while samples are pending or the database is down.
+        batch_size (int): Samples written per transaction.
+        on_written (callable): Called on the flusher thread with the entries of every committed batch.
+        apply_entries (callable): Writes a batch of journal entries and returns their keys, e.g.
+            collector_service.CollectorClient.apply_journal_entries; by default they are written
+            through connection_manager.
+    """
+
+    def __init__(self, journal, connection_manager, interval=5.0, batch_size=100, on_written=None, apply_entries=None):
+        self._journal = journal
+        self._connection_manager = connection_manager
+        self._interval = interval
+        self._batch_size = batch_size
+        self._on_written = on_written
+        self._apply_entries = apply_entries
+        self._wake = threading.Event()
+        self._stopping = False
+        # Held from writing a batch until it is acknowledged. Holding it while reading the database and
+        # the journal gives one consistent point: none of this journal's samples move between the two.
+        self.write_lock = threading.Lock()
+        self._thread = None
+        self.last_error = None
+
+    def flush_once(self):
+        """
+        Writes every pending sample, batch by batch, on the calling thread.
+
+        Returns:
+            int: Number of samples written. Raises the database error if a batch fails.
+        """
+        written = 0
+        while True:
+            entries = self._journal.pending(self._batch_size)
+            if not entries:
+                return written
+            with self.write_lock:
+                if self._apply_entries is not None:
+                    keys = self._apply_entries(entries)
+                else:
+                    keys = self._connection_manager.run(lambda conn: hardness_db.apply_journal_entries(
+                        conn, [(entry['key'], journal_entry_records(entry)) for entry in entries]))
+                self._journal.acknowledge(keys)
+            written += len(keys)
+            if self._on_written is not None:
+                self._on_written(entries)
+
+    def _run(self):
+        while not self._stopping:
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if self._stopping or self._journal.pending_count() == 0:
+                continue
+            try:
+                with instrumentation.action('journal_flush'): # The database half of Save
+                    written = self.flush_once()
+                self.last_error = None
+                print(f"Flushed {written} journaled sample(s) to the database.")
+            except Exception as e: # Database unreachable or rejecting writes; keep the journal and retry later
+                self.last_error = e
+                print(f"Journal flush failed, will retry: {e}")
+
+    def start(self):
+        """Starts the flusher thread (once; later calls do nothing)."""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="hardness-journal-flusher", daemon=True)
+        self._thread.start()
+
+    def flush_soon(self):
+        """Wakes the flusher thread so it writes pending samples now instead of at the next interval."""
+        self._wake.set()
+
+    def stop(self, timeout=10.0):
+        """Stops the flusher thread after its current batch."""
+        self._stopping = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,233 @@
+"""
+Headless batch rendering of the Top/Bottom chart of every sample, for audits.
+
+Each report is the chart the technician saw on "Display on Graph": the sample's
+twelve readings against the control limits, per-position limits and Nelson rule
+violations as they were before that sample was saved. Those limits come from
+every earlier reading, so a range of reports needs the history up to its last
+sample. It is read in one query (hardness_db.fetch_samples()). The limits as of
+each sample are then computed for all samples at once from exclusive cumulative
+sums of count, deviation and squared deviation (around a fixed shift, so the
+sums of squares do not cancel). No per-sample query or loop over the history is
+needed.
+
+The figures are rendered with chart_renderer.ChartRenderer on the Agg canvas
+across a process pool. Every process builds one renderer and reuses it for all
+of its samples, changing only the data, as the window does. Limit modes
+(rolling window, EWMA, CUSUM) are not drawn; reports use the all-history limits.
+
+Usage:
+    python report_generator.py reports/ --start 2024-05-01 --end 2024-06-01 --sqlite hardness_readings.db
+    python report_generator.py reports/ --sample-id "12*" --format pdf --workers 8 --server HOST --database DB --username USER
+"""
+import argparse
+import fnmatch
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np # For the cumulative statistics
+
+import hardness_db
+from hardness_validation import normalize_initials
+from spc_config import DEFAULT_LIMITS
+from spc_rules import LOOKBACK, evaluate_new_points, violating_indices
+
+SIDES = ('Bottom', 'Top')
+FORMATS = ('png', 'pdf')
+DEFAULT_DPI = 100
+FIGSIZE = (10, 8) # Inches; the window stretches its (6, 4) figure to the canvas, reports need the room too
+TASK_SAMPLES = 25 # Reports per pool task
+
+_worker_renderer = None # ChartRenderer of the pool process, created by _init_worker()
+_worker_title = None
+_worker_options = None # (output_dir, image_format, dpi)
+
+
+def _exclusive_cumsum(values):
+    """Sum of all rows before each row."""
+    return np.cumsum(values, axis=0) - values
+
+def _limits_from_sums(counts, sums, squares, shift):
+    """(mean, ucl, lcl) arrays from counts and sums of deviations from shift; NaN with fewer than 2 values."""
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_deviation = sums / counts
+        m2 = np.maximum(squares - sums * mean_deviation, 0.0)
+        std_dev = np.sqrt(m2 / (counts - 1))
+    mean_val = np.where(counts >= 2, shift + mean_deviation, np.nan)
+    std_dev = np.where(counts >= 2, std_dev, np.nan)
+    return mean_val, mean_val + 3 * std_dev, mean_val - 3 * std_dev
+
+def cumulative_limits(matrix):
+    """
+    3-sigma limits as of every sample: from all readings of the samples before it.
+
+    Args:
+        matrix (np.ndarray): (samples, 12) readings (B1-B6, T1-T6) in time order, NaN where missing.
+
+    Returns:
+        tuple: (side_limits, position_limits) where side_limits[side] is a (samples, 3) array
+        of mean, UCL and LCL and position_limits[side] a (samples, 3, 6) array of the same per
+        position. Both are NaN where fewer than 2 earlier readings exist.
+    """
+    valid = ~np.isnan(matrix)
+    shift = float(np.nanmean(matrix)) if valid.any() else 0.0
+    deviations = np.where(valid, matrix - shift, 0.0)
+    counts = _exclusive_cumsum(valid.astype(np.float64))
+    sums = _exclusive_cumsum(deviations)
+    squares = _exclusive_cumsum(deviations * deviations)
+    side_limits = {}
+    position_limits = {}
+    for side, columns in (('Bottom', slice(0, 6)), ('Top', slice(6, 12))):
+        side_limits[side] = np.stack(_limits_from_sums(counts[:, columns].sum(axis=1), sums[:, columns].sum(axis=1),
+                                                       squares[:, columns].sum(axis=1), shift), axis=1)
+        position_limits[side] = np.stack(_limits_from_sums(counts[:, columns], sums[:, columns],
+                                                           squares[:, columns], shift), axis=1)
+    return side_limits, position_limits
+
+def _as_datetime(value):
+    """Timestamps come back as text from SQLite and as datetime from pyodbc."""
+    return datetime.fromisoformat(value) if isinstance(value, str) else value
+
+def select_samples(samples, start=None, technician=None, sample_id=None):
+    """
+    Indices of the samples to report on.
+
+    Args:
+        samples (list): (TechnicianInitials, SampleID, Timestamp) tuples from hardness_db.fetch_samples().
+        start (datetime): Only samples at or after this time.
+        technician (str): Only samples of these initials (in any case).
+        sample_id (str): Only samples with this SampleID; * matches any characters.
+    """
+    technician = normalize_initials(technician) if technician else None
+    return [index for index, (sample_technician, sample_sample_id, timestamp) in enumerate(samples)
+            if (start is None or _as_datetime(timestamp) >= start)
+            and (technician is None or normalize_initials(sample_technician) == technician)
+            and (sample_id is None or fnmatch.fnmatchcase(sample_sample_id, sample_id))]
+
+def _limit_lists(limits):
+    """(3, 6) position limit array as the (means, ucls, lcls) lists update_plot() takes, None where unknown."""
+    return tuple([None if np.isnan(value) else float(value) for value in row] for row in limits)
+
+def build_report_payloads(samples, matrix, indices):
+    """
+    Everything a pool process needs to draw the reports of the given samples,
+    without access to the database or the rest of the history.
+
+    Returns:
+        list: One tuple per sample: (file_stem, title, {side: (values, (mean, ucl, lcl), position_limits, tail)}).
+    """
+    side_limits, position_limits = cumulative_limits(matrix)
+    side_columns = {'Bottom': matrix[:, :6], 'Top': matrix[:, 6:]}
+    # Each side's readings in save order and where each sample's readings start, for the Nelson rule context
+    flat_values = {side: values.ravel()[~np.isnan(values.ravel())] for side, values in side_columns.items()}
+    offsets = {side: _exclusive_cumsum((~np.isnan(values)).sum(axis=1)) for side, values in side_columns.items()}
+    payloads = []
+    for index in indices:
+        technician, sample_id, timestamp = samples[index]
+        sides = {}
+        for side in SIDES:
+            limits = side_limits[side][index]
+            if np.isnan(limits).any():
+                limits = DEFAULT_LIMITS[side]
+            offset = offsets[side][index]
+            sides[side] = (side_columns[side][index].tolist(), tuple(float(value) for value in limits),
+                           _limit_lists(position_limits[side][index]),
+                           flat_values[side][max(0, offset - LOOKBACK):offset].tolist())
+        file_stem = f"{index + 1:06d}_{re.sub(r'[^A-Za-z0-9_-]', '_', sample_id)}"
+        title = f"Sample {sample_id}  -  {technician}  -  {_as_datetime(timestamp):%Y-%m-%d %H:%M:%S}"
+        payloads.append((file_stem, title, sides))
+    return payloads
+
+def _init_worker(output_dir, image_format, dpi):
+    global _worker_renderer, _worker_title, _worker_options
+    from chart_renderer import ChartRenderer # Imports matplotlib (Agg canvas only) in the pool process
+    _worker_renderer = ChartRenderer(figsize=FIGSIZE)
+    _worker_title = _worker_renderer.fig.suptitle("Sample", fontsize='medium')
+    _worker_renderer.relayout() # Once, with room for the title
+    _worker_options = (output_dir, image_format, dpi)
+
+def render_report(renderer, title_text, payload, path, dpi=DEFAULT_DPI):
+    """Draws one sample's report on a reused ChartRenderer and saves it to path (format from the extension)."""
+    _, title, sides = payload
+    arguments = {}
+    for side in SIDES:
+        values, limits, position_limits, tail = sides[side]
+        mean_val, ucl, lcl = limits
+        rule_results = evaluate_new_points(tail, values, mean_val, (ucl - mean_val) / 3)
+        arguments[side] = (values, limits, violating_indices(rule_results).tolist(), position_limits)
+    bottom, top = arguments['Bottom'], arguments['Top']
+    renderer.update(bottom[0], top[0], *bottom[1], *top[1],
+                    bottom_violations=bottom[2], top_violations=top[2],
+                    bottom_position_limits=bottom[3], top_position_limits=top[3], redraw=False)
+    title_text.set_text(title)
+    renderer.fig.savefig(path, dpi=dpi)
+
+def _render_chunk(payloads):
+    output_dir, image_format, dpi = _worker_options
+    paths = []
+    for payload in payloads:
+        path = os.path.join(output_dir, f"{payload[0]}.{image_format}")
+        render_report(_worker_renderer, _worker_title, payload, path, dpi)
+        paths.append(path)
+    return paths
+
+def generate_reports(samples, matrix, indices, output_dir, image_format='png', dpi=DEFAULT_DPI, workers=None):
+    """
+    Renders the report of every selected sample into output_dir.
+
+    Args:
+        samples, matrix: As returned by hardness_db.fetch_samples() (the history up to the last selected sample).
+        indices (list): Samples to report on, e.g. from select_samples().
+        output_dir (str): Destination directory (created if missing).
+        image_format (str): 'png' or 'pdf'.
+        dpi (int): Resolution of the PNG reports.
+        workers (int): Processes to use; defaults to the number of CPUs.
+
+    Returns:
+        list: Paths of the written files, in sample order.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    payloads = build_report_payloads(samples, matrix, indices)
+    chunks = [payloads[start:start + TASK_SAMPLES] for start in range(0, len(payloads), TASK_SAMPLES)]
+    workers = min(workers or os.cpu_count() or 1, max(len(chunks), 1))
+    if workers == 1:
+        _init_worker(output_dir, image_format, dpi)
+        return [path for chunk in chunks for path in _render_chunk(chunk)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(output_dir, image_format, dpi)) as pool:
+        return [path for paths in pool.map(_render_chunk, chunks) for path in paths]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render the Top/Bottom chart of every sample in a range to PNG or PDF.")
+    parser.add_argument("output_dir", help="Directory for the reports.")
+    parser.add_argument("--start", type=datetime.fromisoformat, help="Only samples at or after this time (YYYY-MM-DD[ HH:MM:SS]).")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Only samples before this time (YYYY-MM-DD[ HH:MM:SS]).")
+    parser.add_argument("--technician", help="Only samples of these technician initials (any case).")
+    parser.add_argument("--sample-id", help="Only samples with this SampleID (* matches any characters).")
+    parser.add_argument("--format", choices=FORMATS, default='png', help="Report file format.")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_DPI, help="Resolution of PNG reports.")
+    parser.add_argument("--workers", type=int, help="Rendering processes (default: number of CPUs).")
+    hardness_db.add_connection_arguments(parser)
+    args = parser.parse_args(argv)
+
+    conn = hardness_db.connect_from_args(args)
+    try:
+        start = time.perf_counter()
+        samples, matrix = hardness_db.fetch_samples(conn, args.end)
+    finally:
+        conn.close()
+    read_seconds = time.perf_counter() - start
+    indices = select_samples(samples, args.start, args.technician, args.sample_id)
+    start = time.perf_counter()
+    paths = generate_reports(samples, matrix, indices, args.output_dir, args.format, args.dpi, args.workers)
+    print(f"Read {len(samples)} samples in {read_seconds:.1f}s, "
+          f"rendered {len(paths)} reports to {args.output_dir} in {time.perf_counter() - start:.1f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
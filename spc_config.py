@@ -0,0 +1,25 @@
+"""
+SPC limits configured for the plant, shared by the data entry window and the
+headless tools (report_generator.py), so a changed value applies to both.
+"""
+
+# --- Default SPC Values for initial empty database scenario ---
+DEFAULT_TOP_UCL = 340.0
+DEFAULT_TOP_MEAN = 320.0
+DEFAULT_TOP_LCL = 300.0
+
+DEFAULT_BOTTOM_UCL = 340.0
+DEFAULT_BOTTOM_MEAN = 320.0
+DEFAULT_BOTTOM_LCL = 300.0
+
+# (mean, ucl, lcl) per side, shown while a side has fewer than 2 readings
+DEFAULT_LIMITS = {
+    'Bottom': (DEFAULT_BOTTOM_MEAN, DEFAULT_BOTTOM_UCL, DEFAULT_BOTTOM_LCL),
+    'Top': (DEFAULT_TOP_MEAN, DEFAULT_TOP_UCL, DEFAULT_TOP_LCL),
+}
+
+# Specification limits (LSL, USL) for the capability analysis; None for a one-sided spec
+SPEC_LIMITS = {
+    'Bottom': (290.0, 350.0),
+    'Top': (290.0, 350.0),
+}
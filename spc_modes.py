@@ -0,0 +1,223 @@
+"""
+Faster-reacting control limit modes: rolling window, EWMA and tabular CUSUM.
+
+The default limits come from every reading ever saved (spc_statistics). With a
+long history they barely move, so a real shift of the process takes hundreds
+of samples to show. The technician can pick one of these modes instead:
+
+  - Rolling window: 3-sigma limits of the readings of the last
+    ROLLING_WINDOW_SAMPLES samples.
+  - EWMA: exponentially weighted moving average of the sample means,
+    z = lambda * xbar + (1 - lambda) * z, against the limits
+    mu0 +/- L * sigma_xbar * sqrt(lambda / (2 - lambda) * (1 - (1 - lambda)^(2t))).
+  - CUSUM: tabular CUSUM of the sample means,
+    C+ = max(0, C+ + xbar - (mu0 + K * sigma_xbar)) and C- likewise,
+    which signals once either exceeds H * sigma_xbar.
+
+EWMA and CUSUM use the all-history mean and standard deviation of the side as
+mu0 and sigma (sigma_xbar = sigma / sqrt(6)).
+
+Each side keeps a SideModeState. The window lives in fixed-size NumPy ring
+buffers of per-sample count, mean and M2, with window sums that are updated in
+O(1) per sample. EWMA and CUSUM are plain accumulators. The state is restored
+once at startup from the last MODE_HISTORY_SAMPLES rows of the sample summary
+table and then updated on every save. Switching modes only changes what is
+drawn and never queries the database again.
+"""
+import math
+from itertools import groupby
+
+import numpy as np # For the ring buffers
+
+from spc_statistics import SIDES, RunningStatistics
+from spc_subgroups import DEFAULT_SUBGROUP_SIZE
+
+MODE_CUMULATIVE = 'All History'
+MODE_ROLLING = 'Rolling Window'
+MODE_EWMA = 'EWMA'
+MODE_CUSUM = 'CUSUM'
+MODES = (MODE_CUMULATIVE, MODE_ROLLING, MODE_EWMA, MODE_CUSUM)
+
+ROLLING_WINDOW_SAMPLES = 50 # Samples (of 6 readings per side) in the rolling window
+EWMA_LAMBDA = 0.2 # Weight of the newest sample mean
+EWMA_WIDTH = 3.0 # L, limit width in standard deviations of the EWMA statistic
+CUSUM_K = 0.5 # Reference value (allowance) in sigma_xbar; detects shifts of about 2K
+CUSUM_H = 5.0 # Decision interval in sigma_xbar
+
+# Samples read at startup: the window plus enough EWMA/CUSUM history for the
+# weight of the samples before it to be negligible ((1 - 0.2) ** 200 ~ 4e-20)
+MODE_HISTORY_SAMPLES = max(ROLLING_WINDOW_SAMPLES, 200)
+
+
+class SideModeState:
+    """
+    Rolling window, EWMA and CUSUM state of one side, updated in O(1) per sample.
+
+    Args:
+        window_samples (int): Size of the rolling window in samples.
+    """
+
+    def __init__(self, window_samples=ROLLING_WINDOW_SAMPLES):
+        self._counts = np.zeros(window_samples, dtype=np.int64)
+        self._means = np.zeros(window_samples)
+        self._m2s = np.zeros(window_samples)
+        self._head = 0 # Slot the next sample goes to
+        self._filled = 0
+        # Window sums around a fixed shift (the first sample's mean), which keeps the
+        # sum of squares from cancelling: count, sum of n*(mean - shift) and of M2 + n*(mean - shift)^2
+        self._shift = None
+        self._sum_count = 0
+        self._sum_deviation = 0.0
+        self._sum_square = 0.0
+
+        self.ewma = None
+        self.ewma_samples = 0
+        self.cusum_high = 0.0
+        self.cusum_low = 0.0
+
+    def _recompute_window_sums(self):
+        filled = slice(0, self._filled)
+        deviations = self._means[filled] - self._shift
+        self._sum_count = int(self._counts[filled].sum())
+        self._sum_deviation = float(np.dot(self._counts[filled], deviations))
+        self._sum_square = float(self._m2s[filled].sum() + np.dot(self._counts[filled], deviations * deviations))
+
+    def _add_to_window(self, count, mean_val, m2):
+        if self._shift is None:
+            self._shift = mean_val
+        if self._filled == self._counts.size: # Evict the oldest sample, which sits in the head slot
+            old_count, old_deviation = self._counts[self._head], self._means[self._head] - self._shift
+            self._sum_count -= int(old_count)
+            self._sum_deviation -= old_count * old_deviation
+            self._sum_square -= self._m2s[self._head] + old_count * old_deviation * old_deviation
+        else:
+            self._filled += 1
+        deviation = mean_val - self._shift
+        self._counts[self._head], self._means[self._head], self._m2s[self._head] = count, mean_val, m2
+        self._sum_count += count
+        self._sum_deviation += count * deviation
+        self._sum_square += m2 + count * deviation * deviation
+        self._head = (self._head + 1) % self._counts.size
+        if self._head == 0: # Once per pass through the ring, drop the rounding error of the running sums
+            self._recompute_window_sums()
+
+    def window_statistics(self):
+        """
+        Returns:
+            RunningStatistics: Count, mean and M2 of the readings in the rolling window.
+        """
+        if self._sum_count == 0:
+            return RunningStatistics()
+        mean_deviation = self._sum_deviation / self._sum_count
+        m2 = max(self._sum_square - self._sum_deviation * mean_deviation, 0.0)
+        return RunningStatistics(self._sum_count, self._shift + mean_deviation, m2)
+
+    def _next_ewma(self, sample_mean, baseline):
+        previous = self.ewma
+        if previous is None: # Start at the target (or at the first sample without a history)
+            previous = baseline.mean if baseline is not None and baseline.count else sample_mean
+        return EWMA_LAMBDA * sample_mean + (1 - EWMA_LAMBDA) * previous
+
+    def _next_cusum(self, sample_mean, baseline):
+        sigma_xbar = _sigma_xbar(baseline)
+        if sigma_xbar is None:
+            return self.cusum_high, self.cusum_low
+        allowance = CUSUM_K * sigma_xbar
+        return (max(0.0, self.cusum_high + sample_mean - (baseline.mean + allowance)),
+                max(0.0, self.cusum_low + (baseline.mean - allowance) - sample_mean))
+
+    def add_sample(self, count, mean_val, m2, baseline):
+        """
+        Folds one saved sample (subgroup) of this side into every mode.
+
+        Args:
+            count (int): Readings in the sample.
+            mean_val (float): Their mean.
+            m2 (float): Their sum of squared deviations from the mean.
+            baseline (RunningStatistics): All-history statistics of the side (mu0, sigma), or None.
+        """
+        if count == 0:
+            return
+        self._add_to_window(count, mean_val, m2)
+        self.ewma = self._next_ewma(mean_val, baseline)
+        self.ewma_samples += 1
+        self.cusum_high, self.cusum_low = self._next_cusum(mean_val, baseline)
+
+    def overlay(self, mode, baseline, current_values=()):
+        """
+        The EWMA or CUSUM statistic and its limits, on the hardness scale so they can
+        be drawn on the readings chart. Displayed (not yet saved) readings are
+        included as the next sample without changing the state.
+
+        Args:
+            mode (str): MODE_EWMA or MODE_CUSUM (other modes have no overlay).
+            baseline (RunningStatistics): All-history statistics of the side.
+            current_values (list): Displayed readings of this side, if any.
+
+        Returns:
+            tuple: (center, ucl, lcl, statistic_values), or None without enough data.
+            For CUSUM the statistics are drawn as mu0 + C+ and mu0 - C-, against mu0 +/- H * sigma_xbar.
+        """
+        sigma_xbar = _sigma_xbar(baseline)
+        if sigma_xbar is None or mode not in (MODE_EWMA, MODE_CUSUM):
+            return None
+        current_mean = float(np.mean(current_values)) if len(current_values) else None
+        if mode == MODE_EWMA:
+            ewma, samples = self.ewma, self.ewma_samples
+            if current_mean is not None:
+                ewma, samples = self._next_ewma(current_mean, baseline), samples + 1
+            if ewma is None:
+                return None
+            width = EWMA_WIDTH * sigma_xbar * math.sqrt(
+                EWMA_LAMBDA / (2 - EWMA_LAMBDA) * (1 - (1 - EWMA_LAMBDA) ** (2 * samples)))
+            return baseline.mean, baseline.mean + width, baseline.mean - width, [ewma]
+        cusum_high, cusum_low = self.cusum_high, self.cusum_low
+        if current_mean is not None:
+            cusum_high, cusum_low = self._next_cusum(current_mean, baseline)
+        decision = CUSUM_H * sigma_xbar
+        return (baseline.mean, baseline.mean + decision, baseline.mean - decision,
+                [baseline.mean + cusum_high, baseline.mean - cusum_low])
+
+
+def _sigma_xbar(baseline):
+    """Standard deviation of a sample mean of DEFAULT_SUBGROUP_SIZE readings, or None without a baseline."""
+    if baseline is None or baseline.std_dev is None:
+        return None
+    return baseline.std_dev / math.sqrt(DEFAULT_SUBGROUP_SIZE)
+
+def build_mode_states(recent_summaries, side_statistics):
+    """
+    Restores the mode state of both sides from recent sample summaries.
+
+    Args:
+        recent_summaries (dict): As returned by hardness_db.fetch_recent_sample_summaries().
+        side_statistics (dict): All-history {side: RunningStatistics} used as the EWMA/CUSUM baseline.
+
+    Returns:
+        dict: {'Bottom': SideModeState, 'Top': SideModeState}
+    """
+    mode_states = {side: SideModeState() for side in SIDES}
+    for side in SIDES:
+        baseline = side_statistics.get(side) if side_statistics else None
+        for count, mean_val, std_dev in recent_summaries.get(side, []):
+            m2 = 0.0 if std_dev is None else std_dev * std_dev * (count - 1)
+            mode_states[side].add_sample(count, mean_val, m2, baseline)
+    return mode_states
+
+def update_mode_states(mode_states, records, side_statistics):
+    """
+    Folds newly saved records into the mode states in place. Consecutive records of
+    the same technician, SampleID and side form one sample.
+
+    Args:
+        mode_states (dict): As returned by build_mode_states().
+        records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples.
+        side_statistics (dict): All-history {side: RunningStatistics} (the EWMA/CUSUM baseline).
+    """
+    for key, group in groupby(records, key=lambda record: tuple(record[:3])):
+        side = key[2]
+        if side in mode_states:
+            sample = RunningStatistics.from_values([record[4] for record in group])
+            baseline = side_statistics.get(side) if side_statistics else None
+            mode_states[side].add_sample(sample.count, sample.mean, sample.m2, baseline)
+    return mode_states
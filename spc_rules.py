@@ -0,0 +1,149 @@
+"""
+Nelson rules (Western Electric rules 1-4 plus Nelson's 5-8) for out-of-control patterns.
+
+Each rule is evaluated over a whole series at once: the per-point conditions
+are computed as boolean arrays, and "k points in a row" / "m out of k points"
+patterns are found with cumulative-sum window counts, so there is no Python
+loop over the points and millions of readings are checked in a fraction of a
+second.
+
+A violation is reported at the index of the point that completes the pattern.
+For a single new sample, evaluate_new_points() only evaluates the windows that
+end on the new readings, using the last LOOKBACK values of history as context.
+"""
+import numpy as np # For vectorized window evaluation
+
+RULE_DESCRIPTIONS = {
+    1: "One point beyond 3 sigma",
+    2: "Nine points in a row on the same side of the mean",
+    3: "Six points in a row steadily increasing or decreasing",
+    4: "Fourteen points in a row alternating up and down",
+    5: "Two out of three points beyond 2 sigma on the same side",
+    6: "Four out of five points beyond 1 sigma on the same side",
+    7: "Fifteen points in a row within 1 sigma",
+    8: "Eight points in a row beyond 1 sigma on either side",
+}
+
+# Longest pattern (rule 7) spans 15 points, so 14 earlier points are enough context
+LOOKBACK = 14
+
+
+def _window_counts(mask, window):
+    """
+    Number of True values in each window of `window` consecutive elements.
+    Element i of the result covers mask[i:i + window], i.e. it ends at index i + window - 1.
+    """
+    counts = np.concatenate(([0], np.cumsum(mask, dtype=np.int64)))
+    return counts[window:] - counts[:-window]
+
+def _runs_ending(mask, window, offset=0):
+    """
+    Indices (in the original series) of points that end a run of `window` True values.
+    `offset` shifts the indices for masks derived from differences of the series.
+    """
+    if len(mask) < window:
+        return np.empty(0, dtype=np.int64)
+    full = np.flatnonzero(_window_counts(mask, window) == window)
+    return full + window - 1 + offset
+
+def _m_of_k_ending(mask, m, k):
+    """Indices of points ending a window of k points of which at least m are True,
+    where the ending point itself is one of them."""
+    if len(mask) < k:
+        return np.empty(0, dtype=np.int64)
+    ends = np.arange(k - 1, len(mask))
+    hits = (_window_counts(mask, k) >= m) & mask[ends]
+    return ends[hits]
+
+def evaluate_rules(values, mean, sigma, rules=tuple(RULE_DESCRIPTIONS)):
+    """
+    Evaluates Nelson rules over a series.
+
+    Args:
+        values (array-like): Hardness values in time order.
+        mean (float): Center line.
+        sigma (float): Process standard deviation (UCL = mean + 3 * sigma).
+        rules (iterable): Rule numbers (1-8) to evaluate.
+
+    Returns:
+        dict: {rule_number: np.ndarray of indices of the points completing a violation}
+    """
+    data = np.asarray(values, dtype=np.float64)
+    if sigma is None or sigma <= 0 or data.size == 0:
+        return {rule: np.empty(0, dtype=np.int64) for rule in rules}
+
+    z = (data - mean) / sigma
+    above, below = z > 0, z < 0
+    diffs = np.diff(data)
+
+    results = {}
+    for rule in rules:
+        if rule == 1:
+            found = np.flatnonzero(np.abs(z) > 3)
+        elif rule == 2:
+            found = np.union1d(_runs_ending(above, 9), _runs_ending(below, 9))
+        elif rule == 3:
+            # 6 points trending = 5 consecutive differences of the same sign
+            found = np.union1d(_runs_ending(diffs > 0, 5, offset=1), _runs_ending(diffs < 0, 5, offset=1))
+        elif rule == 4:
+            # 14 alternating points = 12 consecutive sign changes between the 13 differences
+            alternating = diffs[:-1] * diffs[1:] < 0
+            found = _runs_ending(alternating, 12, offset=2)
+        elif rule == 5:
+            found = np.union1d(_m_of_k_ending(z > 2, 2, 3), _m_of_k_ending(z < -2, 2, 3))
+        elif rule == 6:
+            found = np.union1d(_m_of_k_ending(z > 1, 4, 5), _m_of_k_ending(z < -1, 4, 5))
+        elif rule == 7:
+            found = _runs_ending(np.abs(z) < 1, 15)
+        elif rule == 8:
+            outside = np.abs(z) > 1
+            runs = _runs_ending(outside, 8)
+            if runs.size:
+                # Both sides must be represented within the run
+                above_counts = _window_counts(z > 1, 8)[runs - 7]
+                runs = runs[(above_counts > 0) & (above_counts < 8)]
+            found = runs
+        else:
+            raise ValueError(f"Unknown Nelson rule: {rule}")
+        results[rule] = found.astype(np.int64)
+    return results
+
+def evaluate_new_points(history_tail, new_values, mean, sigma, rules=tuple(RULE_DESCRIPTIONS)):
+    """
+    Evaluates only the windows ending on newly arrived values.
+
+    Args:
+        history_tail (array-like): The most recent historical values (up to LOOKBACK are used).
+        new_values (array-like): New values, in time order.
+        mean (float): Center line.
+        sigma (float): Process standard deviation.
+
+    Returns:
+        dict: {rule_number: indices into new_values of the points completing a violation}
+    """
+    tail = np.asarray(history_tail, dtype=np.float64)[-LOOKBACK:]
+    series = np.concatenate((tail, np.asarray(new_values, dtype=np.float64)))
+    results = evaluate_rules(series, mean, sigma, rules)
+    return {rule: indices[indices >= tail.size] - tail.size for rule, indices in results.items()}
+
+def violating_indices(results):
+    """Sorted unique indices flagged by any rule in a result of evaluate_rules()."""
+    arrays = [indices for indices in results.values() if indices.size]
+    if not arrays:
+        return np.empty(0, dtype=np.int64)
+    return np.unique(np.concatenate(arrays))
+
+def describe_violations(results, labels):
+    """
+    Human-readable lines for the violations in a result, e.g.
+    "Bottom 3: One point beyond 3 sigma".
+
+    Args:
+        results (dict): As returned by evaluate_rules() / evaluate_new_points().
+        labels (list): Display label for each index.
+    """
+    lines = []
+    for rule, indices in sorted(results.items()):
+        for index in indices:
+            lines.append(f"{labels[index]}: {RULE_DESCRIPTIONS[rule]} (rule {rule})")
+    return lines
@@ -0,0 +1,246 @@
+"""
+Running statistics for the SPC control limits.
+
+The UI used to re-read every historical hardness value from the database on
+each "Display on Graph" / "Save to Database" click just to recompute a mean and
+a standard deviation. The accumulators in this module keep count, mean and M2
+(sum of squared deviations) per Top/Bottom series instead, so the history is
+read once at startup and each save only folds in its 12 new readings.
+"""
+import json
+import math
+import os
+from datetime import datetime
+
+import numpy as np # For vectorized batch updates
+
+SIDES = ('Bottom', 'Top')
+POSITIONS = (1, 2, 3, 4, 5, 6)
+
+
+class RunningStatistics:
+    """
+    Mergeable count/mean/M2 accumulator (Welford's algorithm, batched with
+    Chan et al.'s parallel merge formula).
+    """
+
+    __slots__ = ('count', 'mean', 'm2')
+
+    def __init__(self, count=0, mean=0.0, m2=0.0):
+        self.count = int(count)
+        self.mean = float(mean)
+        self.m2 = float(m2)
+
+    @classmethod
+    def from_values(cls, values):
+        """
+        Builds an accumulator from a batch of values.
+
+        Args:
+            values (iterable): Numerical hardness values.
+
+        Returns:
+            RunningStatistics: Statistics of the batch.
+        """
+        data = np.asarray(values, dtype=np.float64)
+        if data.size == 0:
+            return cls()
+        mean_val = data.mean()
+        m2 = np.square(data - mean_val).sum()
+        return cls(data.size, mean_val, m2)
+
+    @classmethod
+    def from_summary(cls, count, mean, std_dev):
+        """
+        Rebuilds an accumulator from a COUNT/AVG/STDEV summary computed by the database.
+
+        Args:
+            count (int): Number of values.
+            mean (float): Mean of the values.
+            std_dev (float): Sample standard deviation (ddof=1), or None for a single value.
+        """
+        if count == 0:
+            return cls()
+        m2 = 0.0 if std_dev is None else std_dev * std_dev * (count - 1)
+        return cls(count, mean, m2)
+
+    def update(self, values):
+        """Folds a batch of new values into the running statistics in place."""
+        self.merge(RunningStatistics.from_values(values))
+        return self
+
+    def merge(self, other):
+        """
+        Merges another accumulator into this one in place.
+
+        Args:
+            other (RunningStatistics): Statistics of a disjoint set of values.
+        """
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean, other.m2
+            return self
+
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta * delta * self.count * other.count / total
+        self.count = total
+        return self
+
+    def copy(self):
+        return RunningStatistics(self.count, self.mean, self.m2)
+
+    @property
+    def variance(self):
+        """Sample variance (ddof=1), or None with fewer than 2 values."""
+        if self.count < 2:
+            return None
+        return self.m2 / (self.count - 1)
+
+    @property
+    def std_dev(self):
+        """Sample standard deviation (ddof=1), or None with fewer than 2 values."""
+        variance = self.variance
+        return None if variance is None else math.sqrt(variance)
+
+    def control_limits(self):
+        """
+        Calculates the 3-sigma limits exactly like calculate_control_limits().
+
+        Returns:
+            tuple: (mean, ucl, lcl) or (None, None, None) if not enough data.
+        """
+        std_dev = self.std_dev
+        if std_dev is None:
+            return None, None, None
+        return self.mean, self.mean + (3 * std_dev), self.mean - (3 * std_dev)
+
+    def __repr__(self):
+        return f"RunningStatistics(count={self.count}, mean={self.mean:.4f}, m2={self.m2:.4f})"
+
+
+def build_side_statistics(bottom_values, top_values):
+    """
+    Builds the per-side accumulators from the historical value lists returned
+    by hardness_db.fetch_all_hardness_values().
+
+    Returns:
+        dict: {'Bottom': RunningStatistics, 'Top': RunningStatistics}
+    """
+    return {
+        'Bottom': RunningStatistics.from_values(bottom_values),
+        'Top': RunningStatistics.from_values(top_values),
+    }
+
+
+def build_side_statistics_from_aggregates(aggregates):
+    """
+    Builds the per-side accumulators from the grouped COUNT/AVG/STDEV rows
+    returned by hardness_db.fetch_control_limit_aggregates().
+
+    Returns:
+        dict: {'Bottom': RunningStatistics, 'Top': RunningStatistics}
+    """
+    side_statistics = {side: RunningStatistics() for side in SIDES}
+    for side, (count, mean_val, std_dev) in aggregates.items():
+        if side in side_statistics:
+            side_statistics[side] = RunningStatistics.from_summary(count, mean_val, std_dev)
+    return side_statistics
+
+
+def update_side_statistics(side_statistics, records):
+    """
+    Folds newly saved records into the per-side accumulators in place.
+
+    Args:
+        side_statistics (dict): As returned by build_side_statistics().
+        records (list): (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples.
+    """
+    for side in SIDES:
+        values = [record[4] for record in records if record[2] == side]
+        if values:
+            side_statistics[side].update(values)
+    return side_statistics
+
+
+def build_position_statistics_from_aggregates(position_aggregates):
+    """
+    Builds one accumulator per side and position from the rows returned by
+    hardness_db.fetch_control_limit_aggregates(conn, by_position=True).
+
+    Returns:
+        dict: {(side, position): RunningStatistics} for all 12 combinations.
+    """
+    position_statistics = {(side, position): RunningStatistics() for side in SIDES for position in POSITIONS}
+    for key, (count, mean_val, std_dev) in position_aggregates.items():
+        if key in position_statistics:
+            position_statistics[key] = RunningStatistics.from_summary(count, mean_val, std_dev)
+    return position_statistics
+
+def side_statistics_from_positions(position_statistics):
+    """
+    Merges per-position accumulators into per-side ones, so a single grouped
+    query serves both the pooled and the per-position limits.
+
+    Returns:
+        dict: {'Bottom': RunningStatistics, 'Top': RunningStatistics}
+    """
+    side_statistics = {side: RunningStatistics() for side in SIDES}
+    for (side, _), statistics in position_statistics.items():
+        if side in side_statistics:
+            side_statistics[side].merge(statistics)
+    return side_statistics
+
+def update_position_statistics(position_statistics, records):
+    """Folds newly saved records into the per-side, per-position accumulators in place."""
+    for record in records:
+        key = (record[2], int(record[3]))
+        if key in position_statistics:
+            position_statistics[key].update([record[4]])
+    return position_statistics
+
+def position_control_limits(position_statistics, side):
+    """
+    Per-position 3-sigma limits of one side, in position order 1-6.
+
+    Returns:
+        tuple: (means, ucls, lcls) lists with None for positions without enough data.
+    """
+    limits = [position_statistics[(side, position)].control_limits() for position in POSITIONS]
+    return [limit[0] for limit in limits], [limit[1] for limit in limits], [limit[2] for limit in limits]
+
+def save_statistics_snapshot(path, position_statistics):
+    """
+    Persists the per-position accumulators (count, mean, std dev) so the next start can
+    show the last known limits before the database has answered.
+    """
+    snapshot = {
+        'saved': datetime.now().isoformat(timespec='seconds'),
+        'positions': [[side, position, statistics.count, statistics.mean, statistics.std_dev]
+                      for (side, position), statistics in sorted(position_statistics.items())],
+    }
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+    os.replace(temp_path, path)
+
+def load_statistics_snapshot(path):
+    """
+    Reads a snapshot written by save_statistics_snapshot().
+
+    Returns:
+        dict: {(side, position): RunningStatistics}, or None if there is no usable snapshot.
+    """
+    try:
+        with open(path, encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        aggregates = {(side, int(position)): (int(count), float(mean_val), None if std_dev is None else float(std_dev))
+                      for side, position, count, mean_val, std_dev in snapshot['positions']}
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        print(f"Ignoring unreadable limits snapshot '{path}': {e}")
+        return None
+    return build_position_statistics_from_aggregates(aggregates)
@@ -0,0 +1,110 @@
+"""
+X-bar/R and X-bar/S control charts over the natural subgroups of the data.
+
+Every save writes one subgroup of 6 Bottom and one of 6 Top readings for a
+SampleID. The charts work from the HardnessSampleSummary table (mean, range
+and standard deviation per sample and side, maintained by hardness_db on every
+insert), so a chart over thousands of samples needs a few KB of summary rows
+instead of the raw readings.
+"""
+import numpy as np # For the chart statistics
+
+# Control chart constants by subgroup size n: (A2, A3, d2, D3, D4, c4, B3, B4)
+CONTROL_CHART_CONSTANTS = {
+    2: (1.880, 2.659, 1.128, 0.000, 3.267, 0.7979, 0.000, 3.267),
+    3: (1.023, 1.954, 1.693, 0.000, 2.574, 0.8862, 0.000, 2.568),
+    4: (0.729, 1.628, 2.059, 0.000, 2.282, 0.9213, 0.000, 2.266),
+    5: (0.577, 1.427, 2.326, 0.000, 2.114, 0.9400, 0.000, 2.089),
+    6: (0.483, 1.287, 2.534, 0.000, 2.004, 0.9515, 0.030, 1.970),
+    7: (0.419, 1.182, 2.704, 0.076, 1.924, 0.9594, 0.118, 1.882),
+    8: (0.373, 1.099, 2.847, 0.136, 1.864, 0.9650, 0.185, 1.815),
+    9: (0.337, 1.032, 2.970, 0.184, 1.816, 0.9693, 0.239, 1.761),
+    10: (0.308, 0.975, 3.078, 0.223, 1.777, 0.9727, 0.284, 1.716),
+}
+
+CHART_XBAR_R = 'R'
+CHART_XBAR_S = 'S'
+
+DEFAULT_SUBGROUP_SIZE = 6 # Six positions per side per sample
+
+
+def subgroup_chart_limits(summary, chart_type=CHART_XBAR_R, subgroup_size=DEFAULT_SUBGROUP_SIZE):
+    """
+    Calculates X-bar and R (or S) chart limits from per-sample summaries.
+
+    Args:
+        summary (dict): One side of hardness_db.fetch_sample_summaries().
+        chart_type (str): CHART_XBAR_R or CHART_XBAR_S.
+        subgroup_size (int): Only complete subgroups of this size are charted.
+
+    Returns:
+        dict: {'sample_ids', 'xbar_points', 'dispersion_points', 'xbar_limits' (cl, ucl, lcl),
+               'dispersion_limits' (cl, ucl, lcl), 'sigma'}, or None with fewer than 2 subgroups.
+    """
+    A2, A3, d2, D3, D4, c4, B3, B4 = CONTROL_CHART_CONSTANTS[subgroup_size]
+    complete = summary['sizes'] == subgroup_size
+    if np.count_nonzero(complete) < 2:
+        return None
+
+    means = summary['means'][complete]
+    dispersion = summary['ranges'][complete] if chart_type == CHART_XBAR_R else summary['std_devs'][complete]
+    grand_mean = means.mean()
+    average_dispersion = dispersion.mean()
+
+    if chart_type == CHART_XBAR_R:
+        xbar_width = A2 * average_dispersion
+        dispersion_limits = (average_dispersion, D4 * average_dispersion, D3 * average_dispersion)
+        sigma = average_dispersion / d2
+    else:
+        xbar_width = A3 * average_dispersion
+        dispersion_limits = (average_dispersion, B4 * average_dispersion, B3 * average_dispersion)
+        sigma = average_dispersion / c4
+
+    return {
+        'sample_ids': [sample_id for sample_id, keep in zip(summary['sample_ids'], complete) if keep],
+        'xbar_points': means,
+        'dispersion_points': dispersion,
+        'xbar_limits': (grand_mean, grand_mean + xbar_width, grand_mean - xbar_width),
+        'dispersion_limits': dispersion_limits,
+        'sigma': sigma,
+    }
+
+def _draw_chart(ax, points, limits, title, ylabel):
+    center, ucl, lcl = limits
+    x_positions = np.arange(1, len(points) + 1)
+    ax.plot(x_positions, points, marker='o', markersize=3, linestyle='-', linewidth=0.8, color='steelblue')
+    outside = (points > ucl) | (points < lcl)
+    ax.plot(x_positions[outside], points[outside], linestyle='none', marker='o', color='red')
+    ax.axhline(y=center, color='blue', linestyle=':', label=f'CL ({center:.2f})')
+    ax.axhline(y=ucl, color='red', linestyle='--', label=f'UCL ({ucl:.2f})')
+    ax.axhline(y=lcl, color='red', linestyle='--', label=f'LCL ({lcl:.2f})')
+    ax.set_title(title)
+    ax.set_xlabel('Sample')
+    ax.set_ylabel(ylabel)
+    ax.grid(True)
+    ax.legend(loc='best', fontsize='small')
+
+def draw_subgroup_charts(fig, summaries, chart_type=CHART_XBAR_R):
+    """
+    Draws X-bar and R/S charts for Bottom and Top on a figure (2 x 2 axes).
+
+    Args:
+        fig (matplotlib.figure.Figure): Figure to draw on (cleared first).
+        summaries (dict): As returned by hardness_db.fetch_sample_summaries().
+        chart_type (str): CHART_XBAR_R or CHART_XBAR_S.
+    """
+    fig.clear()
+    axes = fig.subplots(2, 2)
+    dispersion_name = 'Range' if chart_type == CHART_XBAR_R else 'Std Dev'
+    for row, side in enumerate(('Bottom', 'Top')):
+        ax_xbar, ax_dispersion = axes[row]
+        limits = subgroup_chart_limits(summaries[side], chart_type)
+        if limits is None:
+            for ax in (ax_xbar, ax_dispersion):
+                ax.text(0.5, 0.5, f"Not enough {side} samples yet", ha='center', va='center', transform=ax.transAxes)
+                ax.set_axis_off()
+            continue
+        _draw_chart(ax_xbar, limits['xbar_points'], limits['xbar_limits'], f'{side} X-bar', 'Mean - BHN')
+        _draw_chart(ax_dispersion, limits['dispersion_points'], limits['dispersion_limits'],
+                    f'{side} {dispersion_name}', f'{dispersion_name} - BHN')
+    fig.tight_layout()
@@ -0,0 +1,28 @@
+"""Shared fixtures: the modules live in the repository root, next to this directory."""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hardness_db
+
+
+@pytest.fixture
+def sqlite_path(tmp_path):
+    """Path of a fresh SQLite database with the readings, summary and journal tables."""
+    path = str(tmp_path / "hardness_readings.db")
+    conn = hardness_db.connect_sqlite(path)
+    hardness_db.create_table(conn)
+    hardness_db.create_journal_table(conn)
+    conn.close()
+    return path
+
+
+@pytest.fixture
+def conn(sqlite_path):
+    """Open connection to the database of sqlite_path."""
+    conn = hardness_db.connect_sqlite(sqlite_path)
+    yield conn
+    conn.close()
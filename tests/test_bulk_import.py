@@ -0,0 +1,33 @@
+"""CSV import: validation, line numbers and normalized initials."""
+import io
+
+from bulk_import import REQUIRED_COLUMNS, import_files
+from hardness_validation import sample_rows_to_records
+
+BOTTOM = ["321.5", "322", "323", "324", "325", "326"]
+TOP = ["331", "332", "333", "334", "335", "336"]
+
+
+def write_csv(path, rows):
+    path.write_text("\n".join([",".join(REQUIRED_COLUMNS)] + [",".join(row) for row in rows]) + "\n", encoding='utf-8')
+    return str(path)
+
+
+def test_initials_are_stored_in_normalized_form(conn, tmp_path):
+    path = write_csv(tmp_path / "sheet.csv", [[" ab", "123-ab"] + BOTTOM + TOP, ["Cd ", "124-ab"] + BOTTOM + TOP])
+    assert import_files(conn, [path]) == (2, 0)
+    rows = conn.execute("SELECT DISTINCT TechnicianInitials FROM HardnessReadings ORDER BY 1;").fetchall()
+    assert [row[0] for row in rows] == ["AB", "CD"]
+
+def test_rejected_rows_are_reported_by_line(conn, tmp_path):
+    path = write_csv(tmp_path / "sheet.csv", [["a", "123-ab"] + BOTTOM + TOP, ["AB", "124-ab"] + BOTTOM + ["99"] + TOP[1:]])
+    errors = io.StringIO()
+    assert import_files(conn, [path], error_stream=errors) == (0, 2)
+    assert f"{path}:2: Tech Initials must be between 2 and 4 characters long." in errors.getvalue()
+    assert f"{path}:3: Top 1 Hardness must be between 100 and 500." in errors.getvalue()
+    assert conn.execute("SELECT COUNT(*) FROM HardnessReadings;").fetchone()[0] == 0
+
+def test_records_use_normalized_initials():
+    records = sample_rows_to_records(["ab "], ["123-ab"], [[320.0] * 12])
+    assert {record[0] for record in records} == {"AB"}
+    assert len(records) == 12
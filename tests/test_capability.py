@@ -0,0 +1,53 @@
+"""Capability point estimates against direct formulas, and the seeded bootstrap."""
+import numpy as np
+import pytest
+
+from capability import MOVING_RANGE_D2, analyze_capability, format_capability_report
+
+SPEC = {'Bottom': (290.0, 350.0), 'Top': (None, 350.0)}
+MATRIX = np.round(np.random.default_rng(11).normal(322.0, 5.0, (40, 12)), 1)
+
+
+def test_side_indices_use_the_pooled_within_sample_sigma():
+    result = analyze_capability(MATRIX, SPEC, resamples=0)['Bottom']
+    values = MATRIX[:, :6]
+    mean_val = values.mean()
+    sigma_within = np.sqrt(np.square(values - values.mean(axis=1, keepdims=True)).sum() / (values.shape[0] * 5))
+    sigma_overall = values.std(ddof=1)
+    assert result['count'] == values.size
+    assert result['mean'] == pytest.approx(mean_val)
+    assert result['sigma_within'] == pytest.approx(sigma_within)
+    assert result['sigma_overall'] == pytest.approx(sigma_overall)
+    assert result['Cp'][0] == pytest.approx(60.0 / (6 * sigma_within))
+    assert result['Cpk'][0] == pytest.approx(min(350.0 - mean_val, mean_val - 290.0) / (3 * sigma_within))
+    assert result['Pp'][0] == pytest.approx(60.0 / (6 * sigma_overall))
+    assert result['Ppk'][0] == pytest.approx(min(350.0 - mean_val, mean_val - 290.0) / (3 * sigma_overall))
+    assert result['Cp'][1:] == (None, None) # No bootstrap asked for
+
+def test_position_indices_use_the_moving_range():
+    column = MATRIX[:, 2]
+    sigma_within = np.abs(np.diff(column)).mean() / MOVING_RANGE_D2
+    result = analyze_capability(MATRIX, SPEC, resamples=0)[('Bottom', 3)]
+    assert result['sigma_within'] == pytest.approx(sigma_within)
+    assert result['Cpk'][0] == pytest.approx(min(350.0 - column.mean(), column.mean() - 290.0) / (3 * sigma_within))
+
+def test_one_sided_spec():
+    result = analyze_capability(MATRIX, SPEC, resamples=0)['Top']
+    assert result['Cp'][0] is None and result['Pp'][0] is None
+    assert result['Cpk'][0] == pytest.approx((350.0 - MATRIX[:, 6:].mean()) / (3 * result['sigma_within']))
+
+def test_missing_readings_are_skipped():
+    matrix = MATRIX.copy()
+    matrix[5, 0] = np.nan
+    result = analyze_capability(matrix, SPEC, resamples=0)
+    assert result['Bottom']['count'] == MATRIX[:, :6].size - 1
+    assert result[('Bottom', 1)]['mean'] == pytest.approx(np.nanmean(matrix[:, 0]))
+
+def test_seeded_bootstrap_is_reproducible():
+    first = analyze_capability(MATRIX, SPEC, resamples=200, workers=1, seed=5)
+    second = analyze_capability(MATRIX, SPEC, resamples=200, workers=1, seed=5)
+    assert first == second
+    estimate, low, high = first['Bottom']['Cpk']
+    assert low < estimate < high
+    assert first['Top']['Cp'] == (None, None, None)
+    assert "Bottom 3" in format_capability_report(first, SPEC)
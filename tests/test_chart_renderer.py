@@ -0,0 +1,51 @@
+"""ChartRenderer on the headless Agg canvas."""
+import math
+
+import pytest
+
+from chart_renderer import DEFAULT_Y_RANGE, ChartRenderer
+
+BOTTOM = [321.0, 324.5, 319.0, 330.0, 327.5, 322.0]
+TOP = [331.0, 335.5, 329.0, 338.0, 333.0, 336.5]
+POSITION_LIMITS = ([320.0] * 6, [335.0] * 6, [305.0] * 6)
+
+
+@pytest.fixture
+def renderer():
+    return ChartRenderer()
+
+def test_update_reuses_the_artists(renderer):
+    panel = renderer.panels['Bottom']
+    artists = (panel.reading_line, panel.mean_line, panel.legend)
+    renderer.update(BOTTOM, TOP, 320.0, 340.0, 300.0, 330.0, 350.0, 310.0, redraw=False)
+    renderer.update(TOP, BOTTOM, 321.0, 341.0, 301.0, 331.0, 351.0, 311.0, bottom_violations=[3],
+                    bottom_position_limits=POSITION_LIMITS, redraw=False)
+    renderer.draw()
+    assert (panel.reading_line, panel.mean_line, panel.legend) == artists
+    assert len(renderer.ax_bottom.lines) == len(renderer.ax_top.lines)
+    assert list(panel.reading_line.get_ydata()) == TOP
+    assert list(panel.violation_markers.get_ydata()) == [TOP[3]]
+    assert panel.mean_line.get_ydata()[0] == 321.0
+    assert panel.legend.get_texts()[2].get_text() == 'UCL (341.00)'
+
+def test_limits_hidden_without_enough_data(renderer):
+    renderer.update([], [], None, None, None, None, None, None, redraw=False)
+    panel = renderer.panels['Top']
+    assert not any(line.get_visible() for line in panel.limit_lines)
+    assert not panel.legend.get_visible()
+    assert renderer.ax_top.get_ylim() == DEFAULT_Y_RANGE
+
+def test_missing_positions_do_not_break_the_y_range(renderer):
+    renderer.update(BOTTOM[:5] + [math.nan], TOP, 320.0, 340.0, 300.0, 330.0, 350.0, 310.0, redraw=False)
+    low, high = renderer.ax_bottom.get_ylim()
+    assert not math.isnan(low) and not math.isnan(high)
+    assert high > 340.0
+
+def test_mode_overlay_turns_red_when_out_of_control(renderer):
+    overlay = ('EWMA', 320.0, 325.0, 315.0, [318.0, 327.0])
+    renderer.update(BOTTOM, TOP, 320.0, 340.0, 300.0, 330.0, 350.0, 310.0, bottom_mode_overlay=overlay, redraw=False)
+    panel = renderer.panels['Bottom']
+    assert panel.mode_statistic_line.get_color() == 'red'
+    assert 'EWMA' in [text.get_text() for text in panel.legend.get_texts()]
+    renderer.update(BOTTOM, TOP, 320.0, 340.0, 300.0, 330.0, 350.0, 310.0, redraw=False)
+    assert 'EWMA' not in [text.get_text() for text in panel.legend.get_texts()]
@@ -0,0 +1,101 @@
+"""Collector service on SQLite with stand-in stations."""
+import threading
+from datetime import datetime
+
+import pytest
+
+import hardness_db
+from collector_service import CollectorClient, create_server, simulate_stations, validate_entry
+from db_connection import ConnectionManager
+from offline_journal import TIMESTAMP_FORMAT
+from spc_rules import LOOKBACK
+
+STATIONS = 4
+SAMPLES = 10
+
+
+@pytest.fixture
+def collector(sqlite_path):
+    """(client, server) of a collector serving on a free local port."""
+    manager = ConnectionManager(lambda: hardness_db.connect_sqlite(sqlite_path))
+    server = create_server(manager, port=0, batch_delay=0.2)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield CollectorClient(f"http://127.0.0.1:{server.server_address[1]}"), server
+    server.shutdown()
+    server.server_close()
+    server.writer.stop()
+    manager.close()
+
+def entry(key, technician="AB"):
+    return {'key': key, 'timestamp': datetime(2024, 5, 1, 8, 0, 0).strftime(TIMESTAMP_FORMAT),
+            'records': [[technician, "123-ab", side, position, 320.0 + position]
+                        for side in ('Bottom', 'Top') for position in range(1, 7)]}
+
+def count_readings(sqlite_path):
+    conn = hardness_db.connect_sqlite(sqlite_path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {hardness_db.TABLE_NAME};").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_posts_from_all_stations_are_batched(collector, sqlite_path):
+    client, server = collector
+    count, _ = simulate_stations(client.url, STATIONS, SAMPLES, seed=1)
+    assert count == STATIONS * SAMPLES
+    assert count_readings(sqlite_path) == 12 * count
+    health = client.health()
+    assert health['samples'] == count
+    assert health['batches'] < count # Samples of several stations shared a transaction
+
+def test_limits_match_the_database(collector, sqlite_path):
+    client, _ = collector
+    simulate_stations(client.url, STATIONS, SAMPLES, seed=2)
+    aggregates, recent_values, recent_summaries = client.fetch_limits()
+    conn = hardness_db.connect_sqlite(sqlite_path)
+    try:
+        expected = hardness_db.fetch_control_limit_aggregates(conn, by_position=True)
+    finally:
+        conn.close()
+    assert set(aggregates) == set(expected)
+    for key, (count, mean_val, std_dev) in expected.items():
+        assert aggregates[key] == (count, pytest.approx(mean_val), pytest.approx(std_dev))
+    assert all(len(values) == LOOKBACK for values in recent_values.values())
+    assert all(len(summaries) > 0 for summaries in recent_summaries.values())
+
+def test_reposted_key_is_a_no_op(collector, sqlite_path):
+    client, server = collector
+    assert client.apply_journal_entries([entry("key-1")]) == ["key-1"]
+    # A station retrying after a lost answer
+    assert client.apply_journal_entries([entry("key-1")]) == ["key-1"]
+    assert count_readings(sqlite_path) == 12
+    assert server.writer.samples == 1
+    assert client.fetch_limits()[0][('Bottom', 1)][0] == 1
+
+def test_invalid_entry_is_rejected(collector, sqlite_path):
+    client, _ = collector
+    invalid = entry("key-2", technician="A") # Initials too short
+    with pytest.raises(RuntimeError, match="400"):
+        client.apply_journal_entries([invalid])
+    assert count_readings(sqlite_path) == 0
+
+def test_initials_are_normalized(collector, sqlite_path):
+    client, _ = collector
+    assert client.apply_journal_entries([entry("key-3", technician=" ab")]) == ["key-3"]
+    conn = hardness_db.connect_sqlite(sqlite_path)
+    try:
+        rows = conn.execute(f"SELECT DISTINCT TechnicianInitials FROM {hardness_db.TABLE_NAME};").fetchall()
+    finally:
+        conn.close()
+    assert rows == [("AB",)]
+
+def test_validate_entry_normalizes_only_valid_entries():
+    valid = entry("key-4", technician="cd")
+    validate_entry(valid)
+    assert {record[0] for record in valid['records']} == {"CD"}
+    invalid = entry("key-5", technician="cd")
+    invalid['records'][-1][4] = 900.0
+    with pytest.raises(ValueError):
+        validate_entry(invalid)
+    assert invalid['records'][0][0] == "cd"
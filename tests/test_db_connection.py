@@ -0,0 +1,51 @@
+"""ConnectionManager on a SQLite file."""
+import sqlite3
+
+import pytest
+
+import hardness_db
+from db_connection import ConnectionManager
+
+RECORD = ("AB", "123-ab", 'Bottom', 1, 321.0)
+
+
+def count_readings(path):
+    conn = hardness_db.connect_sqlite(path)
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM {hardness_db.TABLE_NAME};").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_reuses_the_warm_connection(sqlite_path):
+    manager = ConnectionManager(lambda: hardness_db.connect_sqlite(sqlite_path))
+    first = manager.run(lambda conn: conn)
+    assert manager.run(lambda conn: conn) is first
+    assert manager.stats['opened'] == 1
+    manager.close()
+
+def test_non_database_error_rolls_back(sqlite_path):
+    manager = ConnectionManager(lambda: hardness_db.connect_sqlite(sqlite_path))
+
+    def insert_then_fail(conn):
+        hardness_db.insert_readings(conn, [RECORD], commit=False)
+        raise ValueError("callback failed")
+    with pytest.raises(ValueError):
+        manager.run(insert_then_fail)
+    # The next caller's commit must not write the failed caller's statements
+    manager.run(lambda conn: conn.commit())
+    assert count_readings(sqlite_path) == 0
+    assert manager.stats['opened'] == 1 # Not a connection problem, so the connection is kept
+    manager.close()
+
+def test_database_error_rolls_back(sqlite_path):
+    manager = ConnectionManager(lambda: hardness_db.connect_sqlite(sqlite_path))
+
+    def insert_then_fail(conn):
+        hardness_db.insert_readings(conn, [RECORD], commit=False)
+        conn.execute("SELECT * FROM NoSuchTable;")
+    with pytest.raises(sqlite3.Error):
+        manager.run(insert_then_fail)
+    manager.run(lambda conn: conn.commit())
+    assert count_readings(sqlite_path) == 0
+    manager.close()
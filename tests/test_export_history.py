@@ -0,0 +1,40 @@
+"""export_history filters and output."""
+import csv
+
+import pytest
+
+import export_history
+import hardness_db
+
+
+def readings(technician, sample_id):
+    return [(technician, sample_id, side, position, 320.0 + position)
+            for side in ('Bottom', 'Top') for position in range(1, 7)]
+
+def exported_samples(conn, tmp_path, **filters):
+    path = str(tmp_path / "readings.csv")
+    export_history.export_history(conn, path, **filters)
+    with open(path, newline='', encoding='utf-8') as csv_file:
+        return sorted({(row['TechnicianInitials'], row['SampleID']) for row in csv.DictReader(csv_file)})
+
+@pytest.fixture
+def history(conn):
+    hardness_db.insert_readings(conn, readings("ab", "123-ab")) # Initials saved as typed by older versions
+    hardness_db.insert_readings(conn, readings("AB", "12%-cd"))
+    hardness_db.insert_readings(conn, readings("CD", "12x-cd"))
+    hardness_db.insert_readings(conn, readings("CD", "1_3-ef"))
+    return conn
+
+
+@pytest.mark.parametrize("technician", ["ab", "AB", " Ab "])
+def test_technician_matches_in_any_case(history, tmp_path, technician):
+    assert exported_samples(history, tmp_path, technician=technician) == [("AB", "12%-cd"), ("ab", "123-ab")]
+
+def test_sample_id_wildcard_is_the_only_wildcard(history, tmp_path):
+    assert exported_samples(history, tmp_path, sample_id="12%*") == [("AB", "12%-cd")]
+    assert exported_samples(history, tmp_path, sample_id="1_*") == [("CD", "1_3-ef")]
+    assert exported_samples(history, tmp_path, sample_id="12*-cd") == [("AB", "12%-cd"), ("CD", "12x-cd")]
+
+def test_exact_sample_id(history, tmp_path):
+    assert exported_samples(history, tmp_path, sample_id="12x-cd") == [("CD", "12x-cd")]
+    assert len(open(tmp_path / "readings.csv", encoding='utf-8').readlines()) == 13 # Header and 12 readings
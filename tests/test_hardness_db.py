@@ -0,0 +1,112 @@
+"""hardness_db against the SQLite backend."""
+import statistics
+from datetime import datetime, timedelta
+
+import pytest
+
+import hardness_db
+
+BOTTOM = [321.0, 324.5, 319.0, 330.0, 327.5, 322.0]
+TOP = [331.0, 335.5, 329.0, 338.0, 333.0, 336.5]
+
+
+def sample_records(technician="AB", sample_id="123-ab", bottom=BOTTOM, top=TOP):
+    """The 12 (TechnicianInitials, SampleID, TopOrBottom, Position, HardnessValue) tuples of one save."""
+    return ([(technician, sample_id, 'Bottom', position, value) for position, value in enumerate(bottom, start=1)]
+            + [(technician, sample_id, 'Top', position, value) for position, value in enumerate(top, start=1)])
+
+def timestamped(records, timestamp):
+    return [record + (timestamp,) for record in records]
+
+def count_rows(conn, table):
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT COUNT(*) FROM {table};")
+    return cursor.fetchone()[0]
+
+
+def test_create_table_is_idempotent(conn):
+    hardness_db.create_table(conn)
+    hardness_db.create_journal_table(conn)
+    assert hardness_db.storage_layout(conn) == hardness_db.LAYOUT_NARROW
+    assert count_rows(conn, hardness_db.TABLE_NAME) == 0
+
+def test_insert_and_fetch_all_values(conn):
+    hardness_db.insert_readings(conn, sample_records())
+    hardness_db.insert_readings(conn, sample_records(sample_id="124-ab", bottom=[310.0] * 6, top=[340.0] * 6))
+    bottom_values, top_values = hardness_db.fetch_all_hardness_values(conn)
+    assert bottom_values == BOTTOM + [310.0] * 6
+    assert top_values == TOP + [340.0] * 6
+    assert count_rows(conn, hardness_db.SUMMARY_TABLE_NAME) == 4
+
+def test_insert_timestamped_readings_keeps_time_order(conn):
+    later = datetime(2024, 5, 2, 8, 0, 0)
+    earlier = later - timedelta(days=1)
+    hardness_db.insert_timestamped_readings(conn, timestamped(sample_records(sample_id="200-bb", bottom=[300.0] * 6), later))
+    hardness_db.insert_timestamped_readings(conn, timestamped(sample_records(sample_id="100-aa"), earlier))
+    bottom_values, _ = hardness_db.fetch_all_hardness_values(conn)
+    assert bottom_values == BOTTOM + [300.0] * 6
+    records, ids = hardness_db.fetch_readings_since(conn)
+    assert records[0][1] == "100-aa"
+    assert records[0][5] == "2024-05-01 08:00:00"
+    assert sorted(ids) == list(range(1, 25))
+    assert hardness_db.fetch_readings_since(conn, max(ids)) == ([], [])
+
+def test_fetch_recent_values(conn):
+    hardness_db.insert_readings(conn, sample_records())
+    assert hardness_db.fetch_recent_values(conn, 4) == {'Bottom': BOTTOM[-4:], 'Top': TOP[-4:]}
+
+def test_control_limit_aggregates(conn):
+    second_bottom = [315.0, 318.0, 320.0, 329.0, 331.0, 325.0]
+    hardness_db.insert_readings(conn, sample_records())
+    hardness_db.insert_readings(conn, sample_records(sample_id="124-ab", bottom=second_bottom))
+    aggregates = hardness_db.fetch_control_limit_aggregates(conn)
+    count, mean_val, std_dev = aggregates['Bottom']
+    assert count == 12
+    assert mean_val == pytest.approx(statistics.mean(BOTTOM + second_bottom))
+    assert std_dev == pytest.approx(statistics.stdev(BOTTOM + second_bottom))
+    by_position = hardness_db.fetch_control_limit_aggregates(conn, by_position=True)
+    assert set(by_position) == {(side, position) for side in ('Bottom', 'Top') for position in range(1, 7)}
+    count, mean_val, std_dev = by_position[('Bottom', 1)]
+    assert (count, mean_val) == (2, pytest.approx((BOTTOM[0] + second_bottom[0]) / 2))
+    assert std_dev == pytest.approx(statistics.stdev([BOTTOM[0], second_bottom[0]]))
+
+def test_single_value_groups_have_no_std_dev(conn):
+    hardness_db.insert_readings(conn, sample_records()[:1])
+    assert hardness_db.fetch_control_limit_aggregates(conn) == {'Bottom': (1, BOTTOM[0], None)}
+
+def test_sample_summaries(conn):
+    hardness_db.insert_readings(conn, sample_records())
+    summaries = hardness_db.fetch_sample_summaries(conn)
+    assert summaries['Bottom']['sample_ids'] == ["123-ab"]
+    assert summaries['Bottom']['sizes'].tolist() == [6]
+    assert summaries['Bottom']['means'][0] == pytest.approx(statistics.mean(BOTTOM))
+    assert summaries['Bottom']['ranges'][0] == pytest.approx(max(BOTTOM) - min(BOTTOM))
+    assert summaries['Top']['std_devs'][0] == pytest.approx(statistics.stdev(TOP))
+
+def test_apply_journal_entries_is_idempotent(conn):
+    timestamp = datetime(2024, 5, 1, 8, 0, 0)
+    first = ("key-1", timestamped(sample_records(sample_id="100-aa"), timestamp))
+    second = ("key-2", timestamped(sample_records(sample_id="101-aa"), timestamp))
+    assert hardness_db.apply_new_journal_entries(conn, [first, first]) == [first]
+    assert count_rows(conn, hardness_db.TABLE_NAME) == 12
+    # A retry after a lost commit acknowledgement: only the new key is inserted
+    assert hardness_db.apply_new_journal_entries(conn, [first, second]) == [second]
+    assert hardness_db.apply_journal_entries(conn, [first, second]) == ["key-1", "key-2"]
+    assert count_rows(conn, hardness_db.TABLE_NAME) == 24
+    assert count_rows(conn, hardness_db.JOURNAL_TABLE_NAME) == 2
+    assert count_rows(conn, hardness_db.SUMMARY_TABLE_NAME) == 4
+
+def test_backfill_summarizes_each_save(conn):
+    hardness_db.insert_readings(conn, sample_records())
+    hardness_db.insert_readings(conn, sample_records(sample_id="124-ab"))
+    hardness_db.insert_readings(conn, sample_records(bottom=[310.0] * 6)) # Same SampleID saved again
+    live = hardness_db.fetch_sample_summaries(conn)
+    conn.execute(f"DELETE FROM {hardness_db.SUMMARY_TABLE_NAME};")
+    conn.commit()
+    hardness_db.backfill_sample_summary(conn)
+    backfilled = hardness_db.fetch_sample_summaries(conn)
+    for side in ('Bottom', 'Top'):
+        assert backfilled[side]['sample_ids'] == live[side]['sample_ids'] == ["123-ab", "124-ab", "123-ab"]
+        assert backfilled[side]['sizes'].tolist() == [6, 6, 6]
+        for column in ('means', 'ranges', 'std_devs'):
+            assert backfilled[side][column] == pytest.approx(live[side][column])
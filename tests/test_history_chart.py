@@ -0,0 +1,37 @@
+"""HistoryPyramid views and LTTB downsampling."""
+import numpy as np
+
+from history_chart import FACTOR, HistoryPyramid, lttb
+
+
+def test_view_of_a_series_too_short_for_a_level():
+    pyramid = HistoryPyramid(np.arange(FACTOR, dtype=np.float64))
+    x, y = pyramid.view(0, FACTOR, 3)
+    assert x.size == 3
+    assert (x[0], x[-1]) == (0, FACTOR - 1)
+    assert np.array_equal(y, x.astype(np.float64))
+
+def test_view_keeps_spikes():
+    values = np.full(100000, 320.0)
+    values[12345] = 480.0
+    values[67890] = 150.0
+    pyramid = HistoryPyramid(values)
+    x, y = pyramid.view(0, values.size, 200)
+    assert x.size <= 200
+    assert 12345 in x and 67890 in x
+
+def test_append_matches_building_at_once():
+    values = np.random.default_rng(1).normal(320.0, 5.0, 5000)
+    built = HistoryPyramid(values)
+    appended = HistoryPyramid(values[:1234])
+    for start in range(1234, values.size, 12):
+        appended.append(values[start:start + 12])
+    for arrays in zip(built.view(0, values.size, 300), appended.view(0, values.size, 300)):
+        assert np.array_equal(*arrays)
+
+def test_lttb_keeps_end_points():
+    x = np.arange(1000)
+    y = np.sin(x / 50.0)
+    kept_x, kept_y = lttb(x, y, 50)
+    assert kept_x.size == 50
+    assert (kept_x[0], kept_x[-1]) == (0, 999)
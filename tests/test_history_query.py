@@ -0,0 +1,71 @@
+"""Filtered history queries and their cache."""
+from datetime import datetime
+
+import hardness_db
+from history_query import HistoryFilter, HistoryQueryCache, fetch_page, fetch_statistics
+
+TIMESTAMP = datetime(2024, 5, 1, 8, 0, 0)
+
+
+def readings(technician, sample_id, timestamp=TIMESTAMP):
+    return [(technician, sample_id, side, position, 320.0 + position, timestamp)
+            for side in ('Bottom', 'Top') for position in range(1, 7)]
+
+
+def test_technician_matches_in_any_case(conn):
+    hardness_db.insert_timestamped_readings(conn, readings("ab", "123-ab") + readings("CD", "124-ab"))
+    for technician in ("ab", "AB"):
+        history_filter = HistoryFilter(technician=technician)
+        rows, next_after = fetch_page(conn, history_filter, page_size=50)
+        assert len(rows) == 12 and next_after is None
+        assert fetch_statistics(conn, history_filter)['Bottom'][0] == 6
+        assert history_filter.matches(readings("ab", "125-ab")[0])
+        assert history_filter.matches(readings("Ab", "125-ab")[0])
+
+def test_sample_prefix_is_literal(conn):
+    hardness_db.insert_timestamped_readings(conn, readings("AB", "1_3-ab") + readings("AB", "123-ab"))
+    rows, _ = fetch_page(conn, HistoryFilter(sample_prefix="1_"), page_size=50)
+    assert {row[2] for row in rows} == {"1_3-ab"}
+
+def test_sample_prefix_matches_in_any_case(conn):
+    hardness_db.insert_timestamped_readings(conn, readings("AB", "12A-ab"))
+    for prefix in ("12a", "12A"):
+        history_filter = HistoryFilter(sample_prefix=prefix)
+        rows, _ = fetch_page(conn, history_filter, page_size=50)
+        assert len(rows) == 12 # As the database's LIKE
+        assert history_filter.matches(readings("AB", "12a-cd")[0])
+        assert history_filter.matches(readings("AB", "12A-cd")[0])
+        assert not history_filter.matches(readings("AB", "13A-cd")[0])
+
+def test_keyset_pages_cover_the_slice_once(conn):
+    hardness_db.insert_timestamped_readings(conn, readings("AB", "123-ab") + readings("AB", "124-ab"))
+    history_filter = HistoryFilter(side='Top')
+    seen = []
+    after = None
+    while True:
+        rows, after = fetch_page(conn, history_filter, page_size=5, after=after)
+        seen.extend(row[0] for row in rows)
+        if after is None:
+            break
+    assert len(seen) == len(set(seen)) == 12
+
+def test_invalidation_drops_only_matching_entries():
+    cache = HistoryQueryCache()
+    ab, cd = HistoryFilter(technician="AB"), HistoryFilter(technician="CD")
+    cache.store_statistics(ab, {})
+    cache.store_statistics(cd, {})
+    assert cache.invalidate(readings("ab", "125-ab")) == 1
+    assert cache.statistics(ab) is None
+    assert cache.statistics(cd) == {}
+
+def test_result_read_during_an_invalidation_is_not_cached():
+    cache = HistoryQueryCache()
+    history_filter = HistoryFilter(technician="AB")
+    generation = cache.generation
+    cache.invalidate(readings("AB", "125-ab")) # Committed while the page was being read
+    cache.store_page(history_filter, 50, None, ([], None), generation)
+    cache.store_statistics(history_filter, {}, generation)
+    assert cache.page(history_filter, 50) is None
+    assert cache.statistics(history_filter) is None
+    cache.store_statistics(history_filter, {}, cache.generation)
+    assert cache.statistics(history_filter) == {}
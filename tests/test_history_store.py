@@ -0,0 +1,72 @@
+"""HistoryStore columns, persistence and catch-up."""
+from datetime import datetime
+
+import numpy as np
+
+import hardness_db
+from history_chart import HistoryPyramid
+from history_store import BYTES_PER_READING, HistoryStore
+
+TIMESTAMP = datetime(2024, 5, 1, 8, 0, 0)
+
+
+def readings(technician, sample_id, offset=0.0):
+    return [(technician, sample_id, side, position, 320.0 + position + offset)
+            for side in ('Bottom', 'Top') for position in range(1, 7)]
+
+
+def test_columns_and_size():
+    store = HistoryStore()
+    store.append(readings("AB", "123-ab"), TIMESTAMP)
+    store.append([record + (TIMESTAMP,) for record in readings("CD", "124-ab", 5.0)])
+    assert len(store) == 24
+    assert store.nbytes == 24 * BYTES_PER_READING < 24 * 20
+    assert store.values('Top').dtype == np.float32
+    assert store.values('Top').tolist() == [321, 322, 323, 324, 325, 326, 326, 327, 328, 329, 330, 331]
+    assert store.column('Bottom', 'positions').tolist() == list(range(1, 7)) * 2
+    assert [store.technicians[code] for code in store.column('Bottom', 'technicians')[::6]] == ["AB", "CD"]
+    assert store.column('Top', 'timestamps')[0] == np.datetime64(TIMESTAMP, 's').astype(np.int64)
+
+def test_catch_up_save_and_reload(conn, tmp_path):
+    directory = str(tmp_path / "store")
+    hardness_db.insert_readings(conn, readings("AB", "123-ab"))
+    first = HistoryStore.load_or_fetch(conn, directory)
+    assert len(first) == 12
+    hardness_db.insert_readings(conn, readings("AB", "124-ab", 1.0))
+    reloaded = HistoryStore.load_or_fetch(conn, directory) # Only the new sample is read
+    bottom_values, top_values = hardness_db.fetch_all_hardness_values(conn)
+    assert reloaded.values('Bottom').tolist() == bottom_values
+    assert reloaded.values('Top').tolist() == top_values
+    assert reloaded.sample_ids == ["123-ab", "124-ab"]
+    assert len(HistoryStore.load(directory)) == 24
+
+def test_pyramid_indexes_the_store_column(conn, tmp_path):
+    for index in range(20):
+        hardness_db.insert_readings(conn, readings("AB", f"{100 + index}-ab", index))
+    directory = str(tmp_path / "store")
+    HistoryStore.load_or_fetch(conn, directory)
+    store = HistoryStore.load_or_fetch(conn, directory) # Memory-mapped
+    pyramid = HistoryPyramid(column=store.value_column('Top'))
+    store.append(readings("AB", "999-ab", 100.0), TIMESTAMP)
+    pyramid.sync()
+    assert len(pyramid) == 126
+    assert pyramid.view(0, 126, 10)[1].max() == store.values('Top').max()
+
+def insert_with_ids(conn, records, first_id):
+    """Inserts readings under explicit IDs, like a transaction that got its IDs earlier than it committed."""
+    conn.executemany(f"INSERT INTO {hardness_db.TABLE_NAME} (ID, TechnicianInitials, SampleID, TopOrBottom, Position, "
+                     "HardnessValue) VALUES (?, ?, ?, ?, ?, ?);",
+                     [(first_id + index,) + record for index, record in enumerate(records)])
+    conn.commit()
+
+def test_catch_up_reads_ids_that_commit_late(conn, tmp_path):
+    directory = str(tmp_path / "store")
+    insert_with_ids(conn, readings("AB", "123-ab"), 1)
+    insert_with_ids(conn, readings("AB", "125-ab", 2.0), 25) # IDs 13-24 are still in flight
+    assert len(HistoryStore.load_or_fetch(conn, directory)) == 24
+    insert_with_ids(conn, readings("AB", "124-ab", 1.0), 13) # Commits after 25-36 were read
+    store = HistoryStore.load_or_fetch(conn, directory)
+    assert len(store) == 36
+    assert sorted(store.values('Bottom').tolist()) == sorted(hardness_db.fetch_all_hardness_values(conn)[0])
+    assert store.sample_ids == ["123-ab", "125-ab", "124-ab"] # Read order, not time order
+    assert HistoryStore.load_or_fetch(conn, directory).catch_up(conn) == 0 # Nothing twice
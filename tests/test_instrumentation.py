@@ -0,0 +1,96 @@
+"""Span recording, action attribution and the metrics files."""
+import json
+import pstats
+import threading
+
+import pytest
+
+import instrumentation
+
+
+@pytest.fixture(autouse=True)
+def clean_histograms():
+    instrumentation.reset()
+    yield
+    instrumentation.reset()
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = instrumentation.RollingHistogram(buckets=(0.01, 0.1, 1.0), window=3)
+    for seconds in (0.005, 0.05, 0.5, 5.0):
+        histogram.record(seconds)
+    data = histogram.snapshot()
+    assert data['count'] == 4
+    assert data['sum'] == pytest.approx(5.555)
+    assert data['buckets'] == [(0.01, 1), (0.1, 2), (1.0, 3)]
+    # Only the last 3 durations are in the rolling window
+    assert data['recent']['max'] == 5.0
+    assert data['recent']['p50'] == pytest.approx(0.5)
+
+def test_spans_are_charged_to_the_action():
+    @instrumentation.traced_action('display')
+    def display():
+        with instrumentation.span('query'):
+            pass
+        return 42
+
+    assert display() == 42
+    with instrumentation.span('draw'): # Deferred work after the click still belongs to it
+        pass
+    recorded = instrumentation.snapshot()
+    assert set(recorded) == {'display/query', 'display/total', 'display/draw'}
+    assert all(data['count'] == 1 for data in recorded.values())
+
+def test_nested_actions_and_background_threads():
+    def worker():
+        with instrumentation.span('insert'):
+            pass
+
+    with instrumentation.action('save'):
+        with instrumentation.action('startup'):
+            with instrumentation.span('connect'):
+                pass
+        with instrumentation.span('fetch'):
+            pass
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    assert set(instrumentation.snapshot()) == {'startup/connect', 'save/fetch', 'background/insert'}
+
+def test_span_records_when_the_body_raises():
+    with pytest.raises(RuntimeError):
+        with instrumentation.span('query', action_name='save'):
+            raise RuntimeError("database gone")
+    assert instrumentation.snapshot()['save/query']['count'] == 1
+
+def test_traced_wraps_a_callable():
+    draw = instrumentation.traced('render', lambda value: value * 2)
+    with instrumentation.action('display'):
+        assert draw(21) == 42
+    assert instrumentation.snapshot()['display/render']['count'] == 1
+
+def test_metrics_files(tmp_path):
+    instrumentation.record('display', 'query', 0.02)
+    instrumentation.record('display', 'query', 3.0)
+    prometheus_path, json_path = str(tmp_path / "metrics.prom"), str(tmp_path / "metrics.json")
+    instrumentation.write_metrics(prometheus_path, json_path)
+
+    text = open(prometheus_path, encoding='utf-8').read()
+    labels = 'action="display",stage="query"'
+    assert f'hardness_span_seconds_bucket{{{labels},le="0.025"}} 1' in text
+    assert f'hardness_span_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f'hardness_span_seconds_count{{{labels}}} 2' in text
+    assert f'hardness_span_seconds_recent{{{labels},quantile="max"}} 3.000000' in text
+    with open(json_path, encoding='utf-8') as json_file:
+        assert json.load(json_file)['display/query']['count'] == 2
+    assert not list(tmp_path.glob("*.tmp"))
+
+def test_toggle_profiling(tmp_path):
+    path = str(tmp_path / "capture.prof")
+    assert instrumentation.stop_profiling(path) is None
+    assert instrumentation.toggle_profiling(path) is True
+    assert instrumentation.is_profiling()
+    sum(range(1000))
+    assert instrumentation.toggle_profiling(path) is False
+    assert not instrumentation.is_profiling()
+    assert pstats.Stats(path).total_calls > 0
@@ -0,0 +1,46 @@
+"""Chunked copy to the wide layout, reconciliation and the switch."""
+import hardness_db
+import migrate_to_wide
+
+
+def readings(technician, sample_id, offset=0.0):
+    return [(technician, sample_id, side, position, 320.0 + position + offset)
+            for side in ('Bottom', 'Top') for position in range(1, 7)]
+
+def insert_with_ids(conn, records, first_id):
+    """Inserts readings under explicit IDs, like a transaction that got its IDs earlier than it committed."""
+    conn.executemany(f"INSERT INTO {hardness_db.TABLE_NAME} (ID, TechnicianInitials, SampleID, TopOrBottom, Position, "
+                     "HardnessValue) VALUES (?, ?, ?, ?, ?, ?);",
+                     [(first_id + index,) + record for index, record in enumerate(records)])
+    conn.commit()
+
+def prepare(conn):
+    hardness_db.create_wide_table(conn)
+    migrate_to_wide.create_state_table(conn)
+    conn.commit()
+
+
+def test_chunked_copy_keeps_samples_together(conn):
+    for index in range(5):
+        hardness_db.insert_readings(conn, readings("AB", f"{100 + index}-ab", index))
+    before = hardness_db.fetch_all_hardness_values(conn)
+    prepare(conn)
+    assert migrate_to_wide.copy_readings(conn, chunk_size=18, progress_stream=None) == 60
+    assert migrate_to_wide.reconcile_copy(conn) == 0
+    migrate_to_wide.switch_to_wide(conn)
+    assert hardness_db.storage_layout(conn) == hardness_db.LAYOUT_WIDE
+    assert conn.execute(f"SELECT COUNT(*) FROM {hardness_db.WIDE_TABLE_NAME};").fetchone()[0] == 5
+    assert hardness_db.fetch_all_hardness_values(conn) == before
+
+def test_readings_committed_late_are_copied_before_the_switch(conn, sqlite_path):
+    insert_with_ids(conn, readings("AB", "123-ab"), 1)
+    insert_with_ids(conn, readings("AB", "125-ab", 2.0), 25) # IDs 13-24 are still in flight
+    prepare(conn)
+    migrate_to_wide.copy_readings(conn, progress_stream=None)
+    insert_with_ids(conn, readings("AB", "124-ab", 1.0), 13) # Commits below LastReadingID
+    assert migrate_to_wide.copy_readings(conn, progress_stream=None) == 0 # Not seen by the ID watermark
+    before = hardness_db.fetch_all_hardness_values(conn)
+
+    assert migrate_to_wide.main(["--switch", "--sqlite", sqlite_path]) == 0
+    assert hardness_db.storage_layout(conn) == hardness_db.LAYOUT_WIDE
+    assert [sorted(values) for values in hardness_db.fetch_all_hardness_values(conn)] == [sorted(values) for values in before]
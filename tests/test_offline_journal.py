@@ -0,0 +1,57 @@
+"""OfflineJournal replay and crash recovery."""
+import hardness_db
+from db_connection import ConnectionManager
+from offline_journal import JournalFlusher, OfflineJournal, journal_entry_records, unwritten_entries
+
+RECORDS = [("AB", "123-ab", 'Bottom', 1, 321.0), ("AB", "123-ab", 'Top', 1, 331.0)]
+
+
+def test_pending_entries_survive_a_restart(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = OfflineJournal(path)
+    first = journal.append(RECORDS)
+    second = journal.append(RECORDS)
+    journal.acknowledge([first])
+    assert [entry['key'] for entry in OfflineJournal(path).pending()] == [second]
+
+def test_append_after_a_torn_last_line(tmp_path):
+    path = str(tmp_path / "journal.jsonl")
+    journal = OfflineJournal(path)
+    first = journal.append(RECORDS)
+    with open(path, 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"key": "torn", "timestamp": "2024-') # Crash mid-write
+    journal = OfflineJournal(path)
+    assert [entry['key'] for entry in journal.pending()] == [first]
+    second = journal.append(RECORDS)
+    assert [entry['key'] for entry in OfflineJournal(path).pending()] == [first, second]
+
+def test_snapshot_tells_later_appends_apart(tmp_path):
+    journal = OfflineJournal(str(tmp_path / "journal.jsonl"))
+    journal.append(RECORDS)
+    entries, sequence = journal.snapshot()
+    journal.append(RECORDS)
+    assert len(entries) == 1
+    assert journal.appended == sequence + 1
+
+def test_flusher_writes_and_acknowledges(tmp_path, sqlite_path):
+    manager = ConnectionManager(lambda: hardness_db.connect_sqlite(sqlite_path))
+    journal = OfflineJournal(str(tmp_path / "journal.jsonl"))
+    written = []
+    flusher = JournalFlusher(journal, manager, batch_size=2, on_written=written.extend)
+    for _ in range(3):
+        journal.append(RECORDS)
+    assert flusher.flush_once() == 3
+    assert journal.pending_count() == 0
+    assert len(written) == 3
+    assert manager.run(lambda conn: conn.execute(f"SELECT COUNT(*) FROM {hardness_db.TABLE_NAME};").fetchone()[0]) == 6
+    manager.close()
+
+def test_unwritten_entries_skips_committed_but_unacknowledged(tmp_path, conn):
+    journal = OfflineJournal(str(tmp_path / "journal.jsonl"))
+    journal.append(RECORDS)
+    journal.append(RECORDS)
+    committed, waiting = journal.pending()
+    # The batch committed, but the acknowledgement was lost (e.g. the answer timed out)
+    hardness_db.apply_journal_entries(conn, [(committed['key'], journal_entry_records(committed))])
+    assert unwritten_entries(conn, journal.pending()) == [waiting]
+    assert unwritten_entries(conn, []) == []
@@ -0,0 +1,32 @@
+"""Sample selection and as-of limits of the report generator."""
+import numpy as np
+import pytest
+
+from report_generator import build_report_payloads, cumulative_limits, select_samples
+from spc_config import DEFAULT_LIMITS
+
+SAMPLES = [("ab", "123-ab", "2024-05-01 08:00:00"), ("AB", "124-ab", "2024-05-02 08:00:00"),
+           ("CD", "125-cd", "2024-05-03 08:00:00")]
+
+
+@pytest.mark.parametrize("technician", ["ab", "AB"])
+def test_technician_matches_in_any_case(technician):
+    assert select_samples(SAMPLES, technician=technician) == [0, 1]
+
+def test_sample_id_pattern():
+    assert select_samples(SAMPLES, sample_id="12[45]-*") == [1, 2]
+
+def test_limits_use_only_earlier_samples():
+    matrix = np.random.default_rng(3).normal(320.0, 5.0, (20, 12))
+    side_limits, position_limits = cumulative_limits(matrix)
+    assert np.isnan(side_limits['Bottom'][0]).all()
+    earlier = matrix[:10, :6]
+    mean_val, ucl, _ = side_limits['Bottom'][10]
+    assert mean_val == pytest.approx(earlier.mean())
+    assert ucl == pytest.approx(earlier.mean() + 3 * earlier.std(ddof=1))
+    assert position_limits['Top'][10][0][2] == pytest.approx(matrix[:10, 8].mean())
+
+def test_first_sample_uses_the_configured_defaults():
+    matrix = np.random.default_rng(3).normal(320.0, 5.0, (3, 12))
+    (_, _, sides), = build_report_payloads(SAMPLES, matrix, [0])
+    assert {side: limits for side, (_, limits, _, _) in sides.items()} == DEFAULT_LIMITS
@@ -0,0 +1,98 @@
+"""Rolling window, EWMA and CUSUM against straightforward recomputations."""
+import math
+import random
+import statistics
+
+import pytest
+
+from spc_modes import (CUSUM_H, CUSUM_K, EWMA_LAMBDA, EWMA_WIDTH, MODE_CUMULATIVE, MODE_CUSUM, MODE_EWMA,
+                       SideModeState, build_mode_states, update_mode_states)
+from spc_statistics import RunningStatistics
+from spc_subgroups import DEFAULT_SUBGROUP_SIZE
+
+BASELINE = RunningStatistics.from_summary(5000, 320.0, 6.0)
+SIGMA_XBAR = 6.0 / math.sqrt(DEFAULT_SUBGROUP_SIZE)
+
+
+def make_samples(count, seed=3, shift_after=None):
+    generator = random.Random(seed)
+    samples = []
+    for index in range(count):
+        center = 320.0 + (8.0 if shift_after is not None and index >= shift_after else 0.0)
+        samples.append([round(generator.gauss(center, 6.0), 1) for _ in range(DEFAULT_SUBGROUP_SIZE)])
+    return samples
+
+def fill(state, samples):
+    for sample in samples:
+        summary = RunningStatistics.from_values(sample)
+        state.add_sample(summary.count, summary.mean, summary.m2, BASELINE)
+    return state
+
+
+def test_rolling_window_keeps_the_last_samples():
+    samples = make_samples(137)
+    state = fill(SideModeState(window_samples=50), samples)
+    window = [value for sample in samples[-50:] for value in sample]
+    result = state.window_statistics()
+    assert result.count == len(window)
+    assert result.mean == pytest.approx(statistics.mean(window))
+    assert result.std_dev == pytest.approx(statistics.stdev(window))
+
+def test_rolling_window_before_it_is_full():
+    samples = make_samples(7)
+    result = fill(SideModeState(window_samples=50), samples).window_statistics()
+    assert result.std_dev == pytest.approx(statistics.stdev([value for sample in samples for value in sample]))
+    assert SideModeState().window_statistics().count == 0
+
+def test_ewma_matches_a_direct_loop():
+    samples = make_samples(40)
+    state = fill(SideModeState(), samples)
+    ewma = BASELINE.mean
+    for sample in samples:
+        ewma = EWMA_LAMBDA * statistics.mean(sample) + (1 - EWMA_LAMBDA) * ewma
+    assert state.ewma == pytest.approx(ewma)
+
+    center, ucl, lcl, (value,) = state.overlay(MODE_EWMA, BASELINE)
+    width = EWMA_WIDTH * SIGMA_XBAR * math.sqrt(EWMA_LAMBDA / (2 - EWMA_LAMBDA) * (1 - (1 - EWMA_LAMBDA) ** 80))
+    assert (center, ucl, lcl, value) == (320.0, pytest.approx(320.0 + width), pytest.approx(320.0 - width),
+                                         pytest.approx(ewma))
+
+def test_cusum_matches_a_direct_loop():
+    samples = make_samples(60, shift_after=30)
+    state = fill(SideModeState(), samples)
+    high = low = 0.0
+    signalled = False
+    for sample in samples:
+        sample_mean = statistics.mean(sample)
+        high = max(0.0, high + sample_mean - (320.0 + CUSUM_K * SIGMA_XBAR))
+        low = max(0.0, low + (320.0 - CUSUM_K * SIGMA_XBAR) - sample_mean)
+        signalled = signalled or high > CUSUM_H * SIGMA_XBAR
+    assert (state.cusum_high, state.cusum_low) == (pytest.approx(high), pytest.approx(low))
+    assert signalled # An 8 BHN shift is about 3.3 sigma_xbar
+
+    center, ucl, _, statistic_values = state.overlay(MODE_CUSUM, BASELINE)
+    assert ucl == pytest.approx(center + CUSUM_H * SIGMA_XBAR)
+    assert statistic_values == [pytest.approx(320.0 + high), pytest.approx(320.0 - low)]
+
+def test_overlay_includes_displayed_values_without_changing_the_state():
+    state = fill(SideModeState(), make_samples(5))
+    ewma = state.ewma
+    *_, (value,) = state.overlay(MODE_EWMA, BASELINE, current_values=[340.0] * 6)
+    assert value == pytest.approx(EWMA_LAMBDA * 340.0 + (1 - EWMA_LAMBDA) * ewma)
+    assert state.ewma == ewma and state.ewma_samples == 5
+    assert state.overlay(MODE_CUMULATIVE, BASELINE) is None
+    assert state.overlay(MODE_EWMA, None) is None
+
+def test_saved_records_match_restored_summaries():
+    samples = make_samples(12)
+    records = [("AB", f"{index}-a", side, position + 1, value)
+               for index, sample in enumerate(samples) for side in ('Bottom', 'Top')
+               for position, value in enumerate(sample)]
+    side_statistics = {'Bottom': BASELINE, 'Top': BASELINE}
+    updated = update_mode_states(build_mode_states({}, side_statistics), records, side_statistics)
+    summaries = [(len(sample), statistics.mean(sample), statistics.stdev(sample)) for sample in samples]
+    restored = build_mode_states({'Bottom': summaries, 'Top': summaries}, side_statistics)
+    for side in ('Bottom', 'Top'):
+        assert updated[side].ewma == pytest.approx(restored[side].ewma)
+        assert updated[side].cusum_high == pytest.approx(restored[side].cusum_high)
+        assert updated[side].window_statistics().std_dev == pytest.approx(restored[side].window_statistics().std_dev)
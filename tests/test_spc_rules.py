@@ -0,0 +1,64 @@
+"""Nelson rules on crafted series (mean 0, sigma 1, so values are z-scores)."""
+import pytest
+
+from spc_rules import RULE_DESCRIPTIONS, describe_violations, evaluate_new_points, evaluate_rules, violating_indices
+
+
+def found(values, rule):
+    return evaluate_rules(values, 0.0, 1.0, rules=(rule,))[rule].tolist()
+
+
+@pytest.mark.parametrize("rule, series, expected", [
+    (1, [0.0, 0.5, 3.5, 0.0, -3.2], [2, 4]),
+    (1, [0.0, 2.9, -2.9], []),
+    (2, [0.5] * 9, [8]),
+    (2, [-0.5] * 10, [8, 9]),
+    (2, [0.5] * 8 + [-0.5], []),
+    (3, [-0.5, -0.3, -0.1, 0.1, 0.3, 0.5], [5]),
+    (3, [0.5, 0.3, 0.1, -0.1, -0.3, -0.5], [5]),
+    (3, [-0.5, -0.3, -0.1, -0.1, 0.3, 0.5], []),
+    (4, [0.5, -0.5] * 7, [13]),
+    (4, [0.5, -0.5] * 6 + [0.5], []),
+    (5, [0.0, 2.5, 0.0, 2.5], [3]),
+    (5, [0.0, -2.5, -2.5], [2]),
+    (5, [2.5, -2.5, 0.0], []),
+    (6, [1.5, 1.5, 0.0, 1.5, 1.5], [4]),
+    (6, [-1.5, -1.5, -1.5, 0.0, -1.5], [4]),
+    (6, [1.5, 1.5, 0.0, -1.5, 1.5], []),
+    (7, [0.5, -0.5, 0.0] * 5, [14]),
+    (7, [0.5, -0.5, 0.0] * 4 + [0.5, 1.5], []),
+    (8, [1.5, -1.5] * 4, [7]),
+    (8, [1.5] * 8, []), # All on one side is rule 2/6, not 8
+    (8, [1.5, -1.5] * 3 + [0.5, 1.5], []),
+])
+def test_each_rule_on_a_crafted_series(rule, series, expected):
+    assert found(series, rule) == expected
+
+def test_all_rules_are_known():
+    assert sorted(RULE_DESCRIPTIONS) == list(range(1, 9))
+    with pytest.raises(ValueError):
+        evaluate_rules([0.0], 0.0, 1.0, rules=(9,))
+
+def test_no_sigma_reports_nothing():
+    results = evaluate_rules([5.0] * 20, 0.0, 0.0)
+    assert violating_indices(results).size == 0
+
+def test_new_points_use_the_history_as_context():
+    # The ninth point above the mean completes rule 2 with the eight before it
+    results = evaluate_new_points([0.5] * 8, [0.5, 0.2], 0.0, 1.0)
+    assert results[2].tolist() == [0, 1]
+    # Violations inside the history itself are not reported again
+    results = evaluate_new_points([5.0] + [0.0] * 3, [0.0], 0.0, 1.0)
+    assert violating_indices(results).size == 0
+
+def test_new_points_match_the_full_series():
+    series = [0.5, -0.5] * 10 + [2.5, 2.5, 0.5, 3.5]
+    full = evaluate_rules(series, 0.0, 1.0)
+    split = 17
+    new = evaluate_new_points(series[:split], series[split:], 0.0, 1.0)
+    for rule in RULE_DESCRIPTIONS:
+        assert (new[rule] + split).tolist() == [index for index in full[rule].tolist() if index >= split]
+
+def test_descriptions_use_the_labels():
+    results = evaluate_rules([0.0, 3.5], 0.0, 1.0, rules=(1,))
+    assert describe_violations(results, ["Bottom 1", "Bottom 2"]) == ["Bottom 2: One point beyond 3 sigma (rule 1)"]
@@ -0,0 +1,62 @@
+"""RunningStatistics and the limits snapshot."""
+import random
+import statistics
+
+import pytest
+
+from spc_statistics import (RunningStatistics, build_position_statistics_from_aggregates, load_statistics_snapshot,
+                            position_control_limits, save_statistics_snapshot, side_statistics_from_positions,
+                            update_position_statistics)
+
+VALUES = [round(random.Random(7).gauss(320.0, 6.0), 1) for _ in range(200)]
+
+
+def test_batched_updates_match_statistics():
+    running = RunningStatistics()
+    for start in range(0, len(VALUES), 12):
+        running.update(VALUES[start:start + 12])
+    assert running.count == len(VALUES)
+    assert running.mean == pytest.approx(statistics.mean(VALUES))
+    assert running.std_dev == pytest.approx(statistics.stdev(VALUES))
+
+def test_merge_of_disjoint_parts():
+    merged = RunningStatistics.from_values(VALUES[:37]).merge(RunningStatistics.from_values(VALUES[37:]))
+    assert merged.std_dev == pytest.approx(statistics.stdev(VALUES))
+    assert RunningStatistics().merge(merged).std_dev == pytest.approx(merged.std_dev)
+    assert merged.copy().merge(RunningStatistics()).mean == pytest.approx(merged.mean)
+
+def test_from_summary_round_trips():
+    summary = RunningStatistics.from_summary(len(VALUES), statistics.mean(VALUES), statistics.stdev(VALUES))
+    assert summary.variance == pytest.approx(statistics.variance(VALUES))
+    assert RunningStatistics.from_summary(1, 320.0, None).control_limits() == (None, None, None)
+
+def test_control_limits_are_three_sigma():
+    mean_val, ucl, lcl = RunningStatistics.from_values(VALUES).control_limits()
+    std_dev = statistics.stdev(VALUES)
+    assert (ucl - mean_val, mean_val - lcl) == (pytest.approx(3 * std_dev), pytest.approx(3 * std_dev))
+
+def test_positions_merge_into_sides():
+    position_statistics = build_position_statistics_from_aggregates({})
+    records = [("AB", "123-ab", 'Bottom', index % 6 + 1, value) for index, value in enumerate(VALUES)]
+    update_position_statistics(position_statistics, records)
+    side = side_statistics_from_positions(position_statistics)['Bottom']
+    assert side.std_dev == pytest.approx(statistics.stdev(VALUES))
+    means, _, _ = position_control_limits(position_statistics, 'Bottom')
+    assert means[0] == pytest.approx(statistics.mean(VALUES[0::6]))
+    assert position_control_limits(position_statistics, 'Top')[0] == [None] * 6
+
+def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    position_statistics = build_position_statistics_from_aggregates({('Bottom', 1): (3, 320.0, 2.5),
+                                                                     ('Top', 6): (1, 330.0, None)})
+    save_statistics_snapshot(path, position_statistics)
+    loaded = load_statistics_snapshot(path)
+    assert loaded[('Bottom', 1)].std_dev == pytest.approx(2.5)
+    assert (loaded[('Top', 6)].count, loaded[('Top', 6)].std_dev) == (1, None)
+    assert loaded[('Top', 1)].count == 0
+
+def test_missing_or_damaged_snapshot(tmp_path):
+    path = tmp_path / "snapshot.json"
+    assert load_statistics_snapshot(str(path)) is None
+    path.write_text("{not json", encoding='utf-8')
+    assert load_statistics_snapshot(str(path)) is None
@@ -0,0 +1,78 @@
+"""Import side effects and the background startup load of the window module (no display needed)."""
+import importlib.util
+import os
+import runpy
+from datetime import datetime
+
+import pytest
+
+import hardness_db
+from offline_journal import journal_entry_records
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Hardness_UI_Application.py")
+
+RECORDS = [("AB", "123-ab", 'Bottom', 1, 321.0), ("AB", "123-ab", 'Top', 1, 331.0)]
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch, sqlite_path):
+    """The window module, configured for sqlite_path, with its services created but not started."""
+    pytest.importorskip("tkinter")
+    monkeypatch.chdir(tmp_path)
+    spec = importlib.util.spec_from_file_location("hardness_ui_under_test", APP_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.DB_BACKEND = hardness_db.BACKEND_SQLITE
+    module.SQLITE_DATABASE_PATH = sqlite_path
+    module.start_services()
+    yield module
+    module._db_manager.close()
+
+
+def test_import_leaves_the_journal_alone(tmp_path, monkeypatch):
+    pytest.importorskip("tkinter")
+    monkeypatch.chdir(tmp_path)
+    journal_path = tmp_path / "hardness_journal.jsonl"
+    torn = b'{"key": "a", "records": []}\n{"key": "b", "rec'
+    journal_path.write_bytes(torn)
+
+    # Windows starts capability pool workers by running the main script again under this name
+    namespace = runpy.run_path(APP_PATH, run_name="__mp_main__")
+
+    assert journal_path.read_bytes() == torn # The torn tail is only cut when the app itself starts
+    assert sorted(os.listdir(tmp_path)) == ["hardness_journal.jsonl"]
+    assert namespace['_journal'] is None and namespace['_db_manager'] is None
+    assert namespace['JOURNAL_PATH'] == "hardness_journal.jsonl"
+
+def test_startup_load_returns_the_journal_read_with_the_aggregates(app, monkeypatch):
+    timestamp = datetime(2024, 5, 1, 8, 0, 0)
+    committed = app._journal.append(RECORDS, timestamp)
+    # Committed by an earlier session whose acknowledgement was lost
+    entry, = app._journal.pending()
+    app._db_manager.run(lambda conn: hardness_db.apply_journal_entries(conn, [(committed, journal_entry_records(entry))]))
+    waiting = app._journal.append(RECORDS, timestamp)
+
+    def unreachable():
+        raise OSError("database unreachable")
+    monkeypatch.setattr(app._flusher, 'flush_once', unreachable)
+
+    aggregates, _, _, entries, sequence = app.load_startup_data()
+    assert aggregates[('Bottom', 1)][0] == 1 # Only the committed sample
+    assert [entry['key'] for entry in entries] == [waiting]
+    assert sequence == app._journal.appended
+
+def test_saves_during_the_load_are_counted_once(app, monkeypatch):
+    monkeypatch.setattr(app, 'update_plot', lambda *args, **kwargs: None) # No window
+    monkeypatch.setattr(app._flusher, 'start', lambda: None)
+    app._db_manager.run(lambda conn: hardness_db.insert_readings(conn, RECORDS))
+    app._journal.append(RECORDS) # Journaled before the load's snapshot...
+    app._loading_statistics = True
+    app._statistics_saves_while_loading = [(app._journal.appended, RECORDS)] # ...and buffered by save_to_database()
+    monkeypatch.setattr(app._flusher, 'flush_once', lambda: None)
+    result = app.load_startup_data()
+    app._journal.append(RECORDS) # Saved after the snapshot
+    app._statistics_saves_while_loading.append((app._journal.appended, RECORDS))
+
+    app.on_startup_data_loaded(result)
+    assert app._side_statistics['Bottom'].count == 3 # Database, journal snapshot, later save
+    assert app._statistics_saves_while_loading is None